@@ -10,20 +10,18 @@ MCP Stock Analysis Server + Visualization + Console Output
 """
 
 from __future__ import annotations
-import os, sys
+import os, sys, threading
 from datetime import datetime
 from typing import Any, Dict, List, Optional, Tuple
-import feedparser, yfinance as yf
-from transformers import pipeline
-from langgraph.graph import StateGraph, END
+import feedparser
 from fastmcp import FastMCP
+# yfinance/pandas, langgraph and transformers/torch are imported on first use (fast MCP handshake)
 from rich.console import Console
 from rich.table import Table
 from rich.panel import Panel
 from rich.theme import Theme
 from rich import box
 from rich.traceback import install as rich_traceback
-import matplotlib.pyplot as plt
 
 # ---- Setup ----
 rich_traceback(show_locals=False)
@@ -39,19 +37,39 @@ EMBED_MODEL = os.getenv("EMBED_MODEL","sentence-transformers/all-MiniLM-L6-v2")
 SENTIMENT_MODEL = os.getenv("SENTIMENT_MODEL",None)
 DEVICE = os.getenv("DEVICE","cpu").lower()
 
-if DEVICE in ("cuda","mps"):
-    generator_pipeline = pipeline("text2text-generation", model=GEN_MODEL, device_map="auto")
-    critic_pipeline = pipeline("text2text-generation", model=CRITIC_MODEL, device_map="auto")
-    embed_pipeline = pipeline("feature-extraction", model=EMBED_MODEL, device_map="auto")
-else:
-    generator_pipeline = pipeline("text2text-generation", model=GEN_MODEL)
-    critic_pipeline = pipeline("text2text-generation", model=CRITIC_MODEL)
-    embed_pipeline = pipeline("feature-extraction", model=EMBED_MODEL)
-
-sentiment_pipeline = pipeline("sentiment-analysis", model=SENTIMENT_MODEL) if SENTIMENT_MODEL else pipeline("sentiment-analysis")
+class LazyPipeline:
+    """Stand-in for a transformers pipeline; loads on first use, one instance per (task, model)."""
+    _loaded: Dict[Tuple[str,Optional[str]],Any] = {}
+    _lock = threading.Lock()
+    def __init__(self, task, model=None, **kwargs):
+        self.task, self.model_name, self.kwargs = task, model, kwargs
+    def load(self):
+        key = (self.task, self.model_name)
+        with self._lock:
+            if key not in self._loaded:
+                from transformers import pipeline
+                self._loaded[key] = pipeline(self.task, model=self.model_name, **self.kwargs) if self.model_name else pipeline(self.task, **self.kwargs)
+        return self._loaded[key]
+    def __call__(self, *args, **kwargs):
+        return self.load()(*args, **kwargs)
+    def __getattr__(self, name):
+        return getattr(self.load(), name)
+
+# One instance per checkpoint: the critic reuses the drafter's weights unless CRITIC_MODEL differs.
+# (No embedding model is loaded here -- this variant never embeds.)
+_gen_kwargs = {"device_map":"auto"} if DEVICE in ("cuda","mps") else {}
+generator_pipeline = LazyPipeline("text2text-generation", GEN_MODEL, **_gen_kwargs)
+critic_pipeline = LazyPipeline("text2text-generation", CRITIC_MODEL, **_gen_kwargs)
+
+sentiment_pipeline = LazyPipeline("sentiment-analysis", SENTIMENT_MODEL)
 mcp = FastMCP("investment-analysis-langgraph")
 
 # ---- Visualization helpers ----
+def pyplot():
+    # matplotlib is only needed for charts; importing it lazily keeps stdio startup fast
+    import matplotlib.pyplot as plt
+    return plt
+
 def ensure_dir(path="visuals"):
     if not os.path.exists(path):
         os.makedirs(path)
@@ -59,6 +77,7 @@ def ensure_dir(path="visuals"):
 
 def plot_price_history(ticker, history):
     if not history or "Date" not in history: return
+    plt = pyplot()
     path = ensure_dir()
     plt.figure(figsize=(6,3))
     plt.plot(history["Date"], history["Close"], linewidth=2)
@@ -74,6 +93,7 @@ def plot_sentiment_pie(ticker, sentiments):
     for s in sentiments:
         counts[s["sentiment"]] = counts.get(s["sentiment"],0)+1
     labels,vals = list(counts.keys()), list(counts.values())
+    plt = pyplot()
     path = ensure_dir()
     plt.figure(figsize=(4,4))
     plt.pie(vals,labels=labels,autopct="%1.0f%%",colors=["green","red","gray"])
@@ -83,6 +103,7 @@ def plot_sentiment_pie(ticker, sentiments):
     console.print(f"[ok] Saved sentiment chart: {fname}")
 
 def plot_portfolio_summary(results):
+    plt = pyplot()
     path = ensure_dir()
     tickers=list(results.keys())
     pos=[v.get("sentiment_counts",{}).get("positive",0) for v in results.values()]
@@ -100,6 +121,7 @@ def plot_portfolio_summary(results):
 # ---- Data fetch ----
 def fetch_price_and_history(ticker):
     try:
+        import yfinance as yf
         stock=yf.Ticker(ticker)
         hist=stock.history(period="1y")
         if hist.empty: return None,None
@@ -111,7 +133,9 @@ def fetch_price_and_history(ticker):
         console.print(f"[warn] price fetch fail: {e}"); return None,None
 
 def fetch_pe_ratio(ticker):
-    try: return float(yf.Ticker(ticker).info.get("trailingPE","N/A"))
+    try:
+        import yfinance as yf
+        return float(yf.Ticker(ticker).info.get("trailingPE","N/A"))
     except Exception: return "N/A"
 
 def fetch_news(ticker,max_headlines=5):
@@ -156,6 +180,7 @@ def render_news_table(news,sentiments):
 
 # ---- LangGraph ----
 def build_graph(ticker,max_headlines=5):
+    from langgraph.graph import StateGraph, END
     g=StateGraph(dict)
     def fetch_node(s):
         price,history=fetch_price_and_history(ticker)
@@ -4,7 +4,6 @@ import matplotlib.pyplot as plt
 from datetime import datetime
 from collections import Counter
 import os
-from wordcloud import WordCloud
 from matplotlib.backends.backend_pdf import PdfPages
 
 LOG_FILE = "workflow_log.jsonl"
@@ -111,6 +110,8 @@ def plot_news_wordcloud(ax, steps, symbol):
         ax.text(0.5, 0.5, "⚠️ No news data found.", ha="center", va="center")
         return
 
+    from wordcloud import WordCloud  # optional and slow to import; only needed here
+
     text = " ".join(headlines)
     wc = WordCloud(width=800, height=400, background_color="white").generate(text)
     ax.imshow(wc, interpolation="bilinear")
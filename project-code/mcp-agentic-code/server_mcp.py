@@ -31,16 +31,16 @@ from __future__ import annotations
 
 import os
 import sys
+import threading
 from datetime import datetime
 from typing import Any, Dict, List, Optional, Tuple
 
 import feedparser
-import yfinance as yf
-from transformers import pipeline
-
-from langgraph.graph import StateGraph, END
 from fastmcp import FastMCP
 
+# Heavy subsystems (yfinance/pandas, langgraph, transformers/torch) are imported where
+# they are first used, so the MCP handshake is answered quickly.
+
 # ---- Pretty CLI (Rich) ----
 from rich.console import Console
 from rich.table import Table
@@ -89,16 +89,44 @@ DEVICE = os.getenv("DEVICE", "cpu").lower()
 
 task = "text2text-generation"
 
-if DEVICE in ("cuda", "mps"):
-    generator_pipeline = pipeline(task, model=GEN_MODEL, device_map="auto")
-else:
-    generator_pipeline = pipeline(task, model=GEN_MODEL)
 
-sentiment_pipeline = (
-    pipeline("sentiment-analysis", model=SENTIMENT_MODEL)
-    if SENTIMENT_MODEL
-    else pipeline("sentiment-analysis")
-)
+class LazyPipeline:
+    """
+    Cheap, import-time stand-in for a transformers pipeline.
+
+    The real pipeline (and transformers/torch themselves) load on the first call or
+    attribute access; handles for the same (task, model) share one instance.
+    """
+
+    _loaded: Dict[Tuple[str, Optional[str]], Any] = {}
+    _lock = threading.Lock()
+
+    def __init__(self, task: str, model: Optional[str] = None, **kwargs: Any) -> None:
+        self.task = task
+        self.model_name = model
+        self.kwargs = kwargs
+
+    def load(self) -> Any:
+        key = (self.task, self.model_name)
+        with self._lock:
+            if key not in self._loaded:
+                from transformers import pipeline
+
+                if self.model_name:
+                    self._loaded[key] = pipeline(self.task, model=self.model_name, **self.kwargs)
+                else:
+                    self._loaded[key] = pipeline(self.task, **self.kwargs)
+        return self._loaded[key]
+
+    def __call__(self, *args: Any, **kwargs: Any) -> Any:
+        return self.load()(*args, **kwargs)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.load(), name)
+
+
+generator_pipeline = LazyPipeline(task, GEN_MODEL, **({"device_map": "auto"} if DEVICE in ("cuda", "mps") else {}))
+sentiment_pipeline = LazyPipeline("sentiment-analysis", SENTIMENT_MODEL)
 
 
 # ===========================
@@ -147,6 +175,8 @@ def fetch_price_and_history(ticker: str) -> Tuple[Optional[Dict[str, Any]], Opti
             history_dict: dict of period→{start,end} for "1 Day" | "1 Week" | "1 Month" | "1 Year" or None
     """
     try:
+        import yfinance as yf  # deferred: pulls in pandas
+
         stock = yf.Ticker(ticker)
         hist = stock.history(period="1y")
         if hist.empty:
@@ -187,6 +217,8 @@ def fetch_pe_ratio(ticker: str) -> float | str:
         P/E as float if available, else "N/A".
     """
     try:
+        import yfinance as yf
+
         stock = yf.Ticker(ticker)
         pe = stock.info.get("trailingPE", "N/A")
         return float(pe) if pe and pe != "N/A" else "N/A"
@@ -215,6 +247,33 @@ def fetch_news(ticker: str, max_headlines: int = 5) -> List[Dict[str, Optional[s
         return [{"title": f"No recent news for {ticker}", "link": None}]
 
 
+SENTIMENT_BATCH_SIZE = int(os.getenv("SENTIMENT_BATCH_SIZE", "32"))
+
+
+def _classify_batched(titles: List[str], batch_size: int = SENTIMENT_BATCH_SIZE) -> List[Any]:
+    """
+    Run the sentiment pipeline over `titles` in length-sorted batches (minimal padding).
+
+    Returns:
+        One pipeline result dict per title, in input order, or the Exception raised for
+        that title (a failing batch is retried item by item).
+    """
+    results: List[Any] = [None] * len(titles)
+    order = sorted(range(len(titles)), key=lambda i: len(titles[i]))
+    for start in range(0, len(order), max(1, batch_size)):
+        bucket = order[start:start + batch_size]
+        try:
+            for i, out in zip(bucket, sentiment_pipeline([titles[i] for i in bucket], batch_size=len(bucket))):
+                results[i] = out
+        except Exception:
+            for i in bucket:
+                try:
+                    results[i] = sentiment_pipeline(titles[i])[0]
+                except Exception as e:
+                    results[i] = e
+    return results
+
+
 def classify_sentiment(news_items: List[Dict[str, str]] | None) -> List[Dict[str, Any]]:
     """
     Apply a sentiment classifier to each news title.
@@ -225,25 +284,24 @@ def classify_sentiment(news_items: List[Dict[str, str]] | None) -> List[Dict[str
     Returns:
         List of {"title": str, "sentiment": str, "score": float, ["error": str]}
     """
+    titles = [item.get("title", "") for item in news_items or []]
     results: List[Dict[str, Any]] = []
-    for item in news_items or []:
-        text = item.get("title", "")
-        try:
-            sentiment = sentiment_pipeline(text)[0]
+    for text, out in zip(titles, _classify_batched(titles)):
+        if isinstance(out, Exception):  # pragma: no cover
             results.append(
                 {
                     "title": text,
-                    "sentiment": sentiment["label"].lower(),
-                    "score": float(sentiment["score"]),
+                    "sentiment": "unknown",
+                    "score": 0.0,
+                    "error": str(out),
                 }
             )
-        except Exception as e:  # pragma: no cover
+        else:
             results.append(
                 {
                     "title": text,
-                    "sentiment": "unknown",
-                    "score": 0.0,
-                    "error": str(e),
+                    "sentiment": out["label"].lower(),
+                    "score": float(out["score"]),
                 }
             )
     return results
@@ -459,6 +517,8 @@ def build_graph(ticker: str, max_headlines: int = 5):
     Returns:
         A compiled LangGraph workflow callable via `invoke({})`.
     """
+    from langgraph.graph import StateGraph, END
+
     graph = StateGraph(dict)
 
     def fetch_node(state: Dict[str, Any]) -> Dict[str, Any]:
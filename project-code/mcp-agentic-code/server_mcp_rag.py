@@ -12,11 +12,15 @@ What this adds
   3) We ask the LLM to classify sentiment **with retrieved context** and return a label+rationale.
   4) We **upsert** the new (headline, ticker, label, score, time) back into the vector DB for future runs.
 
-If ChromaDB isn't installed, we gracefully fall back to the original classifier-only flow.
+If ChromaDB isn't installed (or fails to start), the store runs on an in-process NumPy index
+with a SQLite metadata table; without either, we fall back to the original classifier-only flow.
 
 Transports:
-- `stdio` (default): suitable for local MCP clients (e.g., Claude Desktop)
-- `http` / `sse`: optional network transports (health route provided if Starlette is available)
+- `stdio` (default): suitable for local MCP clients (e.g., Claude Desktop). `analyze_stock`
+  streams draft/critique/final tokens as log + progress notifications while it runs.
+- `http` / `sse`: optional network transports. If Starlette is available, `/health` and
+  `/health/live` are liveness probes and `/health/ready` returns 503 until a background
+  warm-up has run one inference through every model and store.
 
 Example usage:
     uv pip install rich yfinance feedparser transformers chromadb  # (chromadb is optional but recommended)
@@ -24,30 +28,102 @@ Example usage:
     python server.py stdio      # run MCP server over stdio (no stdout logs!)
     python server.py http       # run MCP server over HTTP (host/port via env)
     python server.py sse        # run MCP server over SSE (host/port via env)
+    python server.py onnx-parity [onnx|onnx-int8]   # ONNX vs PyTorch encoder parity + throughput
+    python server.py gen-bench [fp32,bf16,dynamic-int8]  # generator tokens/sec + agreement vs fp32
+    python server.py profile-startup [server.py]    # import-time breakdown per subsystem
+    python server.py knn-eval [2000]                # kNN sentiment vs stored labels / base classifier
+    python server.py train-head [head.npz]          # retrain the embedding sentiment head from the store
+    python server.py vstore-migrate-ids             # collapse duplicate headlines onto content-addressed ids
+    python server.py vstore-compact                 # apply vector store retention; size + query p95 before/after
+    python server.py vstore-partition               # split the store into per-ticker collections
+    python server.py vstore-bench [10000,100000,1000000]  # insert/query latency per vector backend
 
 Environment:
     GEN_MODEL          (default: google/flan-t5-base; text2text-generation)
     CRITIC_MODEL       (optional; defaults to GEN_MODEL)
     EMBED_MODEL        (default: sentence-transformers/all-MiniLM-L6-v2)
+    EMBED_BATCH_SIZE   (texts per embedding forward pass; default 64)
+    EMBED_CACHE_DIR    (memory-mapped embedding cache shared across runs and worker processes;
+                       default ./cache/embeddings, empty disables)
+    EMBED_CACHE_DTYPE  ("float32" | "float16"; default "float32") storage precision of that cache
     SENTIMENT_MODEL    (optional; transformers pipeline default if unset)
+                       (all models load lazily on first use; see the `server_stats` tool)
     DEVICE             ("cpu" | "cuda" | "mps"; default "cpu")
+    ENCODER_BACKEND    ("torch" | "onnx" | "onnx-int8"; default "torch") runtime for the
+                       sentiment and embedding encoders; onnx* needs `optimum[onnxruntime]`
+    ONNX_CACHE         (directory for exported ONNX encoders; default ./onnx_cache)
+    GEN_PRECISION      ("fp32" | "bf16" | "dynamic-int8"; default "fp32") drafter weights
+    CRITIC_PRECISION   (optional; defaults to GEN_PRECISION)
+    GEN_CACHE_PATH     (SQLite file caching deterministic generations; default ./cache/generations.sqlite)
+    GEN_CACHE_MAX_ENTRIES (LRU bound for that cache; default 20000, 0 disables)
+    GEN_MODEL_REVISION (optional model revision tag, part of the generation cache key)
+    SENTIMENT_BATCH_SIZE (headlines per classifier forward pass; default 32)
+    SENTIMENT_CACHE_PATH (SQLite file caching per-headline labels and RAG relabels;
+                       default ./cache/sentiment.sqlite)
+    SENTIMENT_CACHE_MAX_ENTRIES, SENTIMENT_CACHE_TTL_S
+                       (LRU bound per table, default 50000, 0 disables; entry lifetime,
+                       default 259200 = 3 days, 0 = no expiry)
+    RAG_ESCALATE_SCORE, RAG_AGREE_MIN
+                       (skip the LLM relabel when the base score is >= the first and the
+                       distance-weighted neighbour share for that label is >= the second;
+                       defaults 0.9 / 0.6)
+    SENTIMENT_MODE     ("rag" | "knn" | "head"; default "rag") knn labels headlines by a
+                       distance-weighted vote of stored neighbours, falling back to the base
+                       classifier; head replaces the classifier with a logistic-regression head
+                       over the MiniLM embedding (see train-head)
+    SENTIMENT_HEAD_PATH (trained head for SENTIMENT_MODE=head; default ./cache/sentiment_head.npz)
+    KNN_K, KNN_MIN_SUPPORT, KNN_MAX_DISTANCE
+                       (neighbours per vote, default 15; minimum effective voters, default 3;
+                       squared-L2 cut-off for voters, default 0 = none)
+    RAG_RELABEL        ("packed" | "batch" | "single"; default "packed") how a ticker's ambiguous
+                       headlines are relabelled: one prompt listing them all, one padded
+                       generator batch, or one generator call each
+    GEN_BATCH_WINDOW_MS, GEN_BATCH_MAX
+                       (http/sse only: micro-batch generator calls arriving within the window,
+                       up to max per batch; defaults 25 ms / 8, window 0 disables)
+    REPEAT_STOP        (per-node loop detection, "<node>=<repeats>x<max_period>" or "<node>=off";
+                       nodes: draft, critique, final, rag, default; default "default=2x48,rag=2x24")
     CHROMA_PATH        (directory for Chroma persistence; default ./rag_store)
+    VSTORE_BACKEND     (auto | chroma | numpy; auto uses Chroma and falls back to the in-process
+                       NumPy + SQLite store when chromadb is missing or fails to start; default auto)
+    VSTORE_WRITE_BATCH, VSTORE_WRITE_DELAY_MS
+                       (write-behind for headline upserts: a single background writer flushes
+                       once this many are queued or the oldest has waited this long; queued
+                       headlines are visible to queries meanwhile; defaults 64 / 2000, batch
+                       <= 1 writes synchronously)
+    VSTORE_PARTITION, VSTORE_PARTITION_MIN_DOCS
+                       ("ticker" keeps one Chroma collection per ticker next to the shared one;
+                       ticker queries search only their partition and merge in shared results
+                       while it holds fewer than MIN_DOCS headlines; run vstore-partition once
+                       to split an existing store; defaults "none" / 20)
+    VSTORE_MAX_AGE_DAYS, VSTORE_MAX_PER_TICKER
+                       (vector store retention applied by vstore-compact: drop headlines not seen
+                       for that many days, keep the most recently seen per ticker; defaults
+                       180 / 2000, 0 = unlimited; seed docs are always kept)
     HOST, PORT         (for http/sse transports; default 0.0.0.0:8000)
 """
 
 from __future__ import annotations
 
+import asyncio
+import atexit
+import hashlib
+import json
 import os
+import queue
+import re
 import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from contextvars import ContextVar
 from datetime import datetime
-from typing import Any, Dict, List, Optional, Tuple
+from importlib.util import find_spec
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 import feedparser
-import yfinance as yf
-from transformers import pipeline
-
-from langgraph.graph import StateGraph, END
-from fastmcp import FastMCP
+from fastmcp import Context, FastMCP
 
 # ---- Pretty CLI (Rich) ----
 from rich.console import Console
@@ -57,25 +133,19 @@ from rich.theme import Theme
 from rich import box
 from rich.traceback import install as rich_traceback
 
-# Optional vector DB (Chroma)
-CHROMA_AVAILABLE = True
-try:
-    import chromadb
-    from chromadb.utils.embedding_functions import EmbeddingFunction
-except Exception:
-    CHROMA_AVAILABLE = False
+# Heavy subsystems (yfinance/pandas, langgraph, chromadb, transformers/torch) are
+# imported where they are first used, so a stdio server answers the MCP handshake
+# quickly. `python server.py profile-startup` shows what importing still costs.
 
-# Optional: numpy for mean pooling (recommended)
-try:
-    import numpy as np
-except Exception:
-    np = None  # we will degrade to pure-Python pooling if needed
+# Optional vector DB (Chroma) -- only probe for it here; it is imported on first use
+CHROMA_AVAILABLE = find_spec("chromadb") is not None
+NUMPY_AVAILABLE = find_spec("numpy") is not None  # in-process vector store fallback
 
 # For HTTP/SSE health route (only needed for http/sse transports)
 try:
-    from starlette.responses import PlainTextResponse
+    from starlette.responses import JSONResponse, PlainTextResponse
 except Exception:  # pragma: no cover - optional dependency
-    PlainTextResponse = None  # type: ignore
+    JSONResponse = PlainTextResponse = None  # type: ignore
 
 
 # ===========================
@@ -109,23 +179,323 @@ CRITIC_MODEL = os.getenv("CRITIC_MODEL", GEN_MODEL)
 EMBED_MODEL = os.getenv("EMBED_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
 SENTIMENT_MODEL = os.getenv("SENTIMENT_MODEL", None)
 DEVICE = os.getenv("DEVICE", "cpu").lower()
+# Runtime for the sentiment/embedding encoders: "torch" | "onnx" | "onnx-int8"
+ENCODER_BACKEND = os.getenv("ENCODER_BACKEND", "torch").lower()
+ONNX_CACHE = os.getenv("ONNX_CACHE", "./onnx_cache")
+# Weight precision for the drafter / critic: "fp32" | "bf16" | "dynamic-int8"
+GEN_PRECISIONS = ("fp32", "bf16", "dynamic-int8")
+GEN_PRECISION = os.getenv("GEN_PRECISION", "fp32").lower()
+CRITIC_PRECISION = os.getenv("CRITIC_PRECISION", GEN_PRECISION).lower()
+for _name, _value in (("GEN_PRECISION", GEN_PRECISION), ("CRITIC_PRECISION", CRITIC_PRECISION)):
+    if _value not in GEN_PRECISIONS:
+        raise ValueError(f"{_name}={_value!r}; expected one of {', '.join(GEN_PRECISIONS)}")
+
+_PROCESS_T0 = time.perf_counter()
+
+# What `pipeline("sentiment-analysis")` picks when no model is given; named explicitly
+# so the weights can be cached and shared like every other checkpoint.
+DEFAULT_SENTIMENT_MODEL = "distilbert/distilbert-base-uncased-finetuned-sst-2-english"
+
+# transformers Auto* class that holds the weights for each pipeline task
+_AUTO_CLASSES = {
+    "text2text-generation": "AutoModelForSeq2SeqLM",
+    "feature-extraction": "AutoModel",
+    "sentiment-analysis": "AutoModelForSequenceClassification",
+}
+
+# optimum.onnxruntime counterparts for the encoder tasks (ENCODER_BACKEND=onnx*)
+_ORT_CLASSES = {
+    "feature-extraction": "ORTModelForFeatureExtraction",
+    "sentiment-analysis": "ORTModelForSequenceClassification",
+}
+
+# `variant` selects how the weights are served: "torch", "onnx" or "onnx-int8" for the
+# encoders, a GEN_PRECISIONS entry for the generators
+PipelineKey = Tuple[str, Optional[str], str, str]  # (task, model, device, variant)
+WeightsKey = Tuple[str, str, str, str]  # (checkpoint, model class, device, variant)
+
+
+def _rss_mb() -> float:
+    """
+    Resident set size of this process in MiB (0.0 if it cannot be determined).
+    """
+    try:
+        with open("/proc/self/statm") as fh:
+            pages = int(fh.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except Exception:
+        try:
+            import resource
+
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return peak / (2**20 if sys.platform == "darwin" else 2**10)  # bytes on macOS, KiB elsewhere
+        except Exception:
+            return 0.0
+
+
+def _load_onnx_model(checkpoint: str, model_class: str, quantize: bool = False) -> Any:
+    """
+    Load an encoder as an ONNX Runtime model (optimum), exporting it on first use.
+
+    Exports are cached under ONNX_CACHE so later starts skip the export. With
+    `quantize`, the exported graph gets dynamic int8 quantization (weights int8,
+    activations quantized on the fly), which needs no calibration data.
+    The returned model is a drop-in for transformers pipelines.
+    """
+    import optimum.onnxruntime as ort
+
+    cls = getattr(ort, model_class)
+    base_dir = os.path.join(ONNX_CACHE, checkpoint.replace("/", "__"))
+    if not os.path.exists(os.path.join(base_dir, "model.onnx")):
+        console.print(f"[muted]Exporting {checkpoint} to ONNX ({base_dir})…[/]")
+        cls.from_pretrained(checkpoint, export=True).save_pretrained(base_dir)
+    if not quantize:
+        return cls.from_pretrained(base_dir)
+
+    int8_dir = base_dir + "-int8"
+    if not os.path.exists(os.path.join(int8_dir, "model_quantized.onnx")):
+        import platform
+
+        from optimum.onnxruntime.configuration import AutoQuantizationConfig
+
+        arm = platform.machine().lower() in ("arm64", "aarch64")
+        qconfig = (AutoQuantizationConfig.arm64 if arm else AutoQuantizationConfig.avx2)(
+            is_static=False, per_channel=False
+        )
+        ort.ORTQuantizer.from_pretrained(base_dir).quantize(save_dir=int8_dir, quantization_config=qconfig)
+    return cls.from_pretrained(int8_dir, file_name="model_quantized.onnx")
+
+
+def _load_torch_model(checkpoint: str, model_class: str, device: str, precision: str) -> Any:
+    """
+    Load a PyTorch model in the requested precision.
+
+    "bf16" loads the weights as bfloat16 (about half the memory; fast on CPUs with
+    AVX512-BF16/AMX and on recent GPUs). "dynamic-int8" loads fp32 and swaps every
+    nn.Linear for a dynamically quantized int8 kernel (CPU only). Anything else is fp32.
+    """
+    import torch
+    import transformers
+
+    kwargs: Dict[str, Any] = {"device_map": "auto"} if device in ("cuda", "mps") else {}
+    if precision == "bf16":
+        kwargs["torch_dtype"] = torch.bfloat16
+    model = getattr(transformers, model_class).from_pretrained(checkpoint, **kwargs)
+    if precision == "dynamic-int8":
+        if device != "cpu":
+            console.print(f"[warn] dynamic-int8 is CPU-only; loading {checkpoint} in fp32 on {device}")
+        else:
+            model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return model.eval()
+
+
+class ModelRegistry:
+    """
+    Process-wide, reference-counted model cache; everything loads the first time it is used.
+
+    Two levels are cached:
+      - weights (model + tokenizer), keyed by (checkpoint, auto class, device), so every
+        role asking for the same checkpoint gets the same tensors in RAM;
+      - pipelines, keyed by (task, model, device) and built on top of shared weights,
+        so e.g. the drafter and critic are one object when CRITIC_MODEL == GEN_MODEL.
+
+    Each role (generator, critic, embed, sentiment) holds one reference on its weights;
+    `release(role)` drops it and frees the weights once nobody uses them. A per-key lock
+    makes concurrent first calls (HTTP/SSE) load only once. The registry also records
+    RSS growth per checkpoint and how long the process took to answer its first MCP
+    message vs. to finish its first inference.
+    """
+
+    def __init__(self) -> None:
+        self._pipelines: Dict[PipelineKey, Any] = {}
+        self._weights: Dict[WeightsKey, Dict[str, Any]] = {}
+        self._roles: Dict[str, PipelineKey] = {}
+        self._locks: Dict[Any, threading.Lock] = {}
+        self._guard = threading.Lock()
+        self.load_seconds: Dict[str, float] = {}
+        self.first_handshake_s: Optional[float] = None
+        self.first_inference_s: Optional[float] = None
+
+    def _lock_for(self, key: Any) -> threading.Lock:
+        with self._guard:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def get(
+        self,
+        task: str,
+        model: Optional[str] = None,
+        device: str = DEVICE,
+        variant: str = "torch",
+        role: Optional[str] = None,
+    ) -> Any:
+        """
+        Return the pipeline for (task, model, device, variant), loading it (and its weights) on first request.
+        """
+        key = (task, model, device, variant)
+        while True:
+            pipe = self._pipelines.get(key)
+            if pipe is None:
+                with self._lock_for(key):
+                    if key not in self._pipelines:
+                        t0 = time.perf_counter()
+                        self._pipelines[key] = self._build_pipeline(*key)
+                        elapsed = time.perf_counter() - t0
+                        self.load_seconds[self._label(key)] = round(elapsed, 3)
+                        console.print(
+                            f"[muted]Loaded {self._label(key)} in {elapsed:.1f}s (RSS {_rss_mb():.0f} MiB)[/]"
+                        )
+                    pipe = self._pipelines.get(key)
+                if pipe is None:
+                    continue
+            if role is None or role in self._roles:
+                return pipe
+            with self._guard:
+                # A concurrent release() may have freed the weights since the load;
+                # take the reference only if they are still there, else load again.
+                entry = self._weights.get(self._weights_key(*key))
+                if entry is not None and key in self._pipelines:
+                    if role not in self._roles:
+                        self._roles[role] = key
+                        entry["refs"] += 1
+                    return self._pipelines[key]
+
+    def release(self, role: str) -> None:
+        """
+        Drop `role`'s reference; weights (and pipelines built on them) are freed at zero refs.
+        """
+        with self._guard:
+            key = self._roles.pop(role, None)
+            if key is None:
+                return
+            wkey = self._weights_key(*key)
+            entry = self._weights.get(wkey)
+            if entry is None:
+                return
+            entry["refs"] -= 1
+            if entry["refs"] > 0:
+                return
+            del self._weights[wkey]
+            for pkey in [k for k in self._pipelines if self._weights_key(*k) == wkey]:
+                del self._pipelines[pkey]
+        import gc
+
+        gc.collect()
+        console.print(f"[muted]Released {wkey[0]} (RSS {_rss_mb():.0f} MiB)[/]")
+
+    def _build_pipeline(self, task: str, model: Optional[str], device: str, variant: str) -> Any:
+        # Deferred: importing transformers (and torch) alone costs seconds.
+        from transformers import pipeline
+
+        weights = self._load_weights(*self._weights_key(task, model, device, variant))
+        return pipeline(task, model=weights["model"], tokenizer=weights["tokenizer"])
+
+    def _load_weights(self, checkpoint: str, model_class: str, device: str, variant: str) -> Dict[str, Any]:
+        wkey = (checkpoint, model_class, device, variant)
+        if wkey in self._weights:
+            return self._weights[wkey]
+        with self._lock_for(wkey):
+            if wkey not in self._weights:
+                import transformers
+
+                rss0 = _rss_mb()
+                if variant.startswith("onnx"):
+                    model = _load_onnx_model(checkpoint, model_class, quantize=variant == "onnx-int8")
+                else:
+                    model = _load_torch_model(checkpoint, model_class, device, variant)
+                self._weights[wkey] = {
+                    "model": model,
+                    "tokenizer": transformers.AutoTokenizer.from_pretrained(checkpoint),
+                    "refs": 0,
+                    "rss_delta_mb": round(_rss_mb() - rss0, 1),
+                }
+        return self._weights[wkey]
+
+    @staticmethod
+    def _weights_key(task: str, model: Optional[str], device: str, variant: str) -> WeightsKey:
+        checkpoint = model or (DEFAULT_SENTIMENT_MODEL if task == "sentiment-analysis" else "")
+        if variant.startswith("onnx") and task in _ORT_CLASSES:
+            return (checkpoint, _ORT_CLASSES[task], device, variant)
+        return (checkpoint, _AUTO_CLASSES.get(task, "AutoModel"), device, variant)
+
+    @staticmethod
+    def _label(key: PipelineKey) -> str:
+        task, model, device, variant = key
+        suffix = "" if variant == "torch" else f"[{variant}]"
+        return f"{task}:{model or 'default'}@{device}{suffix}"
+
+    def mark_handshake(self) -> None:
+        if self.first_handshake_s is None:
+            self.first_handshake_s = round(time.perf_counter() - _PROCESS_T0, 3)
+
+    def mark_inference(self) -> None:
+        if self.first_inference_s is None:
+            self.first_inference_s = round(time.perf_counter() - _PROCESS_T0, 3)
+            console.print(f"[muted]First inference finished {self.first_inference_s:.1f}s after start[/]")
+
+    def report(self) -> Dict[str, Any]:
+        """
+        Loaded pipelines and shared weights (refs, RSS growth), current RSS and
+        startup latency milestones (seconds since import).
+        """
+        return {
+            "rss_mb": round(_rss_mb(), 1),
+            "load_seconds": dict(self.load_seconds),
+            "roles": {role: self._label(key) for role, key in self._roles.items()},
+            "weights": {
+                f"{ckpt}:{cls}@{dev}[{var}]": {"refs": w["refs"], "rss_delta_mb": w["rss_delta_mb"]}
+                for (ckpt, cls, dev, var), w in self._weights.items()
+            },
+            "time_to_first_handshake_s": self.first_handshake_s,
+            "time_to_first_inference_s": self.first_inference_s,
+        }
+
+
+class LazyPipeline:
+    """
+    Cheap, import-time stand-in for a transformers pipeline.
+
+    Calling it (or reading any pipeline attribute such as `.tokenizer`) resolves the
+    real pipeline through the registry under this handle's role; nothing is
+    downloaded or loaded before that.
+    """
+
+    def __init__(
+        self,
+        role: str,
+        task: str,
+        model: Optional[str] = None,
+        variant: str = "torch",
+        device: str = DEVICE,
+    ) -> None:
+        self.role = role
+        self.task = task
+        self.model_name = model
+        self.variant = variant
+        self.device = device
+
+    def load(self) -> Any:
+        return MODELS.get(self.task, self.model_name, self.device, self.variant, role=self.role)
+
+    def release(self) -> None:
+        MODELS.release(self.role)
+
+    def __call__(self, *args: Any, **kwargs: Any) -> Any:
+        out = self.load()(*args, **kwargs)
+        MODELS.mark_inference()
+        return out
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.load(), name)
 
-# Generation (drafter)
-if DEVICE in ("cuda", "mps"):
-    generator_pipeline = pipeline("text2text-generation", model=GEN_MODEL, device_map="auto")
-    critic_pipeline = pipeline("text2text-generation", model=CRITIC_MODEL, device_map="auto")
-    embed_pipeline = pipeline("feature-extraction", model=EMBED_MODEL, device_map="auto")
-else:
-    generator_pipeline = pipeline("text2text-generation", model=GEN_MODEL)
-    critic_pipeline = pipeline("text2text-generation", model=CRITIC_MODEL)
-    embed_pipeline = pipeline("feature-extraction", model=EMBED_MODEL)
-
-# Classifier
-sentiment_pipeline = (
-    pipeline("sentiment-analysis", model=SENTIMENT_MODEL)
-    if SENTIMENT_MODEL
-    else pipeline("sentiment-analysis")
-)
+
+MODELS = ModelRegistry()
+
+# Generation (drafter / critic), embeddings and classifier -- all loaded on first use.
+# The drafter and critic share one model instance unless CRITIC_MODEL/CRITIC_PRECISION differ.
+generator_pipeline = LazyPipeline("generator", "text2text-generation", GEN_MODEL, variant=GEN_PRECISION)
+critic_pipeline = LazyPipeline("critic", "text2text-generation", CRITIC_MODEL, variant=CRITIC_PRECISION)
+embed_pipeline = LazyPipeline("embed", "feature-extraction", EMBED_MODEL, variant=ENCODER_BACKEND)
+sentiment_pipeline = LazyPipeline("sentiment", "sentiment-analysis", SENTIMENT_MODEL, variant=ENCODER_BACKEND)
 
 
 # ===========================
@@ -133,83 +503,418 @@ sentiment_pipeline = (
 # ===========================
 mcp = FastMCP("investment-analysis-langgraph")
 
+# Record when the first MCP message arrives (handshake), for the startup report.
+try:
+    from fastmcp.server.middleware import Middleware
+except Exception:  # pragma: no cover - older fastmcp without middleware support
+    Middleware = None  # type: ignore
+
+if Middleware is not None:
+    class _HandshakeTimer(Middleware):  # type: ignore[misc, valid-type]
+        async def on_message(self, context, call_next):
+            MODELS.mark_handshake()
+            return await call_next(context)
+
+    mcp.add_middleware(_HandshakeTimer())
+
 
 # ===========================
 # RAG: Embeddings & Vector DB
 # ===========================
-def _mean_pool_features(feats: Any) -> List[float]:
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+
+# Encoder forward passes made while a request runs (set per `analyze_stock` call):
+# {"embed_passes", "embed_texts", "sentiment_passes", "sentiment_texts"}
+ENCODER_CALLS: ContextVar[Optional[Dict[str, int]]] = ContextVar("ENCODER_CALLS", default=None)
+
+
+def _count_encoder(kind: str, texts: int) -> None:
+    counts = ENCODER_CALLS.get()
+    if counts is not None:
+        counts[f"{kind}_passes"] = counts.get(f"{kind}_passes", 0) + 1
+        counts[f"{kind}_texts"] = counts.get(f"{kind}_texts", 0) + texts
+
+
+def encode_texts(pipe: Any, texts: List[str], batch_size: int = EMBED_BATCH_SIZE) -> Any:
+    """
+    Sentence embeddings straight from a feature-extraction pipeline's model.
+
+    Texts are sorted by length and tokenized in batches of `batch_size`; each batch is
+    one forward pass, mean-pooled over real tokens only (the attention mask keeps
+    padding out of the mean), on tensors.
+
+    Returns:
+        C-contiguous float32 array of shape [len(texts), hidden], in input order.
+    """
+    import numpy as np
+    import torch
+
+    tok, model = pipe.tokenizer, pipe.model
+    out = np.empty((len(texts), model.config.hidden_size), dtype="float32")
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    with torch.inference_mode():
+        for start in range(0, len(order), max(1, batch_size)):
+            idx = order[start:start + batch_size]
+            enc = tok([texts[i] for i in idx], padding=True, truncation=True, max_length=512, return_tensors="pt")
+            enc = {k: v.to(pipe.device) for k, v in enc.items()}
+            hidden = model(**enc).last_hidden_state
+            _count_encoder("embed", len(idx))
+            mask = enc["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+            pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+            out[idx] = pooled.float().cpu().numpy()
+    return out
+
+
+def embed_texts(texts: List[str]) -> Any:
+    """
+    Embed texts with EMBED_MODEL: float32 matrix [len(texts), hidden].
+
+    Texts already in EMBED_CACHE are read from disk; only the rest (each distinct
+    text once) go through `encode_texts`, and are then added to the cache.
     """
-    Mean-pool a nested list coming from the 'feature-extraction' pipeline.
-    Handles shapes like [seq_len, hidden] or [1, seq_len, hidden].
+    import numpy as np
+
+    found, missing = EMBED_CACHE.get_many(texts)
+    if missing:
+        todo = list(dict.fromkeys(texts[i] for i in missing))
+        fresh = encode_texts(embed_pipeline.load(), todo)
+        MODELS.mark_inference()
+        EMBED_CACHE.put_many(todo, fresh)
+        row_of = {t: r for r, t in enumerate(todo)}
+        for i in missing:
+            found[i] = fresh[row_of[texts[i]]]
+    if not texts:
+        return np.empty((0, 0), dtype="float32")
+    return np.ascontiguousarray(np.stack(found), dtype="float32")
+
+
+def make_embedding_fn() -> Any:
     """
-    # Convert to numpy if available for simplicity
-    if np is not None:
-        arr = np.array(feats, dtype="float32")
-        if arr.ndim == 3:  # [batch, seq, hid]
-            arr = arr[0]
-        # avoid division by zero
-        if arr.size == 0:
-            return []
-        return arr.mean(axis=0).astype("float32").tolist()
+    Build the Chroma EmbeddingFunction that delegates to our HF embedding pipeline.
+    (Defined lazily because subclassing it requires importing chromadb.)
+    """
+    from chromadb.utils.embedding_functions import EmbeddingFunction
 
-    # Fallback: pure python pooling
-    # feats -> list (maybe [1][seq][hidden] or [seq][hidden])
-    if isinstance(feats, list) and feats:
-        if isinstance(feats[0], list) and feats[0] and isinstance(feats[0][0], list):
-            feats = feats[0]  # drop batch
-        # feats is now [seq][hidden]
-        seq = len(feats)
-        hid = len(feats[0]) if seq else 0
-        if seq == 0 or hid == 0:
-            return []
-        # mean across seq for each hidden dim
-        sums = [0.0] * hid
-        for token in feats:
-            for j, val in enumerate(token):
-                sums[j] += float(val)
-        return [s / seq for s in sums]
-    return []
+    class HFEmbeddingFn(EmbeddingFunction):
+        def __call__(self, input: List[str]) -> List[List[float]]:
+            return [_as_vector(v) for v in embed_texts(input)]
 
+    return HFEmbeddingFn()
 
-def embed_texts(texts: List[str]) -> List[List[float]]:
+
+class NumpyCollection:
     """
-    Embed texts via the HF feature-extraction pipeline + mean pooling.
+    In-process vector collection: a float32 matrix searched exactly (squared L2, as in
+    Chroma's default space), with ids, documents, metadata and vectors persisted in SQLite.
+
+    Implements the part of Chroma's Collection API that VectorStore uses -- upsert, get,
+    query, delete, count -- with `where={"key": value}` equality filters ("ticker" is
+    indexed, other keys are scanned).
     """
-    vectors: List[List[float]] = []
-    for t in texts:
-        feats = embed_pipeline(t, truncation=True, max_length=512)
-        vec = _mean_pool_features(feats)
-        vectors.append(vec)
-    return vectors
 
+    def __init__(self, db: Any, lock: Any, name: str, embedding_function: Any = None):
+        self.name = name
+        self._db = db
+        self._lock = lock  # shared with the client (one SQLite connection)
+        self._embed = embedding_function
+        self._ids: List[str] = []
+        self._docs: List[str] = []
+        self._metas: List[Dict[str, Any]] = []
+        self._row: Dict[str, int] = {}
+        self._by_ticker: Dict[Any, set] = {}
+        self._vecs: Any = None  # (capacity, dim); rows [0, count) are live
+        self._norms: Any = None
+        self._load()
+
+    def _load(self) -> None:
+        import numpy as np
+
+        rows = self._db.execute(
+            "SELECT id, document, metadata, embedding FROM vectors WHERE collection = ?", (self.name,)
+        ).fetchall()
+        if rows:
+            vecs = np.frombuffer(b"".join(r[3] for r in rows), dtype="float32").reshape(len(rows), -1)
+            self._append([r[0] for r in rows], [r[1] for r in rows], [json.loads(r[2]) for r in rows], vecs)
+
+    def _append(self, ids: List[str], docs: List[str], metas: List[Dict[str, Any]], vecs: Any) -> None:
+        import numpy as np
+
+        n, need = len(self._ids), len(self._ids) + len(ids)
+        if self._vecs is None or need > self._vecs.shape[0]:
+            grown = np.empty((max(need, 1024, 2 * n), vecs.shape[1]), dtype="float32")
+            norms = np.empty(grown.shape[0], dtype="float32")
+            if n:
+                grown[:n], norms[:n] = self._vecs[:n], self._norms[:n]
+            self._vecs, self._norms = grown, norms
+        self._vecs[n:need] = vecs
+        self._norms[n:need] = (vecs * vecs).sum(axis=1)
+        self._ids.extend(ids)
+        self._docs.extend(docs)
+        self._metas.extend(metas)
+        for r in range(n, need):
+            self._row[self._ids[r]] = r
+            self._by_ticker.setdefault(self._metas[r].get("ticker"), set()).add(r)
+
+    def count(self) -> int:
+        return len(self._ids)
+
+    def upsert(
+        self, ids: List[str], documents: List[str], metadatas: List[Dict[str, Any]], embeddings: Any = None
+    ) -> None:
+        import numpy as np
+
+        if embeddings is None:
+            embeddings = self._embed(list(documents))
+        vecs = np.asarray(embeddings, dtype="float32").reshape(len(ids), -1)
+        keep = sorted({id_: j for j, id_ in enumerate(ids)}.values())  # last write wins
+        with self._lock:
+            with self._db:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO vectors (collection, id, document, metadata, embedding) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    [
+                        (self.name, ids[j], documents[j], json.dumps(metadatas[j], ensure_ascii=False),
+                         vecs[j].tobytes())
+                        for j in keep
+                    ],
+                )
+            new = []
+            for j in keep:
+                r = self._row.get(ids[j])
+                if r is None:
+                    new.append(j)
+                    continue
+                self._by_ticker.get(self._metas[r].get("ticker"), set()).discard(r)
+                self._docs[r], self._metas[r] = documents[j], dict(metadatas[j])
+                self._vecs[r] = vecs[j]
+                self._norms[r] = float(vecs[j] @ vecs[j])
+                self._by_ticker.setdefault(self._metas[r].get("ticker"), set()).add(r)
+            if new:
+                self._append(
+                    [ids[j] for j in new], [documents[j] for j in new], [dict(metadatas[j]) for j in new], vecs[new]
+                )
+
+    def delete(self, ids: List[str]) -> None:
+        with self._lock:
+            with self._db:
+                self._db.executemany(
+                    "DELETE FROM vectors WHERE collection = ? AND id = ?", [(self.name, id_) for id_ in ids]
+                )
+            for id_ in ids:
+                r = self._row.pop(id_, None)
+                if r is None:
+                    continue
+                last = len(self._ids) - 1
+                self._by_ticker.get(self._metas[r].get("ticker"), set()).discard(r)
+                if r != last:  # move the last row into the hole
+                    tags = self._by_ticker.get(self._metas[last].get("ticker"), set())
+                    tags.discard(last)
+                    tags.add(r)
+                    self._ids[r], self._docs[r], self._metas[r] = self._ids[last], self._docs[last], self._metas[last]
+                    self._vecs[r], self._norms[r] = self._vecs[last], self._norms[last]
+                    self._row[self._ids[r]] = r
+                del self._ids[last], self._docs[last], self._metas[last]
+
+    def _filter(self, where: Optional[Dict[str, Any]]) -> Any:
+        # Row indices matching every {key: value} (or {key: {"$eq": value}}); None = all rows.
+        import numpy as np
+
+        if not where:
+            return None
+        rows: Optional[set] = None
+        for key, value in where.items():
+            if isinstance(value, dict):
+                value = value.get("$eq")
+            if key == "ticker":
+                match = self._by_ticker.get(value, set())
+            else:
+                match = {r for r, m in enumerate(self._metas) if m.get(key) == value}
+            rows = set(match) if rows is None else rows & match
+        return np.fromiter(sorted(rows or ()), dtype="int64")
+
+    def get(
+        self, ids: Optional[List[str]] = None, limit: Optional[int] = None, include: Any = None
+    ) -> Dict[str, Any]:
+        with self._lock:
+            rows = [self._row[i] for i in ids if i in self._row] if ids is not None else range(len(self._ids))
+            rows = list(rows)[:limit] if limit else list(rows)
+            return {
+                "ids": [self._ids[r] for r in rows],
+                "documents": [self._docs[r] for r in rows],
+                "metadatas": [dict(self._metas[r]) for r in rows],
+                "embeddings": (
+                    (self._vecs[rows].copy() if rows else []) if include and "embeddings" in include else None
+                ),
+            }
+
+    def query(
+        self,
+        query_embeddings: Any = None,
+        query_texts: Optional[List[str]] = None,
+        n_results: int = 10,
+        where: Optional[Dict[str, Any]] = None,
+    ) -> Dict[str, Any]:
+        import numpy as np
+
+        if query_embeddings is None:
+            query_embeddings = self._embed(list(query_texts or []))
+        Q = np.asarray(query_embeddings, dtype="float32")
+        Q = Q.reshape(len(Q), -1)
+        out: Dict[str, Any] = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        with self._lock:
+            rows = self._filter(where)
+            n = len(self._ids)
+            k = min(max(1, n_results), n if rows is None else len(rows))
+            if k == 0:
+                return {key: [[] for _ in range(len(Q))] for key in out}
+            V = self._vecs[:n] if rows is None else self._vecs[rows]
+            norms = self._norms[:n] if rows is None else self._norms[rows]
+            dist = (Q * Q).sum(axis=1)[:, None] + norms[None, :] - 2.0 * Q @ V.T
+            top = np.argpartition(dist, k - 1, axis=1)[:, :k]
+            for q in range(len(Q)):
+                order = top[q][np.argsort(dist[q, top[q]])]
+                hits = order if rows is None else rows[order]
+                out["ids"].append([self._ids[r] for r in hits])
+                out["documents"].append([self._docs[r] for r in hits])
+                out["metadatas"].append([dict(self._metas[r]) for r in hits])
+                out["distances"].append([float(max(d, 0.0)) for d in dist[q, order]])
+        return out
+
+
+class NumpyVectorClient:
+    """
+    Stand-in for `chromadb.PersistentClient` built on NumpyCollection: one SQLite file
+    under `path` holds every collection. Collections are loaded into memory on open.
+    """
 
-class HFEmbeddingFn(EmbeddingFunction):
+    def __init__(self, path: str):
+        import sqlite3
+
+        os.makedirs(path, exist_ok=True)
+        self.path = os.path.join(path, "numpy_vectors.sqlite3")
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        with self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS collections (name TEXT PRIMARY KEY)")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS vectors (collection TEXT NOT NULL, id TEXT NOT NULL, "
+                "document TEXT, metadata TEXT, embedding BLOB NOT NULL, PRIMARY KEY (collection, id))"
+            )
+        self._lock = threading.RLock()
+        self._cols: Dict[str, NumpyCollection] = {}
+
+    def get_or_create_collection(self, name: str, embedding_function: Any = None) -> NumpyCollection:
+        with self._lock:
+            with self._db:
+                self._db.execute("INSERT OR IGNORE INTO collections (name) VALUES (?)", (name,))
+            return self.get_collection(name, embedding_function)
+
+    def get_collection(self, name: str, embedding_function: Any = None) -> NumpyCollection:
+        with self._lock:
+            col = self._cols.get(name)
+            if col is None:
+                if self._db.execute("SELECT 1 FROM collections WHERE name = ?", (name,)).fetchone() is None:
+                    raise ValueError(f"Collection {name} does not exist.")
+                col = self._cols[name] = NumpyCollection(self._db, self._lock, name, embedding_function)
+            return col
+
+    def list_collections(self) -> List[str]:
+        with self._lock:
+            return [r[0] for r in self._db.execute("SELECT name FROM collections")]
+
+    def delete_collection(self, name: str) -> None:
+        with self._lock:
+            with self._db:
+                self._db.execute("DELETE FROM vectors WHERE collection = ?", (name,))
+                self._db.execute("DELETE FROM collections WHERE name = ?", (name,))
+            self._cols.pop(name, None)
+
+
+def open_vector_client(backend: str, path: str) -> Any:
     """
-    Chroma EmbeddingFunction that delegates to our HF embedding pipeline.
+    Open a vector DB client persisting under `path`: "chroma" (chromadb.PersistentClient)
+    or "numpy" (NumpyVectorClient). Both expose the collection API VectorStore relies on.
     """
-    def __call__(self, input: List[str]) -> List[List[float]]:
-        return embed_texts(input)
+    if backend == "chroma":
+        import chromadb
+
+        return chromadb.PersistentClient(path=path)
+    if backend == "numpy":
+        return NumpyVectorClient(path)
+    raise ValueError(f"unknown vector backend: {backend!r}")
 
 
 class VectorStore:
     """
-    Small wrapper around Chroma (if available) for storing and retrieving headlines.
+    Small wrapper around a vector DB for storing and retrieving headlines: Chroma if
+    available, else (or with backend="numpy") the in-process NumpyVectorClient.
     Each document = {'text': headline, 'metadata': {'ticker', 'sentiment', 'score', 'time'}}.
+
+    With partition="ticker", every headline is also written to a per-ticker collection
+    (`<collection>__<TICKER>`); the shared collection stays the complete, global index.
     """
 
-    def __init__(self, path: str = "./rag_store", collection: str = "finance_news"):
-        self.enabled = CHROMA_AVAILABLE
+    def __init__(
+        self,
+        path: str = "./rag_store",
+        collection: str = "finance_news",
+        max_age_days: float = 0,
+        max_per_ticker: int = 0,
+        write_batch: int = 0,
+        write_delay_ms: float = 0,
+        partition: str = "none",
+        partition_min_docs: int = 0,
+        backend: str = "auto",
+    ):
         self.path = path
+        self.backend = backend  # auto | chroma | numpy
+        self.backend_name: Optional[str] = None  # what `_connect` actually opened
         self.collection_name = collection
+        # Retention (0 = unlimited), applied by `enforce_retention`; seed docs are always kept.
+        self.max_age_days = max_age_days
+        self.max_per_ticker = max_per_ticker
         self.client = None
         self.col = None
-        if self.enabled:
+        self._embed_fn = None
+        # Ticker partitions: collection and document count per upper-cased ticker. The
+        # writer thread and request threads share these (under _partition_lock); sizes
+        # are per-process hints -- refreshed from count() before a sparse decision or a report.
+        self.partition = partition
+        self.partition_min_docs = partition_min_docs
+        self._partitions: Dict[str, Any] = {}
+        self._partition_sizes: Dict[str, int] = {}
+        self._partition_lock = threading.Lock()
+        self.partition_counts = {"partition_queries": 0, "merged_with_shared": 0}
+        self._enabled = (CHROMA_AVAILABLE and backend != "numpy") or (NUMPY_AVAILABLE and backend != "chroma")
+        self._connected = False
+        self._connect_lock = threading.Lock()
+        # Write-behind buffer for `upsert_later` (write_batch <= 1 writes through).
+        self.write_batch = write_batch
+        self.write_delay_s = write_delay_ms / 1000.0
+        self._pending: List[Tuple[str, str, Dict[str, Any], Any]] = []  # (id, text, metadata, embedding)
+        self._pending_since = 0.0
+        self._pending_cv = threading.Condition()
+        self._write_lock = threading.Lock()  # one backend write at a time
+        self._writer: Optional[threading.Thread] = None
+        self.write_counts = {"queued": 0, "written": 0, "flushes": 0, "failed_flushes": 0}
+
+    @property
+    def enabled(self) -> bool:
+        """
+        True if the vector DB is usable. The first access opens (and seeds) the
+        collection, so importing the server never touches the vector DB or the embedder.
+        """
+        if self._enabled and not self._connected:
+            self._connect()
+        return self._enabled
+
+    def _connect(self) -> None:
+        with self._connect_lock:
+            if self._connected:
+                return
+            self._connected = True
             try:
-                self.client = chromadb.PersistentClient(path=self.path)  # type: ignore[name-defined]
-                self.col = self.client.get_or_create_collection(
-                    name=self.collection_name,
-                    embedding_function=HFEmbeddingFn(),
-                )
+                self._open_backend()
                 # Seed a few generic exemplars (only if empty)
                 if self.col.count() == 0:
                     seed_docs = [
@@ -225,98 +930,1353 @@ class VectorStore:
                         ids=[f"seed-{i}" for i in range(len(seed_docs))],
                     )
             except Exception as e:
-                self.enabled = False
+                self._enabled = False
                 console.print(f"[warn] Vector DB disabled (init failed): {e}")
 
-    def upsert(self, text: str, metadata: Dict[str, Any], id_: Optional[str] = None) -> None:
+    def _open_backend(self) -> None:
+        if self.backend != "numpy" and CHROMA_AVAILABLE:
+            try:
+                self.client = open_vector_client("chroma", self.path)
+                self._embed_fn = make_embedding_fn()
+                self.col = self.client.get_or_create_collection(
+                    name=self.collection_name, embedding_function=self._embed_fn
+                )
+                self.backend_name = "chroma"
+                return
+            except Exception as e:
+                if self.backend == "chroma" or not NUMPY_AVAILABLE:
+                    raise
+                console.print(f"[warn] Chroma init failed ({e}); using the in-process NumPy vector store")
+        elif self.backend == "chroma":
+            raise RuntimeError("chromadb is not installed")
+        self.client = open_vector_client("numpy", self.path)
+        self._embed_fn = embed_texts
+        self.col = self.client.get_or_create_collection(name=self.collection_name, embedding_function=self._embed_fn)
+        self.backend_name = "numpy"
+
+    def upsert(
+        self, text: str, metadata: Dict[str, Any], id_: Optional[str] = None, embedding: Any = None
+    ) -> None:
         """
-        Upsert a single document.
+        Upsert a single document. Pass `embedding` if the text was already embedded
+        (Chroma then skips the embedding function).
         """
-        if not self.enabled or self.col is None:
-            return
-        try:
-            self.col.upsert(documents=[text], metadatas=[metadata], ids=[id_ or self._make_id(text, metadata)])
-        except Exception as e:
-            console.print(f"[warn] Vector upsert failed: {e}")
-
-    def upsert_bulk(self, texts: List[str], metadatas: List[Dict[str, Any]], ids: Optional[List[str]] = None) -> None:
+        self.upsert_bulk([text], [metadata], [id_] if id_ else None, [embedding] if embedding is not None else None)
+
+    def upsert_bulk(
+        self,
+        texts: List[str],
+        metadatas: List[Dict[str, Any]],
+        ids: Optional[List[str]] = None,
+        embeddings: Any = None,
+        raise_errors: bool = False,
+    ) -> None:
         """
-        Upsert many documents at once.
+        Upsert many documents at once (optionally with their precomputed `embeddings`).
+
+        Ids are content-addressed (see `_make_id`), so a headline seen again updates
+        its document -- label, last_seen, hit_count -- instead of adding a new one.
+        A failed write is only logged, unless `raise_errors`.
         """
         if not self.enabled or self.col is None or not texts:
             return
         try:
             if ids is None:
                 ids = [self._make_id(t, metadatas[i]) for i, t in enumerate(texts)]
-            self.col.upsert(documents=texts, metadatas=metadatas, ids=ids)
+            # Chroma rejects repeated ids in one call: keep the last sighting of each.
+            last: Dict[str, int] = {}
+            seen: Dict[str, int] = {}
+            first: Dict[str, str] = {}
+            for i, id_ in enumerate(ids):
+                last[id_] = i
+                seen[id_] = seen.get(id_, 0) + 1
+                first.setdefault(id_, metadatas[i].get("time") or "")
+            keep = sorted(last.values())
+            ids = [ids[i] for i in keep]
+            metadatas = self._merge_sightings(
+                ids, [metadatas[i] for i in keep], [seen[x] for x in ids], [first[x] for x in ids]
+            )
+            docs = [texts[i] for i in keep]
+            if embeddings is not None:
+                vectors = [_as_vector(embeddings[i]) for i in keep]
+            elif self.partitioned:
+                vectors = [_as_vector(v) for v in embed_texts(docs)]  # embed once for both copies
+            else:
+                vectors = None
+            extra = {"embeddings": vectors} if vectors is not None else {}
+            self.col.upsert(documents=docs, metadatas=metadatas, ids=ids, **extra)
+            if self.partitioned:
+                self._upsert_partitions(ids, docs, metadatas, vectors)
         except Exception as e:
+            if raise_errors:
+                raise
             console.print(f"[warn] Vector bulk upsert failed: {e}")
 
-    def query(self, text: str, ticker: Optional[str] = None, k: int = 5) -> List[Dict[str, Any]]:
+    def _merge_sightings(
+        self, ids: List[str], metadatas: List[Dict[str, Any]], sightings: List[int], firsts: List[str]
+    ) -> List[Dict[str, Any]]:
+        # Carry first_seen / hit_count over from the stored copy (one bulk read per
+        # write batch). "time" keeps its meaning -- when the headline was last seen.
+        prev = self.col.get(ids=ids, include=["metadatas"])
+        stored = dict(zip(prev.get("ids") or [], prev.get("metadatas") or []))
+        merged = []
+        for id_, meta, n, batch_first in zip(ids, metadatas, sightings, firsts):
+            old = stored.get(id_) or {}
+            now = meta.get("time") or datetime.utcnow().isoformat()
+            # documents stored before first_seen existed carry their first sighting in "time"
+            first = old.get("first_seen") or old.get("time") or batch_first or now
+            merged.append(
+                meta
+                | {
+                    "time": now,
+                    "first_seen": first,
+                    "last_seen": now,
+                    "hit_count": int(old.get("hit_count", 1 if old else 0)) + n,
+                }
+            )
+        return merged
+
+    def query(
+        self, text: str, ticker: Optional[str] = None, k: int = 5, embedding: Any = None
+    ) -> List[Dict[str, Any]]:
         """
         Query similar documents to the given text. Optionally filter by ticker.
+        Pass `embedding` (the text's vector) to search without re-embedding it.
 
         Returns:
             List of {text, metadata, distance}
         """
-        if not self.enabled or self.col is None:
-            return []
+        embeddings = [embedding] if embedding is not None else None
+        return self.query_many([text], tickers=ticker, k=k, embeddings=embeddings, fallback=False)[0]
+
+    def query_many(
+        self,
+        texts: List[str],
+        tickers: Optional[str] | List[Optional[str]] = None,
+        k: int = 5,
+        embeddings: Any = None,
+        fallback: bool = True,
+        exclude_self: bool = False,
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        Query many texts in as few Chroma round trips as possible.
+
+        `tickers` is one filter for every query or one per query (None = no filter).
+        Queries sharing a filter go out as one call; with `fallback`, filtered queries
+        that found nothing are retried together in one unfiltered call. With
+        `exclude_self`, each text's own stored copy is dropped first (see `_drop_self`),
+        so a headline whose only same-ticker hit is itself still gets the general pool.
+
+        Returns:
+            One list of {text, metadata, distance} per input text, in input order.
+        """
+        results: List[List[Dict[str, Any]]] = [[] for _ in texts]
+        if not self.enabled or self.col is None or not texts:
+            return results
+        per_query = tickers if isinstance(tickers, list) else [tickers] * len(texts)
+        groups: Dict[Optional[str], List[int]] = {}
+        for i, t in enumerate(per_query):
+            groups.setdefault(t or None, []).append(i)
+        for ticker, idx in groups.items():
+            self._query_into(results, idx, texts, embeddings, k, {"ticker": ticker} if ticker else None)
+        if exclude_self:
+            results = [_drop_self(rows, texts[i], per_query[i] or "") for i, rows in enumerate(results)]
+        if fallback:
+            empty = [i for i in range(len(texts)) if not results[i] and per_query[i]]
+            if empty:
+                self._query_into(results, empty, texts, embeddings, k, None)
+                if exclude_self:
+                    for i in empty:
+                        results[i] = _drop_self(results[i], texts[i], per_query[i] or "")
+        return results
+
+    def _query_into(
+        self,
+        results: List[List[Dict[str, Any]]],
+        idx: List[int],
+        texts: List[str],
+        embeddings: Any,
+        k: int,
+        where: Optional[Dict[str, Any]],
+    ) -> None:
         try:
-            where = {"ticker": ticker} if ticker else None
-            res = self.col.query(query_texts=[text], n_results=max(1, k), where=where)
-            docs = []
-            for i in range(len(res.get("ids", [[]])[0])):
-                docs.append({
-                    "text": res["documents"][0][i],
-                    "metadata": res["metadatas"][0][i],
-                    "distance": res["distances"][0][i] if "distances" in res and res["distances"] else None,
-                })
-            return docs
+            q_texts = [texts[i] for i in idx]
+            q_vecs = [_as_vector(embeddings[i]) for i in idx] if embeddings is not None else None
+            ticker = (where or {}).get("ticker")
+            if self.partitioned and ticker:
+                rows = self._query_partition(str(ticker), q_texts, q_vecs, k)
+            else:
+                rows = self._search(self.col, q_texts, q_vecs, k, where)
+            for row, i in enumerate(idx):
+                results[i] = rows[row]
         except Exception as e:
             console.print(f"[warn] Vector query failed: {e}")
-            return []
+        self._merge_overlay(results, idx, texts, embeddings, k, where)
+
+    @staticmethod
+    def _search(
+        col: Any, q_texts: List[str], q_vecs: Optional[List[List[float]]], k: int, where: Optional[Dict[str, Any]]
+    ) -> List[List[Dict[str, Any]]]:
+        if q_vecs is not None:
+            res = col.query(query_embeddings=q_vecs, n_results=max(1, k), where=where)
+        else:
+            res = col.query(query_texts=q_texts, n_results=max(1, k), where=where)
+        distances = res.get("distances") or None
+        return [
+            [
+                {
+                    "id": res["ids"][row][j],
+                    "text": res["documents"][row][j],
+                    "metadata": res["metadatas"][row][j],
+                    "distance": distances[row][j] if distances else None,
+                }
+                for j in range(len(res["ids"][row]))
+            ]
+            for row in range(len(q_texts))
+        ]
+
+    # ----- ticker partitions -----
+    @property
+    def partitioned(self) -> bool:
+        return self.partition == "ticker"
+
+    def _partition_name(self, ticker: str) -> str:
+        # Chroma names allow [A-Za-z0-9._-] and must end alphanumeric
+        safe = re.sub(r"[^A-Za-z0-9._-]", "_", ticker.upper()).strip("._-") or "NA"
+        return f"{self.collection_name}__{safe}"
+
+    def _partition(self, ticker: str, create: bool = False) -> Any:
+        # Open a ticker's collection (None if it does not exist and create=False).
+        key = ticker.upper()
+        with self._partition_lock:
+            col = self._partitions.get(key)
+        if col is not None:
+            return col
+        name = self._partition_name(key)
+        if create:
+            col = self.client.get_or_create_collection(name=name, embedding_function=self._embed_fn)
+        else:
+            try:
+                col = self.client.get_collection(name=name, embedding_function=self._embed_fn)
+            except Exception:
+                return None
+        size = col.count()
+        with self._partition_lock:
+            col = self._partitions.setdefault(key, col)
+            self._partition_sizes[key] = size
+        return col
+
+    def _refresh_size(self, ticker: str, col: Any) -> int:
+        size = col.count()
+        with self._partition_lock:
+            self._partition_sizes[ticker.upper()] = size
+        return size
+
+    def _upsert_partitions(
+        self,
+        ids: List[str],
+        docs: List[str],
+        metadatas: List[Dict[str, Any]],
+        vectors: Optional[List[List[float]]],
+    ) -> None:
+        by_ticker: Dict[str, List[int]] = {}
+        for i, (id_, meta) in enumerate(zip(ids, metadatas)):
+            if not id_.startswith("seed-"):  # seeds live in the shared collection only
+                by_ticker.setdefault(str(meta.get("ticker") or "NA").upper(), []).append(i)
+        for ticker, members in by_ticker.items():
+            col = self._partition(ticker, create=True)
+            extra = {"embeddings": [vectors[i] for i in members]} if vectors is not None else {}
+            col.upsert(
+                ids=[ids[i] for i in members],
+                documents=[docs[i] for i in members],
+                metadatas=[metadatas[i] for i in members],
+                **extra,
+            )
+            self._refresh_size(ticker, col)
+
+    def _query_partition(
+        self, ticker: str, q_texts: List[str], q_vecs: Optional[List[List[float]]], k: int
+    ) -> List[List[Dict[str, Any]]]:
+        # Search the ticker's own collection; while it is sparse, merge in the nearest
+        # shared (all-ticker) results by distance.
+        if q_vecs is None:
+            q_vecs = [_as_vector(v) for v in embed_texts(q_texts)]  # one embedding for both searches
+        col = self._partition(ticker)
+        with self._partition_lock:
+            size = self._partition_sizes.get(ticker.upper(), 0)
+            self.partition_counts["partition_queries"] += len(q_texts)
+        if col is not None and size < self.partition_min_docs:
+            size = self._refresh_size(ticker, col)  # another worker may have filled it
+        rows = self._search(col, q_texts, q_vecs, min(k, size), None) if size else [[] for _ in q_texts]
+        if size >= self.partition_min_docs:
+            return rows
+        with self._partition_lock:
+            self.partition_counts["merged_with_shared"] += len(q_texts)
+        for row, extra in zip(rows, self._search(self.col, q_texts, q_vecs, k, None)):
+            have = {d["id"] for d in row}
+            row.extend(d for d in extra if d["id"] not in have)
+            row.sort(key=lambda d: d["distance"] if d["distance"] is not None else float("inf"))
+            del row[max(1, k):]
+        return rows
+
+    def _delete(self, ids: List[str], batch: int = 1000) -> None:
+        # Delete from the shared collection and, when partitioned, from the owning
+        # partitions -- found from the stored metadata ticker, as `_upsert_partitions`
+        # assigns them (legacy ids don't encode the ticker).
+        by_ticker: Dict[str, List[str]] = {}
+        if self.partitioned:
+            for start in range(0, len(ids), batch):
+                stored = self.col.get(ids=ids[start:start + batch], include=["metadatas"])
+                for id_, meta in zip(stored.get("ids") or [], stored.get("metadatas") or []):
+                    if not id_.startswith("seed-"):
+                        by_ticker.setdefault(str((meta or {}).get("ticker") or "NA").upper(), []).append(id_)
+        for start in range(0, len(ids), batch):
+            self.col.delete(ids=ids[start:start + batch])
+        for ticker, members in by_ticker.items():
+            col = self._partition(ticker)
+            if col is None:
+                continue
+            for start in range(0, len(members), batch):
+                col.delete(ids=members[start:start + batch])
+            self._refresh_size(ticker, col)
+
+    def partition_store(self, batch: int = 1000) -> Dict[str, Any]:
+        """
+        Split the shared collection into per-ticker partitions (one-shot migration,
+        safe to re-run: existing partitions are rebuilt from the shared collection,
+        which keeps every document). Seed documents stay shared-only.
+
+        Returns:
+            {"documents", "partitions", "sparse_partitions", "largest": {ticker: n, ...}}
+        """
+        if not self.enabled or self.col is None:
+            return {"error": "vector store unavailable"}
+        prefix = f"{self.collection_name}__"
+        for c in self.client.list_collections():
+            name = getattr(c, "name", c)  # Collection objects on older Chroma, names on newer
+            if str(name).startswith(prefix):
+                self.client.delete_collection(name=name)
+        with self._partition_lock:
+            self._partitions.clear()
+            self._partition_sizes.clear()
+
+        data = self.dump()
+        for start in range(0, len(data["ids"]), batch):
+            end = start + batch
+            self._upsert_partitions(
+                data["ids"][start:end],
+                data["texts"][start:end],
+                [m or {} for m in data["metadatas"][start:end]],
+                [_as_vector(v) for v in data["embeddings"][start:end]],
+            )
+        sizes = sorted(self._partition_size_report().items(), key=lambda kv: -kv[1])
+        return {
+            "documents": len(data["ids"]),
+            "partitions": len(sizes),
+            "sparse_partitions": sum(1 for _, n in sizes if n < self.partition_min_docs),
+            "largest": dict(sizes[:10]),
+            "mode": self.partition,
+        }
+
+    def _partition_size_report(self) -> Dict[str, int]:
+        # Fresh counts for every open partition (the cached sizes are only hints).
+        with self._partition_lock:
+            opened = list(self._partitions.items())
+        return {ticker: self._refresh_size(ticker, col) for ticker, col in opened}
+
+    def partition_stats(self) -> Dict[str, Any]:
+        sizes = self._partition_size_report() if self.partitioned else {}
+        with self._partition_lock:
+            counts = dict(self.partition_counts)
+        return {
+            "mode": self.partition,
+            "min_docs": self.partition_min_docs,
+            "open_partitions": len(sizes),
+            "sparse_open_partitions": sum(1 for n in sizes.values() if n < self.partition_min_docs),
+            **counts,
+        }
+
+    # ----- write-behind buffer -----
+    def upsert_later(self, text: str, metadata: Dict[str, Any], embedding: Any = None) -> None:
+        """
+        Queue an upsert for the background writer. Queued headlines are already visible
+        to `query`/`query_many` (through an in-memory overlay) before they reach Chroma.
+        Without an embedding, or with write-behind disabled, this is a plain `upsert`.
+        """
+        if not self.enabled or self.col is None:
+            return
+        if self.write_batch <= 1 or embedding is None:
+            self.upsert(text, metadata, embedding=embedding)
+            return
+        with self._pending_cv:
+            if not self._pending:
+                self._pending_since = time.perf_counter()
+            self._pending.append((self._make_id(text, metadata), text, metadata, embedding))
+            self.write_counts["queued"] += 1
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._writer_loop, name="vstore-writer", daemon=True)
+                self._writer.start()
+                atexit.register(self.flush)
+            self._pending_cv.notify()
+
+    def flush(self, raise_errors: bool = False) -> int:
+        """
+        Write everything queued so far through `upsert_bulk` (serialised with the
+        background writer). Returns the number of documents written.
+
+        If the write fails the rows stay queued for the next flush; the error is
+        logged (or re-raised with `raise_errors`) and 0 is returned.
+        """
+        with self._write_lock:
+            with self._pending_cv:
+                batch = list(self._pending)
+            if not batch:
+                return 0
+            try:
+                self.upsert_bulk(
+                    texts=[b[1] for b in batch],
+                    metadatas=[b[2] for b in batch],
+                    ids=[b[0] for b in batch],
+                    embeddings=[b[3] for b in batch],
+                    raise_errors=True,
+                )
+            except Exception as e:
+                with self._pending_cv:
+                    self.write_counts["failed_flushes"] += 1
+                if raise_errors:
+                    raise
+                console.print(f"[warn] Vector write-behind flush failed ({len(batch)} queued): {e}")
+                return 0
+            with self._pending_cv:
+                # drop what was written; anything queued meanwhile stays pending
+                del self._pending[:len(batch)]
+                if self._pending:
+                    self._pending_since = time.perf_counter()
+                self.write_counts["written"] += len(batch)
+                self.write_counts["flushes"] += 1
+            return len(batch)
+
+    def _writer_loop(self) -> None:
+        while True:
+            with self._pending_cv:
+                while True:
+                    age = time.perf_counter() - self._pending_since
+                    if self._pending and (len(self._pending) >= self.write_batch or age >= self.write_delay_s):
+                        break
+                    self._pending_cv.wait(timeout=max(self.write_delay_s - age, 0.05) if self._pending else None)
+            try:
+                self.flush(raise_errors=True)
+            except Exception as e:  # keep the writer alive; the rows stay queued
+                console.print(f"[warn] Vector write-behind flush failed: {e}")
+                time.sleep(max(self.write_delay_s, 1.0))
+
+    def _merge_overlay(
+        self,
+        results: List[List[Dict[str, Any]]],
+        idx: List[int],
+        texts: List[str],
+        embeddings: Any,
+        k: int,
+        where: Optional[Dict[str, Any]],
+    ) -> None:
+        # Blend queued (not yet written) documents into query results, by the same
+        # squared-L2 distance Chroma uses; a queued copy supersedes the stored one.
+        with self._pending_cv:
+            latest = {b[0]: b for b in self._pending}
+        ticker = (where or {}).get("ticker")
+        pending = [b for b in latest.values() if not ticker or b[2].get("ticker") == ticker]
+        if not pending:
+            return
+        import numpy as np
+
+        P = np.asarray([_as_vector(b[3]) for b in pending], dtype="float32")
+        if embeddings is not None:
+            Q = np.asarray([_as_vector(embeddings[i]) for i in idx], dtype="float32")
+        else:
+            Q = embed_texts([texts[i] for i in idx])
+        dist = (Q * Q).sum(axis=1)[:, None] + (P * P).sum(axis=1)[None, :] - 2.0 * Q @ P.T
+        for row, i in enumerate(idx):
+            stored = [d for d in results[i] if d.get("id") not in latest]
+            queued = [
+                {"id": b[0], "text": b[1], "metadata": b[2], "distance": float(max(dist[row, j], 0.0))}
+                for j, b in enumerate(pending)
+            ]
+            merged = stored + queued
+            merged.sort(key=lambda d: d["distance"] if d["distance"] is not None else float("inf"))
+            results[i] = merged[:max(1, k)]
+
+    def write_stats(self) -> Dict[str, Any]:
+        with self._pending_cv:
+            pending = len(self._pending)
+        return {
+            "backend": self.backend_name,
+            "write_batch": self.write_batch,
+            "write_delay_ms": round(self.write_delay_s * 1000, 1),
+            "pending": pending,
+            **self.write_counts,
+        }
+
+    def dump(self, limit: Optional[int] = None, embeddings: bool = True) -> Dict[str, Any]:
+        """
+        Stored documents (for offline evaluation / maintenance).
+
+        Returns:
+            {"ids": [...], "texts": [...], "metadatas": [...], "embeddings": [...] or None}
+        """
+        if not self.enabled or self.col is None:
+            return {"ids": [], "texts": [], "metadatas": [], "embeddings": None}
+        include = ["documents", "metadatas"] + (["embeddings"] if embeddings else [])
+        res = self.col.get(limit=limit, include=include)
+        return {
+            "ids": list(res.get("ids") or []),
+            "texts": list(res.get("documents") or []),
+            "metadatas": list(res.get("metadatas") or []),
+            "embeddings": res.get("embeddings") if embeddings else None,
+        }
+
+    def migrate_ids(self, batch: int = 1000) -> Dict[str, Any]:
+        """
+        One-shot migration to content-addressed ids: every group of documents that maps
+        to the same `_make_id` collapses into one, keeping the latest label and stored
+        vector, the earliest first_seen, the latest last_seen and the summed hit_count.
+        Seed documents keep their ids.
+
+        Returns:
+            {"documents_before", "documents_after", "duplicates_collapsed", "ids_rewritten"}
+        """
+        data = self.dump()
+        if not data["ids"]:
+            return {"documents_before": 0, "documents_after": 0, "duplicates_collapsed": 0, "ids_rewritten": 0}
+        groups: Dict[str, List[int]] = {}
+        for i, (id_, text, meta) in enumerate(zip(data["ids"], data["texts"], data["metadatas"])):
+            target = id_ if id_.startswith("seed-") else self._make_id(text, meta or {})
+            groups.setdefault(target, []).append(i)
+
+        new_ids, texts, metas, vectors, stale = [], [], [], [], []
+        for target, members in groups.items():
+            if len(members) == 1 and data["ids"][members[0]] == target:
+                continue  # already migrated
+            metas_in = [data["metadatas"][i] or {} for i in members]
+            times = [m.get("last_seen") or m.get("time") or "" for m in metas_in]
+            latest = members[max(range(len(members)), key=lambda j: times[j])]
+            firsts = [m.get("first_seen") or m.get("time") or "" for m in metas_in]
+            first = min((t for t in firsts if t), default=datetime.utcnow().isoformat())
+            new_ids.append(target)
+            texts.append(data["texts"][latest])
+            vectors.append(_as_vector(data["embeddings"][latest]))
+            metas.append(
+                (data["metadatas"][latest] or {})
+                | {
+                    "time": max(times) or first,
+                    "first_seen": first,
+                    "last_seen": max(times) or first,
+                    "hit_count": sum(int(m.get("hit_count", 1)) for m in metas_in),
+                }
+            )
+            stale.extend(data["ids"][i] for i in members if data["ids"][i] != target)
+
+        for start in range(0, len(new_ids), batch):
+            end = start + batch
+            self.col.upsert(
+                ids=new_ids[start:end], documents=texts[start:end],
+                metadatas=metas[start:end], embeddings=vectors[start:end],
+            )
+        self._delete(stale, batch)
+        if self.partitioned and new_ids:
+            self._upsert_partitions(new_ids, texts, metas, vectors)
+        return {
+            "documents_before": len(data["ids"]),
+            "documents_after": self.col.count(),
+            "duplicates_collapsed": len(data["ids"]) - len(groups),
+            "ids_rewritten": len(new_ids),
+        }
+
+    def retention_victims(self) -> List[str]:
+        """
+        Ids the retention policy would delete: documents not seen (last_seen, else time)
+        within `max_age_days`, then all but the `max_per_ticker` most recently seen per
+        ticker. Seed documents are never returned.
+        """
+        data = self.dump(embeddings=False)
+        cutoff = (
+            datetime.utcfromtimestamp(time.time() - self.max_age_days * 86400).isoformat()
+            if self.max_age_days > 0 else ""
+        )
+        victims: List[str] = []
+        by_ticker: Dict[str, List[Tuple[str, str]]] = {}
+        for id_, meta in zip(data["ids"], data["metadatas"]):
+            if id_.startswith("seed-"):
+                continue
+            meta = meta or {}
+            seen = str(meta.get("last_seen") or meta.get("time") or "")
+            if cutoff and seen < cutoff:
+                victims.append(id_)
+            else:
+                by_ticker.setdefault(str(meta.get("ticker", "NA")), []).append((seen, id_))
+        if self.max_per_ticker > 0:
+            for docs in by_ticker.values():
+                docs.sort(reverse=True)
+                victims.extend(id_ for _, id_ in docs[self.max_per_ticker:])
+        return victims
+
+    def enforce_retention(self, batch: int = 1000) -> int:
+        """
+        Apply the retention policy with bulk deletes. Returns the number of documents deleted.
+        """
+        if not self.enabled or self.col is None or not (self.max_age_days > 0 or self.max_per_ticker > 0):
+            return 0
+        victims = self.retention_victims()
+        self._delete(victims, batch)
+        return len(victims)
+
+    def disk_bytes(self) -> int:
+        total = 0
+        for root, _, files in os.walk(self.path):
+            for name in files:
+                try:
+                    total += os.path.getsize(os.path.join(root, name))
+                except OSError:
+                    pass
+        return total
 
     @staticmethod
     def _make_id(text: str, metadata: Dict[str, Any]) -> str:
-        # compact deterministic id
-        t = metadata.get("ticker", "NA")
-        ts = metadata.get("time", datetime.utcnow().isoformat())
-        base = f"{t}-{ts}-{text[:64]}"
-        return base.replace(" ", "_").replace("/", "_")
+        # content-addressed: one document per (ticker, normalised headline)
+        t = str(metadata.get("ticker") or "NA").upper()
+        digest = hashlib.sha1(normalize_headline(text).encode("utf-8")).hexdigest()[:20]
+        return f"{t}-{digest}"
+
+
+def _as_vector(vec: Any) -> List[float]:
+    # plain lists, like HFEmbeddingFn: older Chroma releases reject ndarray rows
+    return vec.tolist() if hasattr(vec, "tolist") else list(vec)
+
+
+# Global vector store (connects lazily on first use)
+VSTORE = VectorStore(
+    path=os.getenv("CHROMA_PATH", "./rag_store"),
+    max_age_days=float(os.getenv("VSTORE_MAX_AGE_DAYS", "180")),
+    max_per_ticker=int(os.getenv("VSTORE_MAX_PER_TICKER", "2000")),
+    write_batch=int(os.getenv("VSTORE_WRITE_BATCH", "64")),
+    write_delay_ms=float(os.getenv("VSTORE_WRITE_DELAY_MS", "2000")),
+    partition=os.getenv("VSTORE_PARTITION", "none").lower(),
+    partition_min_docs=int(os.getenv("VSTORE_PARTITION_MIN_DOCS", "20")),
+    backend=os.getenv("VSTORE_BACKEND", "auto").lower(),
+)
+
+
+# ===========================
+# Persistent caches
+# ===========================
+class DiskCache:
+    """
+    Small persistent key -> JSON-value cache on SQLite with LRU eviction.
+
+    Keys are content hashes built by `make_key`. Every read refreshes the entry's
+    access time; once the table holds more than `max_entries` rows the least
+    recently used ones are deleted. Entries older than `ttl_s` (if set) count as
+    misses. The database is opened on first use; `max_entries <= 0` disables the cache.
+    """
+
+    def __init__(self, path: str, table: str, max_entries: int, ttl_s: Optional[float] = None) -> None:
+        self.path = path
+        self.table = table
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._db: Any = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    @staticmethod
+    def make_key(*parts: Any) -> str:
+        return hashlib.sha256(json.dumps(parts, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()
+
+    def _conn(self) -> Any:
+        if self._db is None:
+            import sqlite3
+
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            self._db.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_accessed ON {self.table}(accessed)")
+        return self._db
+
+    def get(self, key: str) -> Any:
+        """
+        Return the cached value for `key`, or None on a miss (or expired entry).
+        """
+        if not self.enabled:
+            return None
+        try:
+            with self._lock:
+                db = self._conn()
+                row = db.execute(f"SELECT value, created FROM {self.table} WHERE key = ?", (key,)).fetchone()
+                now = time.time()
+                if row is not None and self.ttl_s and now - row[1] > self.ttl_s:
+                    db.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                    row = None
+                if row is None:
+                    self.misses += 1
+                    return None
+                db.execute(f"UPDATE {self.table} SET accessed = ? WHERE key = ?", (now, key))
+                self.hits += 1
+                return json.loads(row[0])
+        except Exception as e:  # a broken cache must never break a request
+            console.print(f"[warn] Cache read failed ({self.table}): {e}")
+            return None
+
+    def put(self, key: str, value: Any) -> None:
+        if not self.enabled:
+            return
+        try:
+            with self._lock:
+                db = self._conn()
+                now = time.time()
+                db.execute(
+                    f"INSERT OR REPLACE INTO {self.table} (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(value, ensure_ascii=False), now, now),
+                )
+                (count,) = db.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()
+                if count > self.max_entries:
+                    excess = count - self.max_entries
+                    db.execute(
+                        f"DELETE FROM {self.table} WHERE key IN "
+                        f"(SELECT key FROM {self.table} ORDER BY accessed ASC LIMIT ?)",
+                        (excess,),
+                    )
+                    self.evictions += excess
+        except Exception as e:
+            console.print(f"[warn] Cache write failed ({self.table}): {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        entries = None
+        if self.enabled and self._db is not None:
+            with self._lock:
+                (entries,) = self._db.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            "entries": entries,
+            "evictions": self.evictions,
+        }
+
+
+def _package_version(name: str) -> str:
+    try:
+        from importlib.metadata import version
+
+        return version(name)
+    except Exception:
+        return "unknown"
+
 
+class EmbeddingCache:
+    """
+    Content-addressed embedding cache shared by every embedding call site (and process).
+
+    Two append-only files per embedding model/backend and dtype (each in its own
+    directory): `index.bin` holds one 16-byte text digest per row, `vectors.<dtype>`
+    the rows themselves. Row i of the index
+    names row i of the vectors, so no other bookkeeping is needed. Vectors are read
+    through a read-only memory map, so worker processes share the OS page cache
+    instead of each holding a copy. Appends take an exclusive file lock, write the
+    vectors before their digests, and never rewrite existing rows, so readers only
+    ever see complete rows.
+    """
+
+    _DIGEST = 16
+
+    def __init__(self, root: str, namespace: str, dtype: str = "float32") -> None:
+        # the dtype is part of the directory: index.bin rows must match the vectors file
+        self.dir = os.path.join(root, namespace.replace("/", "__"), dtype) if root else ""
+        self.dtype = dtype
+        self.hits = 0
+        self.misses = 0
+        self._rows: Dict[bytes, int] = {}
+        self._index_bytes = 0  # how much of index.bin has been read into _rows
+        self._dim: Optional[int] = None
+        self._mm: Any = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.dir) and self.dtype in ("float32", "float16")
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.dir, name)
+
+    @classmethod
+    def _digest(cls, text: str) -> bytes:
+        return hashlib.sha256(text.encode("utf-8")).digest()[:cls._DIGEST]
+
+    def _refresh(self) -> None:
+        # Pick up rows appended (by any process) since the last read.
+        try:
+            with open(self._path("index.bin"), "rb") as fh:
+                fh.seek(self._index_bytes)
+                tail = fh.read()
+        except FileNotFoundError:
+            return
+        tail = tail[: len(tail) - len(tail) % self._DIGEST]
+        start = self._index_bytes // self._DIGEST
+        for j in range(0, len(tail), self._DIGEST):
+            self._rows.setdefault(tail[j:j + self._DIGEST], start + j // self._DIGEST)
+        self._index_bytes += len(tail)
+        if self._dim is None and os.path.exists(self._path("meta.json")):
+            with open(self._path("meta.json")) as fh:
+                meta = json.load(fh)
+            if meta.get("dtype", self.dtype) != self.dtype:
+                raise ValueError(f"{self.dir} holds {meta['dtype']} vectors, not {self.dtype}")
+            self._dim = int(meta["dim"])
+
+    def _matrix(self, need_rows: int) -> Any:
+        import numpy as np
+
+        if self._mm is None or self._mm.shape[0] < need_rows:
+            rows = self._index_bytes // self._DIGEST
+            self._mm = np.memmap(self._path(f"vectors.{self.dtype}"), dtype=self.dtype, mode="r", shape=(rows, self._dim))
+        return self._mm
+
+    def get_many(self, texts: List[str]) -> Tuple[List[Any], List[int]]:
+        """
+        Look up `texts`. Returns (one float32 vector or None per text, indices of the misses).
+        """
+        import numpy as np
+
+        found: List[Any] = [None] * len(texts)
+        if not self.enabled:
+            return found, list(range(len(texts)))
+        try:
+            with self._lock:
+                digests = [self._digest(t) for t in texts]
+                if any(d not in self._rows for d in digests):
+                    self._refresh()
+                rows = [self._rows.get(d) for d in digests]
+                present = [r for r in rows if r is not None]
+                if present:
+                    mm = self._matrix(max(present) + 1)
+                    for i, r in enumerate(rows):
+                        if r is not None:
+                            found[i] = np.asarray(mm[r], dtype="float32")
+        except Exception as e:  # a broken cache must never break a request
+            console.print(f"[warn] Embedding cache read failed: {e}")
+        missing = [i for i, v in enumerate(found) if v is None]
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+        return found, missing
+
+    def put_many(self, texts: List[str], vectors: Any) -> None:
+        """
+        Append vectors for texts not stored yet (under an exclusive file lock).
+        """
+        import numpy as np
+
+        if not self.enabled or not texts:
+            return
+        try:
+            import fcntl
+        except ImportError:  # Windows: in-process lock only
+            fcntl = None  # type: ignore[assignment]
+        try:
+            with self._lock:
+                os.makedirs(self.dir, exist_ok=True)
+                with open(self._path("lock"), "a") as lock:
+                    if fcntl is not None:
+                        fcntl.flock(lock, fcntl.LOCK_EX)
+                    self._refresh()
+                    vectors = np.asarray(vectors, dtype="float32")
+                    if self._dim is None:
+                        self._dim = int(vectors.shape[1])
+                        with open(self._path("meta.json"), "w") as fh:
+                            json.dump({"dim": self._dim, "dtype": self.dtype}, fh)
+                    new: Dict[bytes, int] = {}
+                    for i, t in enumerate(texts):
+                        d = self._digest(t)
+                        if d not in self._rows:
+                            new.setdefault(d, i)
+                    if not new:
+                        return
+                    rows = self._index_bytes // self._DIGEST
+                    block = np.ascontiguousarray(vectors[list(new.values())], dtype=self.dtype)
+                    with open(self._path(f"vectors.{self.dtype}"), "r+b" if rows else "wb") as fh:
+                        # Truncate any half-written tail left by a crashed writer.
+                        fh.truncate(rows * self._dim * block.itemsize)
+                        fh.seek(0, os.SEEK_END)
+                        fh.write(block.tobytes())
+                    with open(self._path("index.bin"), "ab") as fh:
+                        fh.write(b"".join(new.keys()))
+                    self._refresh()
+        except Exception as e:
+            console.print(f"[warn] Embedding cache write failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            "rows": len(self._rows),
+            "dtype": self.dtype,
+        }
+
+
+# Embeddings depend on the exact text, the model and the runtime (ONNX/int8 differ
+# slightly from PyTorch), so each model/backend pair gets its own files.
+EMBED_CACHE = EmbeddingCache(
+    root=os.getenv("EMBED_CACHE_DIR", "./cache/embeddings"),
+    namespace=f"{EMBED_MODEL}-{ENCODER_BACKEND}",
+    dtype=os.getenv("EMBED_CACHE_DTYPE", "float32").lower(),
+)
+
+
+# Generations are deterministic (do_sample=False), so output depends only on the
+# model version, the prompt and the generation settings -- safe to cache on disk.
+GEN_CACHE = DiskCache(
+    path=os.getenv("GEN_CACHE_PATH", "./cache/generations.sqlite"),
+    table="generations",
+    max_entries=int(os.getenv("GEN_CACHE_MAX_ENTRIES", "20000")),
+)
+
+
+def _generation_key(model: str, precision: str, prompt: str, **gen_kwargs: Any) -> str:
+    """
+    Cache key covering everything that can change a greedy generation. Swapping
+    GEN_MODEL / GEN_PRECISION (or upgrading transformers) yields new keys, so stale
+    entries are simply never hit again and age out through LRU eviction.
+    """
+    version = (model, precision, os.getenv("GEN_MODEL_REVISION", "main"), _package_version("transformers"))
+    return DiskCache.make_key("generate", version, prompt, sorted(gen_kwargs.items()))
+
+
+# ===========================
+# Repetition-aware stopping
+# ===========================
+def _parse_repeat_stop(spec: str) -> Dict[str, Optional[Tuple[int, int]]]:
+    """
+    Parse REPEAT_STOP, e.g. "default=2x48,rag=2x24,critique=off".
+
+    Each entry is <node>=<repeats>x<max_period> (or "off"): decoding stops once the
+    last `max_period` tokens or fewer form a block repeated `repeats` times in a row.
+    """
+    config: Dict[str, Optional[Tuple[int, int]]] = {}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        node, _, value = part.partition("=")
+        bad = f"REPEAT_STOP entry {part!r}: expected <node>=<repeats>x<max_period> (e.g. draft=2x48) or <node>=off"
+        if not node.strip():
+            raise ValueError(bad)
+        if value.strip().lower() in ("off", "0", "none"):
+            config[node.strip()] = None
+            continue
+        repeats, _, period = value.lower().partition("x")
+        try:
+            config[node.strip()] = (max(2, int(repeats)), max(4, int(period)))
+        except ValueError:
+            raise ValueError(bad) from None
+    return config
+
+
+# Nodes: draft, critique, final, rag (per-headline relabel); "default" covers the rest.
+REPEAT_STOP = _parse_repeat_stop(os.getenv("REPEAT_STOP", "default=2x48,rag=2x24"))
+_MIN_LOOP_PERIOD = 3  # shorter loops ("!!", "the the") need 2 extra repeats to count
+
+
+class RepetitionStats:
+    """
+    Per-node counters for repetition-triggered early stops and decode tokens saved.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.nodes: Dict[str, Dict[str, int]] = {}
+
+    def record(self, node: str, stopped: bool, tokens_saved: int) -> None:
+        with self._lock:
+            c = self.nodes.setdefault(node, {"calls": 0, "early_stops": 0, "tokens_saved": 0})
+            c["calls"] += 1
+            c["early_stops"] += int(stopped)
+            c["tokens_saved"] += tokens_saved
+
+    def report(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {node: dict(c) for node, c in self.nodes.items()}
+
+
+REPETITION_STATS = RepetitionStats()
+
+
+def _loop_period(ids: List[int], repeats: int, max_period: int) -> int:
+    """
+    Return the period p if `ids` ends with a block of p tokens repeated `repeats`
+    times back to back (blocks under 8 tokens need 2 more repeats), else 0.
+    """
+    n = len(ids)
+    for p in range(_MIN_LOOP_PERIOD, min(max_period, n // repeats) + 1):
+        need = repeats if p >= 8 else repeats + 2
+        if p * need > n:
+            continue
+        tail = ids[n - p:]
+        if all(ids[n - (k + 1) * p:n - k * p] == tail for k in range(1, need)):
+            return p
+    return 0
+
+
+def make_repetition_stop(
+    repeats: int, max_period: int, max_new_tokens: int, stop_ids: Tuple[Optional[int], ...] = ()
+) -> Any:
+    """
+    Build a transformers StoppingCriteria that ends decoding of a sequence as soon
+    as it starts looping (same sentence or n-gram block repeated back to back).
+
+    `stop_ids` are the EOS / pad token ids: in a padded batch, rows that already
+    finished keep receiving pad tokens, which must not count as a loop.
+
+    The instance remembers, per batch row, how many tokens had been generated when
+    it fired, so callers can compute the decode steps saved.
+    """
+    import torch
+    from transformers import StoppingCriteria
+
+    finished = {t for t in stop_ids if t is not None}
+
+    class RepetitionStop(StoppingCriteria):
+        def __init__(self) -> None:
+            self.stopped_at: Dict[int, int] = {}
+
+        def __call__(self, input_ids: Any, scores: Any, **kwargs: Any) -> Any:
+            done = []
+            for row, seq in enumerate(input_ids.tolist()):
+                if row in self.stopped_at:
+                    done.append(True)
+                    continue
+                seq = seq[1:]  # skip decoder start token
+                if any(t in finished for t in seq):  # row already emitted EOS (pads follow)
+                    done.append(True)
+                    continue
+                looping = _loop_period(seq, repeats, max_period) > 0
+                if looping:
+                    self.stopped_at[row] = len(seq)
+                done.append(looping)
+            return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
+
+        def tokens_saved(self, row: int = 0) -> int:
+            return max(0, max_new_tokens - self.stopped_at[row]) if row in self.stopped_at else 0
+
+    return RepetitionStop()
+
+
+def _trim_repetition(text: str) -> str:
+    """
+    Drop sentences that repeat an earlier one (keeps the first occurrence), so an
+    early-stopped loop reads as a single statement.
+    """
+    seen: set = set()
+    kept = []
+    for sentence in re.split(r"(?<=[.!?])\s+", text.strip()):
+        norm = " ".join(sentence.lower().split())
+        if norm and norm in seen:
+            continue
+        seen.add(norm)
+        kept.append(sentence)
+    return " ".join(kept)
+
+
+# ===========================
+# Token streaming
+# ===========================
+# Set for the duration of a streamed workflow run: called as sink(node, text_chunk)
+# from the generating thread for every decoded chunk.
+TOKEN_SINK: ContextVar[Optional[Callable[[str, str], None]]] = ContextVar("TOKEN_SINK", default=None)
+
+
+def _generate_streaming(pipe: Any, prompt: str, sink: Callable[[str, str], None], node: str, **gen_kwargs: Any) -> Any:
+    """
+    Run `pipe` on a worker thread with a TextIteratorStreamer and forward each decoded
+    chunk to `sink` as it arrives. Returns the pipeline output (same as a plain call).
+    """
+    from transformers import TextIteratorStreamer
+
+    streamer = TextIteratorStreamer(pipe.tokenizer, skip_prompt=True, skip_special_tokens=True)
+    result: Dict[str, Any] = {}
+
+    def run() -> None:
+        try:
+            result["out"] = pipe(prompt, streamer=streamer, **gen_kwargs)
+        except Exception as e:
+            result["err"] = e
+            streamer.end()  # unblock the consumer loop below
+
+    worker = threading.Thread(target=run, name=f"stream-{node}", daemon=True)
+    worker.start()
+    for chunk in streamer:
+        if chunk:
+            sink(node, chunk)
+    worker.join()
+    if "err" in result:
+        raise result["err"]
+    return result["out"]
+
+
+def _output_text(out: Any) -> str:
+    """
+    Text from one pipeline result ([{"generated_text": ...}] or {"generated_text": ...}).
+    """
+    if isinstance(out, list):
+        out = out[0] if out else ""
+    if isinstance(out, dict):
+        text = out.get("generated_text") or out.get("summary_text")
+        return (text or str(out)).strip()
+    return str(out).strip()
+
+
+def _run_generation(
+    pipe: Any,
+    prompts: List[str],
+    max_new_tokens: int,
+    stop_cfg: Optional[Tuple[int, int]],
+    sink: Optional[Callable[[str, str], None]] = None,
+    node: str = "default",
+) -> List[Tuple[str, bool, int]]:
+    """
+    Greedy generation for one prompt, or several as a single padded batch, with the
+    repetition stop attached (and tokens streamed to `sink` for a single prompt).
+
+    Returns:
+        One (text, stopped_early, tokens_saved) per prompt, in order.
+    """
+    gen_kwargs: Dict[str, Any] = {"max_new_tokens": max_new_tokens, "do_sample": False}
+    stopper = None
+    if stop_cfg is not None:
+        from transformers import StoppingCriteriaList
+
+        tok = getattr(pipe, "tokenizer", None)
+        stop_ids = (getattr(tok, "eos_token_id", None), getattr(tok, "pad_token_id", None))
+        stopper = make_repetition_stop(*stop_cfg, max_new_tokens=max_new_tokens, stop_ids=stop_ids)
+        gen_kwargs["stopping_criteria"] = StoppingCriteriaList([stopper])
+
+    if sink is not None and len(prompts) == 1:
+        outputs = [_generate_streaming(pipe, prompts[0], sink, node, **gen_kwargs)]
+    elif len(prompts) == 1:
+        outputs = [pipe(prompts[0], **gen_kwargs)]
+    else:
+        outputs = pipe(prompts, batch_size=len(prompts), **gen_kwargs)
+
+    results = []
+    for row, out in enumerate(outputs):
+        stopped = stopper is not None and row in stopper.stopped_at
+        results.append((_output_text(out), stopped, stopper.tokens_saved(row) if stopped else 0))
+    return results
+
+
+# ===========================
+# Dynamic micro-batching (HTTP/SSE)
+# ===========================
+class GenerationBatcher:
+    """
+    Dynamic micro-batching for generator/critic calls under concurrent load.
+
+    Callers block in `generate`. A single scheduler thread takes the first waiting
+    request, keeps collecting for up to `window_ms` (or until `max_batch` are waiting),
+    groups them by underlying pipeline and generation settings, and runs each group
+    as one padded batch. Only active once `activate()` is called (http/sse transports);
+    a lone stdio/CLI caller would just pay the window.
+    """
+
+    def __init__(self, window_ms: float, max_batch: int) -> None:
+        self.window_s = window_ms / 1000.0
+        self.max_batch = max_batch
+        self.active = False
+        self._queue: "queue.Queue[Tuple[Any, ...]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.requests = 0
+        self._fill: deque = deque(maxlen=2000)
+        self._delays_ms: deque = deque(maxlen=2000)
+
+    @property
+    def enabled(self) -> bool:
+        return self.active and self.window_s > 0 and self.max_batch > 1
+
+    def activate(self) -> None:
+        self.active = True
+
+    def generate(
+        self, pipe: Any, prompt: str, max_new_tokens: int, stop_cfg: Optional[Tuple[int, int]]
+    ) -> Tuple[str, bool, int]:
+        """
+        Queue one prompt and wait for its (text, stopped_early, tokens_saved).
+        """
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="gen-batcher", daemon=True)
+                self._thread.start()
+        fut: Future = Future()
+        self._queue.put((pipe, prompt, max_new_tokens, stop_cfg, time.perf_counter(), fut))
+        return fut.result()
+
+    def _loop(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.perf_counter() + self.window_s
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            groups: Dict[Tuple[Any, ...], List[Tuple[Any, ...]]] = {}
+            for item in batch:
+                pipe, _, max_new_tokens, stop_cfg = item[:4]
+                try:
+                    target = id(pipe.load()) if hasattr(pipe, "load") else id(pipe)
+                except Exception as e:  # model failed to load: fail just this request
+                    item[5].set_exception(e)
+                    continue
+                groups.setdefault((target, max_new_tokens, stop_cfg), []).append(item)
+            for items in groups.values():
+                self._run(items)
+
+    def _run(self, items: List[Tuple[Any, ...]]) -> None:
+        started = time.perf_counter()
+        with self._lock:
+            self.batches += 1
+            self.requests += len(items)
+            self._fill.append(len(items) / self.max_batch)
+            self._delays_ms.extend((started - item[4]) * 1000 for item in items)
+        pipe, _, max_new_tokens, stop_cfg = items[0][:4]
+        try:
+            results = _run_generation(pipe, [item[1] for item in items], max_new_tokens, stop_cfg)
+        except Exception as e:
+            for item in items:
+                item[5].set_exception(e)
+            return
+        for item, result in zip(items, results):
+            item[5].set_result(result)
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            delays = sorted(self._delays_ms)
+            fill = list(self._fill)
+        return {
+            "enabled": self.enabled,
+            "window_ms": round(self.window_s * 1000, 1),
+            "max_batch": self.max_batch,
+            "batches": self.batches,
+            "requests": self.requests,
+            "mean_batch_size": round(self.requests / self.batches, 2) if self.batches else None,
+            "fill_rate": round(sum(fill) / len(fill), 3) if fill else None,
+            "queue_delay_ms_mean": round(sum(delays) / len(delays), 1) if delays else None,
+            "queue_delay_ms_p95": round(delays[int(0.95 * (len(delays) - 1))], 1) if delays else None,
+        }
+
+
+BATCHER = GenerationBatcher(
+    window_ms=float(os.getenv("GEN_BATCH_WINDOW_MS", "25")),
+    max_batch=int(os.getenv("GEN_BATCH_MAX", "8")),
+)
+
+
+def _cached_generate(
+    pipe: Any, model: str, precision: str, prompt: str, max_new_tokens: int, node: str = "default"
+) -> str:
+    """
+    Greedy generation through `pipe`, answered from GEN_CACHE when possible, with
+    the node's repetition stop (REPEAT_STOP) attached. When a TOKEN_SINK is set the
+    tokens are streamed to it as they are decoded (a cache hit is sent as one chunk).
+    Under HTTP/SSE the call is micro-batched with concurrent ones instead; batched
+    rows cannot be streamed token by token, so the sink then gets the whole text.
+    Raises on generation failure (failures are never cached).
+    """
+    sink = TOKEN_SINK.get()
+    stop_cfg = REPEAT_STOP.get(node, REPEAT_STOP.get("default"))
+    key = _generation_key(model, precision, prompt, max_new_tokens=max_new_tokens, repeat_stop=stop_cfg)
+    cached = GEN_CACHE.get(key)
+    if cached is not None:
+        if sink is not None:
+            sink(node, cached)
+        return cached
+
+    if BATCHER.enabled:
+        text, stopped, saved = BATCHER.generate(pipe, prompt, max_new_tokens, stop_cfg)
+        if sink is not None:
+            sink(node, text)
+    else:
+        text, stopped, saved = _run_generation(pipe, [prompt], max_new_tokens, stop_cfg, sink=sink, node=node)[0]
 
-# Global vector store
-VSTORE = VectorStore(path=os.getenv("CHROMA_PATH", "./rag_store"))
+    REPETITION_STATS.record(node, stopped=stopped, tokens_saved=saved)
+    if stopped:
+        text = _trim_repetition(text)
+        console.print(f"[muted]{node}: repetition loop stopped early, saved {saved} decode tokens[/]")
+    GEN_CACHE.put(key, text)
+    return text
 
 
 # ===========================
 # Data & generation helpers
 # ===========================
-def hf_generate(prompt: str, max_new_tokens: int = 256) -> str:
+def hf_generate(prompt: str, max_new_tokens: int = 256, node: str = "default") -> str:
     """
-    Generate text from a prompt using the configured transformers pipeline.
+    Generate text from a prompt using the configured transformers pipeline
+    (served from the persistent generation cache when the same call ran before).
+    `node` selects the repetition-stop settings (see REPEAT_STOP).
     """
     try:
-        outputs = generator_pipeline(
-            prompt, max_new_tokens=max_new_tokens, do_sample=False
-        )
-        if isinstance(outputs, list) and outputs:
-            text = outputs[0].get("generated_text") or outputs[0].get("summary_text")
-            return (text or str(outputs[0])).strip()
-        return str(outputs)
+        return _cached_generate(generator_pipeline, GEN_MODEL, GEN_PRECISION, prompt, max_new_tokens, node)
     except Exception as e:  # pragma: no cover
         console.print(f"[warn] Generation failed: {e}")
         return f"[GENERATION FAILED] {prompt[:200]}"
 
 
-def hf_critic(prompt: str, max_new_tokens: int = 200) -> str:
+def hf_generate_batch(prompts: List[str], max_new_tokens: int = 256, node: str = "default") -> List[str]:
     """
-    Critic LLM generation (can be a different model than the drafter).
+    `hf_generate` for several prompts: cache hits are answered from disk and the
+    misses run through the generator as one padded batch (not streamed).
     """
+    stop_cfg = REPEAT_STOP.get(node, REPEAT_STOP.get("default"))
+    keys = [
+        _generation_key(GEN_MODEL, GEN_PRECISION, p, max_new_tokens=max_new_tokens, repeat_stop=stop_cfg)
+        for p in prompts
+    ]
+    texts: List[Optional[str]] = [GEN_CACHE.get(key) for key in keys]
+    missing = [i for i, text in enumerate(texts) if text is None]
+    if not missing:
+        return [text or "" for text in texts]
     try:
-        out = critic_pipeline(prompt, max_new_tokens=max_new_tokens, do_sample=False)
-        text = out[0].get("generated_text") or out[0].get("summary_text")
-        return (text or str(out[0])).strip()
+        outs = _run_generation(generator_pipeline, [prompts[i] for i in missing], max_new_tokens, stop_cfg)
+    except Exception as e:  # pragma: no cover
+        console.print(f"[warn] Batched generation failed: {e}")
+        for i in missing:
+            texts[i] = f"[GENERATION FAILED] {prompts[i][:200]}"
+        return [text or "" for text in texts]
+    for i, (text, stopped, saved) in zip(missing, outs):
+        REPETITION_STATS.record(node, stopped=stopped, tokens_saved=saved)
+        if stopped:
+            text = _trim_repetition(text)
+        GEN_CACHE.put(keys[i], text)
+        texts[i] = text
+    return [text or "" for text in texts]
+
+
+def hf_critic(prompt: str, max_new_tokens: int = 200, node: str = "critique") -> str:
+    """
+    Critic LLM generation (can be a different model than the drafter; cached like hf_generate).
+    """
+    try:
+        return _cached_generate(critic_pipeline, CRITIC_MODEL, CRITIC_PRECISION, prompt, max_new_tokens, node)
     except Exception as e:
         console.print(f"[warn] Critique generation failed: {e}")
         return "[CRITIC FAILED]"
@@ -327,6 +2287,8 @@ def fetch_price_and_history(ticker: str) -> Tuple[Optional[Dict[str, Any]], Opti
     Fetch latest close, daily change %, and a 1y history snapshot from yfinance.
     """
     try:
+        import yfinance as yf
+
         stock = yf.Ticker(ticker)
         hist = stock.history(period="1y")
         if hist.empty:
@@ -356,116 +2318,536 @@ def fetch_price_and_history(ticker: str) -> Tuple[Optional[Dict[str, Any]], Opti
         return None, None
 
 
-def fetch_pe_ratio(ticker: str) -> float | str:
+def fetch_pe_ratio(ticker: str) -> float | str:
+    """
+    Fetch trailing P/E ratio via yfinance .info (best effort).
+    """
+    try:
+        import yfinance as yf
+
+        stock = yf.Ticker(ticker)
+        pe = stock.info.get("trailingPE", "N/A")
+        return float(pe) if pe and pe != "N/A" else "N/A"
+    except Exception:  # pragma: no cover
+        return "N/A"
+
+
+def fetch_news(ticker: str, max_headlines: int = 5) -> List[Dict[str, Optional[str]]]:
+    """
+    Fetch recent news headlines from Google News RSS for the given ticker.
+    """
+    try:
+        url = f"https://news.google.com/rss/search?q={ticker}+stock"
+        feed = feedparser.parse(url)
+        articles = [{"title": entry.title, "link": entry.link} for entry in feed.entries[:max_headlines]]
+        return articles if articles else [{"title": f"No recent news for {ticker}", "link": None}]
+    except Exception as e:  # pragma: no cover
+        console.print(f"[warn] RSS fetch failed for {ticker}: {e}")
+        return [{"title": f"No recent news for {ticker}", "link": None}]
+
+
+# ===========================
+# Embedding sentiment head
+# ===========================
+# "rag" (classifier + retrieval + LLM escalation), "knn" (vote of stored neighbours)
+# or "head" (as rag, but base labels come from SentimentHead over the MiniLM embedding
+# instead of a second encoder).
+SENTIMENT_MODE = os.getenv("SENTIMENT_MODE", "rag").lower()
+SENTIMENT_LABELS = ("positive", "negative", "neutral")
+SENTIMENT_HEAD_PATH = os.getenv("SENTIMENT_HEAD_PATH", "./cache/sentiment_head.npz")
+
+
+class SentimentHead:
+    """
+    Multinomial logistic regression over EMBED_MODEL vectors, trained offline on the
+    labelled headlines in the vector store and kept as a small .npz file
+    (weights, bias, feature mean/std, label names, embedding model).
+    """
+
+    def __init__(self, W: Any, b: Any, mean: Any, std: Any, labels: List[str], embed_model: str) -> None:
+        self.W, self.b, self.mean, self.std = W, b, mean, std
+        self.labels = labels
+        self.embed_model = embed_model
+
+    @classmethod
+    def load(cls, path: str) -> "SentimentHead":
+        import numpy as np
+
+        with np.load(path, allow_pickle=False) as f:
+            return cls(
+                f["W"], f["b"], f["mean"], f["std"],
+                [str(x) for x in f["labels"]], str(f["embed_model"]),
+            )
+
+    def save(self, path: str) -> None:
+        import numpy as np
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        np.savez(
+            path, W=self.W, b=self.b, mean=self.mean, std=self.std,
+            labels=np.array(self.labels), embed_model=np.array(self.embed_model),
+        )
+
+    def predict_proba(self, X: Any) -> Any:
+        import numpy as np
+
+        z = ((np.asarray(X, dtype="float32") - self.mean) / self.std) @ self.W + self.b
+        z -= z.max(axis=1, keepdims=True)
+        e = np.exp(z)
+        return e / e.sum(axis=1, keepdims=True)
+
+    def classify(self, X: Any) -> List[Dict[str, Any]]:
+        probs = self.predict_proba(X)
+        return [{"label": self.labels[int(p.argmax())], "score": float(p.max())} for p in probs]
+
+    @classmethod
+    def fit(
+        cls, X: Any, y: List[str], embed_model: str, l2: float = 1e-3, epochs: int = 400
+    ) -> "SentimentHead":
+        """
+        Full-batch gradient descent on standardised features, class-balanced so a
+        store dominated by one label does not collapse the head onto it. The step size
+        is 1/L for the loss's Lipschitz bound, so it converges without tuning.
+        """
+        import numpy as np
+
+        X = np.asarray(X, dtype="float32")
+        labels = sorted(set(y))
+        Y = np.zeros((len(y), len(labels)), dtype="float32")
+        Y[np.arange(len(y)), [labels.index(v) for v in y]] = 1.0
+        mean, std = X.mean(axis=0), X.std(axis=0) + 1e-6
+        Xs = (X - mean) / std
+        sample_w = (1.0 / (Y.sum(axis=0) * len(labels)))[Y.argmax(axis=1)] * len(y)
+        lr = 1.0 / (0.5 * float(sample_w.max()) * np.linalg.norm(Xs, 2) ** 2 / len(y) + l2)
+        W = np.zeros((X.shape[1], len(labels)), dtype="float32")
+        b = np.zeros(len(labels), dtype="float32")
+        head = cls(W, b, mean, std, labels, embed_model)
+        for _ in range(epochs):
+            P = head.predict_proba(X)
+            G = (P - Y) * sample_w[:, None] / len(y)
+            W -= lr * (Xs.T @ G + l2 * W)
+            b -= lr * G.sum(axis=0)
+        return head
+
+
+_HEAD: Optional[SentimentHead] = None
+_HEAD_VERSION = ""
+_HEAD_LOADED = False
+_HEAD_LOCK = threading.Lock()
+
+
+def sentiment_head() -> Optional[SentimentHead]:
+    """
+    The trained head for SENTIMENT_MODE=head (loaded on first use), or None if there
+    is none for the current EMBED_MODEL -- callers then use the classifier.
+    """
+    global _HEAD, _HEAD_VERSION, _HEAD_LOADED
+    if SENTIMENT_MODE != "head":
+        return None
+    if not _HEAD_LOADED:
+        with _HEAD_LOCK:
+            if not _HEAD_LOADED:
+                try:
+                    head = SentimentHead.load(SENTIMENT_HEAD_PATH)
+                    if head.embed_model != EMBED_MODEL:
+                        raise ValueError(f"trained on {head.embed_model}, not {EMBED_MODEL}")
+                    st = os.stat(SENTIMENT_HEAD_PATH)
+                    _HEAD, _HEAD_VERSION = head, f"{st.st_size}-{int(st.st_mtime)}"
+                except Exception as e:
+                    console.print(f"[warn] Sentiment head unusable ({SENTIMENT_HEAD_PATH}: {e}); using the classifier")
+                _HEAD_LOADED = True
+    return _HEAD
+
+
+def train_sentiment_head(path: str = SENTIMENT_HEAD_PATH, holdout: float = 0.2) -> Dict[str, Any]:
+    """
+    Retrain the head from the labelled vectors in the vector store and save it.
+
+    Returns:
+        {"documents", "labels", "train_accuracy", "holdout_accuracy", "path"}
+    """
+    import numpy as np
+
+    data = VSTORE.dump()
+    if data["embeddings"] is None:
+        return {"documents": 0, "error": "vector store unavailable"}
+    rows = [
+        (emb, str((m or {}).get("sentiment", "")).lower())
+        for emb, m in zip(data["embeddings"], data["metadatas"])
+        if str((m or {}).get("sentiment", "")).lower() in SENTIMENT_LABELS
+    ]
+    if len({label for _, label in rows}) < 2:
+        return {"documents": len(rows), "error": "need labelled documents of at least two classes"}
+    X = np.asarray([emb for emb, _ in rows], dtype="float32")
+    y = [label for _, label in rows]
+
+    order = np.random.default_rng(0).permutation(len(y))
+    n_hold = int(len(y) * holdout) if len(y) >= 20 else 0
+    hold, train = order[:n_hold], order[n_hold:]
+    head = SentimentHead.fit(X[train], [y[i] for i in train], EMBED_MODEL)
+
+    def accuracy(idx: Any) -> Optional[float]:
+        if len(idx) == 0:
+            return None
+        preds = head.classify(X[idx])
+        return round(sum(p["label"] == y[i] for p, i in zip(preds, idx)) / len(idx), 3)
+
+    report = {
+        "documents": len(y),
+        "labels": {label: y.count(label) for label in head.labels},
+        "train_accuracy": accuracy(train),
+        "holdout_accuracy": accuracy(hold),
+    }
+    # Refit on everything for the saved head.
+    head = SentimentHead.fit(X, y, EMBED_MODEL) if n_hold else head
+    head.save(path)
+    return report | {"path": path}
+
+
+# ===========================
+# Batched headline sentiment
+# ===========================
+SENTIMENT_BATCH_SIZE = int(os.getenv("SENTIMENT_BATCH_SIZE", "32"))
+
+# Google News serves the same headlines for a ticker run after run, so labels (and the
+# RAG relabel, which costs a vector query plus an LLM call) are cached on disk per
+# normalised headline. Two tables: base classifier labels, and final RAG results.
+_SENTIMENT_CACHE_PATH = os.getenv("SENTIMENT_CACHE_PATH", "./cache/sentiment.sqlite")
+_SENTIMENT_CACHE_MAX = int(os.getenv("SENTIMENT_CACHE_MAX_ENTRIES", "50000"))
+_SENTIMENT_CACHE_TTL_S = float(os.getenv("SENTIMENT_CACHE_TTL_S", str(3 * 24 * 3600))) or None
+BASE_SENTIMENT_CACHE = DiskCache(_SENTIMENT_CACHE_PATH, "base_sentiment", _SENTIMENT_CACHE_MAX, _SENTIMENT_CACHE_TTL_S)
+RAG_SENTIMENT_CACHE = DiskCache(_SENTIMENT_CACHE_PATH, "rag_sentiment", _SENTIMENT_CACHE_MAX, _SENTIMENT_CACHE_TTL_S)
+
+# Trailing " - Reuters" / " | Yahoo Finance" / " - seekingalpha.com" publisher tag:
+# at most five words, each capitalised (or a domain), so "... - shares fall" is kept.
+_PUBLISHER_SUFFIX = re.compile(r"\s+[-\u2013\u2014|]\s+((?:[A-Z0-9][\w'&.]*\s?){1,5}|[\w.-]+\.[a-z]{2,})$")
+_PUBLISHER_MIN_KEPT_WORDS = 3
+
+
+def normalize_headline(title: str) -> str:
+    """
+    Canonical form of a headline for cache keys: publisher suffix stripped,
+    case folded, whitespace collapsed. A dash-separated tail only counts as a
+    publisher if at least three words remain before it, so
+    "Microsoft - OpenAI Deal Expands" is left whole.
+    """
+    text = " ".join((title or "").split())
+    suffix = _PUBLISHER_SUFFIX.search(text)
+    if suffix:
+        kept = text[:suffix.start()]
+        if len(kept.split()) >= _PUBLISHER_MIN_KEPT_WORDS:
+            text = kept
+    return text.casefold()
+
+
+def _sentiment_model_id() -> Tuple[str, str]:
+    if sentiment_head() is not None:
+        return ("head:" + _HEAD_VERSION, EMBED_MODEL)
+    return (SENTIMENT_MODEL or DEFAULT_SENTIMENT_MODEL, ENCODER_BACKEND)
+
+
+def _rag_sentiment_key(headline: str, ticker: str) -> str:
+    # The relabel depends on the base classifier, the generator, the embedder (which
+    # neighbours come back), the escalation policy and the ticker filter.
+    version = (
+        _sentiment_model_id(), GEN_MODEL, GEN_PRECISION, EMBED_MODEL,
+        RAG_ESCALATE_SCORE, RAG_AGREE_MIN, RAG_RELABEL,
+    )
+    return DiskCache.make_key("rag-sentiment", version, (ticker or "").upper(), normalize_headline(headline))
+
+
+def classify_headlines(titles: List[str], batch_size: int = SENTIMENT_BATCH_SIZE) -> List[Dict[str, Any]]:
+    """
+    Base-classifier sentiment for many headlines in as few forward passes as possible.
+
+    Headlines already in BASE_SENTIMENT_CACHE are answered from disk. With
+    SENTIMENT_MODE=head the rest are scored by the sentiment head from their
+    embeddings; otherwise they are sorted by length and cut into batches of
+    `batch_size`, so each padded batch holds similar-length inputs (little padding).
+    If a batch fails, its items are retried one by one, so a bad headline only fails itself.
+
+    Returns:
+        One entry per title, in input order: {"label": str, "score": float} or {"error": str}
+    """
+    results: List[Dict[str, Any]] = [{} for _ in titles]
+    model_id = _sentiment_model_id()
+    keys = [DiskCache.make_key("sentiment", model_id, normalize_headline(t)) for t in titles]
+    pending = []
+    for i, key in enumerate(keys):
+        cached = BASE_SENTIMENT_CACHE.get(key)
+        if cached is not None:
+            results[i] = cached
+        else:
+            pending.append(i)
+    head = sentiment_head() if pending else None
+    if head is not None:
+        try:
+            for i, out in zip(pending, head.classify(embed_texts([titles[i] for i in pending]))):
+                results[i] = out
+                BASE_SENTIMENT_CACHE.put(keys[i], out)
+            return results
+        except Exception as e:  # fall back to the classifier below
+            console.print(f"[warn] Sentiment head failed: {e}")
+    order = sorted(pending, key=lambda i: len(titles[i]))
+    for start in range(0, len(order), max(1, batch_size)):
+        bucket = order[start:start + batch_size]
+        try:
+            _count_encoder("sentiment", len(bucket))
+            outs = sentiment_pipeline([titles[i] for i in bucket], batch_size=len(bucket))
+            for i, out in zip(bucket, outs):
+                results[i] = {"label": out["label"].lower(), "score": float(out["score"])}
+        except Exception:
+            for i in bucket:
+                try:
+                    _count_encoder("sentiment", 1)
+                    out = sentiment_pipeline(titles[i])[0]
+                    results[i] = {"label": out["label"].lower(), "score": float(out["score"])}
+                except Exception as e:
+                    results[i] = {"error": str(e)}
+    for i in pending:
+        if "error" not in results[i]:
+            BASE_SENTIMENT_CACHE.put(keys[i], results[i])
+    return results
+
+
+def prefetch_portfolio(tickers: List[str], max_headlines: int = 5) -> Dict[str, Dict[str, Any]]:
+    """
+    Fetch every ticker's headlines and classify them all in one batched call, so a
+    portfolio run costs one or two classifier forward passes instead of one per headline.
+
+    Returns:
+        {ticker: {"news": [...], "base_sentiment": [...]}}, usable as initial workflow state.
+    """
+    news = {t: fetch_news(t, max_headlines=max_headlines) for t in tickers}
+    if SENTIMENT_MODE == "knn":  # base labels are only needed for unsupported headlines
+        return {t: {"news": news[t]} for t in tickers}
+    flat = [item.get("title", "") for t in tickers for item in news[t]]
+    bases = iter(classify_headlines(flat))
+    return {t: {"news": news[t], "base_sentiment": [next(bases) for _ in news[t]]} for t in tickers}
+
+
+# ===========================
+# RAG-augmented sentiment
+# ===========================
+# Escalation policy: the LLM relabel only runs for ambiguous headlines. The base label
+# stands when the classifier is at least RAG_ESCALATE_SCORE confident and at least
+# RAG_AGREE_MIN of the neighbours' (inverse-distance) weight carries the same label.
+RAG_ESCALATE_SCORE = float(os.getenv("RAG_ESCALATE_SCORE", "0.9"))
+RAG_AGREE_MIN = float(os.getenv("RAG_AGREE_MIN", "0.6"))
+
+
+class EscalationStats:
+    """
+    Counts which tier decided each RAG headline: "base" (no neighbours to consult),
+    "consensus" (confident base label backed by its neighbours) or "llm".
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.tiers: Dict[str, int] = {"base": 0, "consensus": 0, "llm": 0}
+        self.relabelled = 0
+        self.relabel_calls = 0
+
+    def record(self, tier: str) -> None:
+        with self._lock:
+            self.tiers[tier] = self.tiers.get(tier, 0) + 1
+
+    def record_relabel(self, headlines: int, calls: int) -> None:
+        with self._lock:
+            self.relabelled += headlines
+            self.relabel_calls += calls
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            tiers = dict(self.tiers)
+            relabelled, calls = self.relabelled, self.relabel_calls
+        return {
+            "tiers": tiers,
+            "llm_calls": calls,
+            # every consensus decision, and every headline packed into a shared
+            # relabel, is a generator call the one-prompt-per-headline flow would have run
+            "llm_calls_avoided": tiers.get("consensus", 0) + relabelled - calls,
+            "relabelled_headlines": relabelled,
+        }
+
+
+ESCALATION_STATS = EscalationStats()
+
+
+def neighbor_vote(neighbors: List[Dict[str, Any]]) -> Dict[str, float]:
     """
-    Fetch trailing P/E ratio via yfinance .info (best effort).
+    Inverse-distance weighted label shares of `neighbors` (summing to 1).
     """
-    try:
-        stock = yf.Ticker(ticker)
-        pe = stock.info.get("trailingPE", "N/A")
-        return float(pe) if pe and pe != "N/A" else "N/A"
-    except Exception:  # pragma: no cover
-        return "N/A"
+    weights: Dict[str, float] = {}
+    for nb in neighbors:
+        label = str((nb.get("metadata", {}) or {}).get("sentiment", "unknown")).lower()
+        dist = nb.get("distance")
+        w = 1.0 / (1e-3 + max(float(dist), 0.0)) if dist is not None else 1.0
+        weights[label] = weights.get(label, 0.0) + w
+    total = sum(weights.values())
+    return {label: w / total for label, w in weights.items()} if total else {}
 
 
-def fetch_news(ticker: str, max_headlines: int = 5) -> List[Dict[str, Optional[str]]]:
+def _drop_self(neighbors: List[Dict[str, Any]], headline: str, ticker: str) -> List[Dict[str, Any]]:
     """
-    Fetch recent news headlines from Google News RSS for the given ticker.
+    `neighbors` without the headline's own stored copy (same id, or the same headline
+    after normalisation), which would otherwise dominate any distance-weighted vote.
     """
-    try:
-        url = f"https://news.google.com/rss/search?q={ticker}+stock"
-        feed = feedparser.parse(url)
-        articles = [{"title": entry.title, "link": entry.link} for entry in feed.entries[:max_headlines]]
-        return articles if articles else [{"title": f"No recent news for {ticker}", "link": None}]
-    except Exception as e:  # pragma: no cover
-        console.print(f"[warn] RSS fetch failed for {ticker}: {e}")
-        return [{"title": f"No recent news for {ticker}", "link": None}]
+    own_id = VectorStore._make_id(headline, {"ticker": ticker})
+    own_text = normalize_headline(headline)
+    return [
+        nb for nb in neighbors
+        if nb.get("id") != own_id and normalize_headline(nb.get("text") or "") != own_text
+    ]
 
 
-# ===========================
-# RAG-augmented sentiment
-# ===========================
-def _rag_sentiment(headline: str, ticker: str) -> Dict[str, Any]:
+def _escalation_tier(base_label: str, base_score: float, neighbors: List[Dict[str, Any]]) -> Tuple[str, float]:
+    """
+    Decide who labels a headline. Returns (tier, neighbour agreement with the base label).
     """
-    RAG-enhanced sentiment classification for a single headline.
+    if not neighbors:
+        return "base", 0.0
+    agreement = neighbor_vote(neighbors).get(base_label, 0.0)
+    if base_score >= RAG_ESCALATE_SCORE and agreement >= RAG_AGREE_MIN:
+        return "consensus", agreement
+    return "llm", agreement
+
+
+# How classify_sentiment relabels a ticker's ambiguous headlines: "packed" (one prompt
+# listing them all with shared context), "batch" (one padded generator batch of the
+# per-headline prompts) or "single" (one generator call per headline).
+RAG_RELABEL = os.getenv("RAG_RELABEL", "packed").lower()
+_LABEL_LINE = re.compile(r"(\d+)\s*[:.)\-]\s*\W*(positive|negative|neutral)", re.IGNORECASE)
+
+
+def _neighbor_bullets(neighbors: List[Dict[str, Any]]) -> List[str]:
+    return [
+        f"- {nb['text']} [sentiment: {(nb.get('metadata', {}) or {}).get('sentiment', 'unknown')}]"
+        for nb in neighbors
+    ]
+
+
+def _relabel_prompt(headline: str, neighbors: List[Dict[str, Any]]) -> str:
+    context = "\n".join(_neighbor_bullets(neighbors)[:5])
+    return (
+        "You are an equity research assistant. Classify the SENTIMENT (positive/negative/neutral) of the "
+        "HEADLINE, taking into account similar prior headlines and their labels for context.\n\n"
+        f"HEADLINE: {headline}\n\n"
+        "SIMILAR HEADLINES:\n"
+        f"{context}\n\n"
+        "Return JSON with fields: label (one of positive|negative|neutral) and rationale (<= 2 short bullets)."
+    )
 
-    Steps:
-        1) Base classifier label/score via transformers pipeline.
-        2) Retrieve top-k similar headlines from the vector DB (same ticker first, else general).
-        3) Ask LLM to re-label with context (label ∈ {positive, negative, neutral}) and give a rationale.
-        4) Upsert this headline into the vector DB for future runs.
 
-    Returns:
-        {
-          "title": str,
-          "sentiment": "positive|negative|neutral",
-          "score": float,     # from base classifier
-          "rag": {
-             "used": bool,
-             "rationale": str,
-             "neighbors": [{"title": str, "sentiment": str, "distance": float}, ...]
-          }
-        }
+def _packed_relabel_prompt(items: List[Dict[str, Any]]) -> str:
+    # Neighbours shared between headlines are listed once.
+    seen: Dict[str, str] = {}
+    for it in items:
+        for nb, bullet in zip(it["neighbors"], _neighbor_bullets(it["neighbors"])):
+            seen.setdefault(nb["text"], bullet)
+    numbered = "\n".join(f"{i}. {it['headline']}" for i, it in enumerate(items, 1))
+    return (
+        "You are an equity research assistant. Classify the SENTIMENT (positive/negative/neutral) of each "
+        "numbered HEADLINE, taking into account the similar prior headlines and their labels for context.\n\n"
+        "SIMILAR HEADLINES:\n"
+        f"{chr(10).join(seen.values())}\n\n"
+        "HEADLINES:\n"
+        f"{numbered}\n\n"
+        'Answer with one line per headline, in order, formatted "<number>: <label>".'
+    )
+
+
+def _parse_label(out: str) -> Optional[str]:
+    # very light parsing: first label word in the answer
+    if out.startswith("[GENERATION FAILED]"):
+        return None
+    for cand in ("positive", "negative", "neutral"):
+        if cand in out.lower():
+            return cand
+    return None
+
+
+def _rag_prepare(
+    headline: str,
+    ticker: str,
+    base: Optional[Dict[str, Any]] = None,
+    embedding: Any = None,
+    neighbors: Optional[List[Dict[str, Any]]] = None,
+) -> Dict[str, Any]:
+    """
+    RAG sentiment, first half: base label, neighbour retrieval (unless `neighbors` were
+    fetched already) and the escalation decision -- keep a confident base label the
+    neighbours agree with ("consensus"), else hand it to the LLM ("llm"). Returns a work
+    item for `_rag_finish`.
+
+    The headline is embedded once (or `embedding` is used) and that vector serves both
+    retrieval queries and the final upsert.
     """
     # 1) Base classifier
-    base = sentiment_pipeline(headline)[0]
-    base_label = base["label"].lower()
-    base_score = float(base["score"])
-
-    # 2) Retrieve neighbors
-    neighbors = VSTORE.query(headline, ticker=ticker, k=5) if VSTORE.enabled else []
-    if not neighbors and VSTORE.enabled:
-        # fallback to general pool
-        neighbors = VSTORE.query(headline, ticker=None, k=5)
-
-    # 3) LLM re-label with context (if any neighbor exists)
-    rag_used = bool(neighbors)
-    final_label = base_label
-    rationale = ""
-
-    if rag_used:
-        bullets = []
-        for nb in neighbors:
-            nb_lab = (nb.get("metadata", {}) or {}).get("sentiment", "unknown")
-            bullets.append(f"- {nb['text']} [sentiment: {nb_lab}]")
-        context = "\n".join(bullets[:5])
+    base = base or classify_headlines([headline])[0]
+    if "error" in base:
+        raise RuntimeError(base["error"])
 
-        prompt = (
-            "You are an equity research assistant. Classify the SENTIMENT (positive/negative/neutral) of the "
-            "HEADLINE, taking into account similar prior headlines and their labels for context.\n\n"
-            f"HEADLINE: {headline}\n\n"
-            "SIMILAR HEADLINES:\n"
-            f"{context}\n\n"
-            "Return JSON with fields: label (one of positive|negative|neutral) and rationale (<= 2 short bullets)."
+    # 2) Retrieve neighbors (same ticker first, general pool if none)
+    if VSTORE.enabled:
+        if embedding is None:
+            embedding = embed_texts([headline])[0]
+        if neighbors is None:
+            # one spare result for the headline's own copy, dropped before the fallback
+            neighbors = VSTORE.query_many(
+                [headline], tickers=ticker, k=6, embeddings=[embedding], exclude_self=True
+            )[0]
+        neighbors = _drop_self(neighbors, headline, ticker)[:5]  # also covers caller-fetched lists
+
+    # 3a) Escalate to an LLM re-label only when the base label is in doubt
+    tier, agreement = _escalation_tier(base["label"], base["score"], neighbors or [])
+    ESCALATION_STATS.record(tier)
+    return {
+        "headline": headline,
+        "ticker": ticker,
+        "cache_key": _rag_sentiment_key(headline, ticker),
+        "base_label": base["label"],
+        "base_score": base["score"],
+        "neighbors": neighbors or [],
+        "tier": tier,
+        "agreement": agreement,
+        "embedding": embedding,
+    }
+
+
+def _rag_finish(item: Dict[str, Any], label: Optional[str] = None, rationale: str = "") -> Dict[str, Any]:
+    """
+    RAG sentiment, second half: settle the label (`label` is the LLM's, if it gave one),
+    upsert the headline, build the result and cache it.
+    """
+    rag_used = bool(item["neighbors"])
+    final_label = label or item["base_label"]
+    if item["tier"] == "consensus":
+        rationale = (
+            f"Base label {item['base_score']:.2f} confident; "
+            f"{item['agreement']:.0%} of neighbour weight agrees."
         )
-        out = hf_generate(prompt, max_new_tokens=220)
-        # very light parsing: find label
-        label = None
-        for cand in ("positive", "negative", "neutral"):
-            if cand in out.lower():
-                label = cand
-                break
-        final_label = label or base_label
-        rationale = out.strip()
-
-    # 4) Upsert this headline (with final label)
+
+    # 4) Upsert this headline (with final label), off the request path
     if VSTORE.enabled:
-        VSTORE.upsert(
-            text=headline,
+        VSTORE.upsert_later(
+            text=item["headline"],
             metadata={
-                "ticker": ticker,
+                "ticker": item["ticker"],
                 "sentiment": final_label,
-                "score": base_score,
+                "score": item["base_score"],
                 "time": datetime.utcnow().isoformat(),
             },
+            embedding=item.get("embedding"),
         )
 
-    return {
-        "title": headline,
+    result = {
         "sentiment": final_label,
-        "score": base_score,
+        "score": item["base_score"],
         "rag": {
             "used": rag_used,
+            "tier": item["tier"],
+            "agreement": round(item["agreement"], 3),
             "rationale": rationale if rag_used else "",
             "neighbors": [
                 {
@@ -473,47 +2855,427 @@ def _rag_sentiment(headline: str, ticker: str) -> Dict[str, Any]:
                     "sentiment": (nb.get("metadata", {}) or {}).get("sentiment", "unknown"),
                     "distance": nb.get("distance"),
                 }
-                for nb in (neighbors or [])
+                for nb in item["neighbors"]
             ],
         },
     }
+    RAG_SENTIMENT_CACHE.put(item["cache_key"], result)
+    return {"title": item["headline"], **result}
+
+
+def _relabel_many(items: List[Dict[str, Any]]) -> List[Tuple[Optional[str], str]]:
+    """
+    LLM re-label for several ambiguous headlines of one ticker, with as few generator
+    calls as RAG_RELABEL allows. Returns (label or None, rationale) per item; a label
+    the model did not give falls back to the base label in `_rag_finish`.
+    """
+    if not items:
+        return []
+    if RAG_RELABEL == "packed" and len(items) > 1:
+        out = hf_generate(_packed_relabel_prompt(items), max_new_tokens=min(220, 16 + 8 * len(items)), node="rag")
+        ESCALATION_STATS.record_relabel(len(items), calls=1)
+        answers: Dict[int, Tuple[str, str]] = {}
+        if not out.startswith("[GENERATION FAILED]"):
+            for m in _LABEL_LINE.finditer(out):
+                answers.setdefault(int(m.group(1)), (m.group(2).lower(), m.group(0).strip()))
+        return [answers.get(i, (None, "")) for i in range(1, len(items) + 1)]
+
+    prompts = [_relabel_prompt(it["headline"], it["neighbors"]) for it in items]
+    if RAG_RELABEL == "batch" and len(items) > 1:
+        outs = hf_generate_batch(prompts, max_new_tokens=220, node="rag")
+        ESCALATION_STATS.record_relabel(len(items), calls=1)
+    else:
+        outs = [hf_generate(prompt, max_new_tokens=220, node="rag") for prompt in prompts]
+        ESCALATION_STATS.record_relabel(len(items), calls=len(items))
+    return [(_parse_label(out), out.strip()) for out in outs]
 
 
-def classify_sentiment(news_items: List[Dict[str, str]] | None, ticker: str = "") -> List[Dict[str, Any]]:
+def classify_sentiment(
+    news_items: List[Dict[str, str]] | None,
+    ticker: str = "",
+    base: Optional[List[Dict[str, Any]]] = None,
+) -> List[Dict[str, Any]]:
     """
     Apply RAG-enhanced sentiment (with vector DB) to each news title.
 
-    If the vector DB is unavailable, falls back to base classifier.
+    Base labels for all titles come from the sentiment cache plus one batched classifier
+    call for the misses (or from `base`, precomputed by `prefetch_portfolio`). Headlines
+    that escalate to the LLM are relabelled together (see RAG_RELABEL), so a ticker costs
+    one generator call rather than one per headline. If the vector DB is unavailable,
+    falls back to the base classifier. With SENTIMENT_MODE=knn the labels come from
+    the stored neighbours instead (see `knn_sentiment`).
+
+    Returns:
+        One per title:
+        {
+          "title": str,
+          "sentiment": "positive|negative|neutral",
+          "score": float,     # from base classifier
+          "rag": {
+             "used": bool,
+             "tier": "base|consensus|llm",   # which step decided the label
+             "agreement": float,             # weighted neighbour share for the base label
+             "rationale": str,
+             "neighbors": [{"title": str, "sentiment": str, "distance": float}, ...]
+          }
+        }
     """
-    results: List[Dict[str, Any]] = []
-    for item in news_items or []:
-        title = item.get("title", "")
+    titles = [item.get("title", "") for item in news_items or []]
+    if SENTIMENT_MODE == "knn" and VSTORE.enabled:
+        return knn_sentiment(titles, ticker=ticker, base=base)
+    bases = base if base is not None and len(base) == len(titles) else classify_headlines(titles)
+    results: List[Optional[Dict[str, Any]]] = [None] * len(titles)
+    pending: Dict[int, Dict[str, Any]] = {}
+    todo: List[int] = []
+    seen_again: List[int] = []
+    for idx, (title, b) in enumerate(zip(titles, bases)):
         try:
+            if "error" in b:
+                raise RuntimeError(b["error"])
             if VSTORE.enabled:
-                results.append(_rag_sentiment(title, ticker))
+                cached = RAG_SENTIMENT_CACHE.get(_rag_sentiment_key(title, ticker))
+                if cached is not None:
+                    results[idx] = {"title": title, **cached}
+                    seen_again.append(idx)
+                else:
+                    todo.append(idx)
             else:
-                base = sentiment_pipeline(title)[0]
-                results.append(
-                    {
-                        "title": title,
-                        "sentiment": base["label"].lower(),
-                        "score": float(base["score"]),
-                        "rag": {"used": False, "rationale": "", "neighbors": []},
-                    }
-                )
-        except Exception as e:  # pragma: no cover
-            results.append(
-                {
+                results[idx] = {
                     "title": title,
-                    "sentiment": "unknown",
-                    "score": 0.0,
-                    "error": str(e),
-                    "rag": {"used": False, "rationale": "", "neighbors": []},
+                    "sentiment": b["label"],
+                    "score": b["score"],
+                    "rag": {"used": False, "tier": "base", "rationale": "", "neighbors": []},
                 }
+        except Exception as e:  # pragma: no cover
+            results[idx] = _sentiment_error(title, e)
+
+    if seen_again:
+        # Answered from cache, but still a sighting: queue it so the stored copy's
+        # last_seen / hit_count move on (vectors normally come from EMBED_CACHE).
+        vectors = embed_texts([titles[idx] for idx in seen_again])
+        now = datetime.utcnow().isoformat()
+        for row, idx in enumerate(seen_again):
+            VSTORE.upsert_later(
+                text=titles[idx],
+                metadata={
+                    "ticker": ticker,
+                    "sentiment": results[idx]["sentiment"],
+                    "score": results[idx]["score"],
+                    "time": now,
+                },
+                embedding=vectors[row],
             )
+
+    if todo:
+        # One batched embedding pass and one bulk retrieval (ticker first, general pool
+        # for headlines with no same-ticker neighbours); the upserts reuse the vectors.
+        todo_titles = [titles[idx] for idx in todo]
+        vectors = embed_texts(todo_titles)
+        neighbors = VSTORE.query_many(  # +1: own copy, dropped before the general-pool fallback
+            todo_titles, tickers=ticker, k=6, embeddings=vectors, exclude_self=True
+        )
+        for row, idx in enumerate(todo):
+            try:
+                pending[idx] = _rag_prepare(
+                    titles[idx], ticker, base=bases[idx], embedding=vectors[row], neighbors=neighbors[row]
+                )
+            except Exception as e:  # pragma: no cover
+                results[idx] = _sentiment_error(titles[idx], e)
+
+    ambiguous = [idx for idx, item in pending.items() if item["tier"] == "llm"]
+    relabels = dict(zip(ambiguous, _relabel_many([pending[idx] for idx in ambiguous])))
+    for idx, item in pending.items():
+        try:
+            results[idx] = _rag_finish(item, *relabels.get(idx, (None, "")))
+        except Exception as e:  # pragma: no cover
+            results[idx] = _sentiment_error(item["headline"], e)
+    return [r for r in results if r is not None]
+
+
+def _sentiment_error(title: str, e: Exception) -> Dict[str, Any]:
+    return {
+        "title": title,
+        "sentiment": "unknown",
+        "score": 0.0,
+        "error": str(e),
+        "rag": {"used": False, "rationale": "", "neighbors": []},
+    }
+
+
+# ===========================
+# kNN sentiment over the vector store
+# ===========================
+# SENTIMENT_MODE=knn labels headlines by a distance-weighted vote of their stored
+# neighbours: one embedding per headline, no classifier or LLM forward pass.
+KNN_K = int(os.getenv("KNN_K", "15"))
+KNN_MIN_SUPPORT = float(os.getenv("KNN_MIN_SUPPORT", "3"))
+KNN_MAX_DISTANCE = float(os.getenv("KNN_MAX_DISTANCE", "0"))  # 0 = no cut-off
+
+
+def knn_vote(neighbors: List[Dict[str, Any]], min_support: float = KNN_MIN_SUPPORT) -> Optional[Dict[str, Any]]:
+    """
+    Distance-weighted vote over labelled neighbours.
+
+    Neighbours beyond KNN_MAX_DISTANCE (if set) or without a usable label do not vote.
+    Support is the effective number of voters, (sum w)^2 / sum w^2, so one very close
+    neighbour counts as about one vote however small its distance. Confidence is the
+    winning share shrunk towards uniform by that support, (share * n + 1) / (n + 3),
+    which keeps thin, lopsided votes from reporting ~1.0.
+
+    Returns:
+        {"label", "confidence", "share", "support"} or None when support < `min_support`.
+    """
+    weights: Dict[str, float] = {}
+    ws: List[float] = []
+    for nb in neighbors:
+        label = str((nb.get("metadata", {}) or {}).get("sentiment", "")).lower()
+        dist = nb.get("distance")
+        if label not in SENTIMENT_LABELS or dist is None:
+            continue
+        if KNN_MAX_DISTANCE > 0 and dist > KNN_MAX_DISTANCE:
+            continue
+        w = 1.0 / (1e-3 + max(float(dist), 0.0))
+        weights[label] = weights.get(label, 0.0) + w
+        ws.append(w)
+    if not ws:
+        return None
+    total = sum(ws)
+    support = total * total / sum(w * w for w in ws)
+    if support < min_support:
+        return None
+    label, w_top = max(weights.items(), key=lambda kv: kv[1])
+    share = w_top / total
+    return {
+        "label": label,
+        "confidence": (share * support + 1.0) / (support + len(SENTIMENT_LABELS)),
+        "share": share,
+        "support": support,
+    }
+
+
+def knn_sentiment(
+    titles: List[str], ticker: str = "", base: Optional[List[Dict[str, Any]]] = None
+) -> List[Dict[str, Any]]:
+    """
+    kNN sentiment for a ticker's headlines (SENTIMENT_MODE=knn).
+
+    Each headline's KNN_K nearest stored headlines (all tickers) vote. Headlines without
+    enough support fall back to the base classifier, batched; only those are upserted,
+    so the store is never fed its own kNN predictions.
+
+    Returns:
+        Same shape as `classify_sentiment`, with rag.tier "knn" or "base" and
+        "score" = calibrated kNN confidence (or the base classifier score).
+    """
+    vectors = embed_texts(titles) if titles else []
+    # one spare result per headline for its own stored copy, which must not vote
+    neighbors = VSTORE.query_many(titles, tickers=None, k=KNN_K + 1, embeddings=vectors)
+    neighbors = [_drop_self(nbs, title, ticker)[:KNN_K] for title, nbs in zip(titles, neighbors)]
+    votes: List[Optional[Dict[str, Any]]] = [knn_vote(nbs) for nbs in neighbors]
+
+    unsupported = [i for i, v in enumerate(votes) if v is None]
+    if base is not None and len(base) == len(titles):
+        fallback = {i: base[i] for i in unsupported}
+    else:
+        fallback = dict(zip(unsupported, classify_headlines([titles[i] for i in unsupported])))
+
+    results: List[Dict[str, Any]] = []
+    for i, title in enumerate(titles):
+        vote, nbs = votes[i], neighbors[i]
+        shown = [
+            {
+                "title": nb["text"],
+                "sentiment": (nb.get("metadata", {}) or {}).get("sentiment", "unknown"),
+                "distance": nb.get("distance"),
+            }
+            for nb in nbs[:5]
+        ]
+        if vote is not None:
+            ESCALATION_STATS.record("knn")
+            results.append({
+                "title": title,
+                "sentiment": vote["label"],
+                "score": round(vote["confidence"], 4),
+                "rag": {
+                    "used": True,
+                    "tier": "knn",
+                    "agreement": round(vote["share"], 3),
+                    "rationale": f"{vote['share']:.0%} of neighbour weight (support {vote['support']:.1f}).",
+                    "neighbors": shown,
+                },
+            })
+            continue
+        b = fallback[i]
+        if "error" in b:
+            results.append(_sentiment_error(title, RuntimeError(b["error"])))
+            continue
+        ESCALATION_STATS.record("base")
+        VSTORE.upsert_later(
+            text=title,
+            metadata={
+                "ticker": ticker,
+                "sentiment": b["label"],
+                "score": b["score"],
+                "time": datetime.utcnow().isoformat(),
+            },
+            embedding=vectors[i],
+        )
+        results.append({
+            "title": title,
+            "sentiment": b["label"],
+            "score": b["score"],
+            "rag": {"used": bool(nbs), "tier": "base", "rationale": "", "neighbors": shown},
+        })
     return results
 
 
+def knn_eval_report(limit: int = 2000, bins: int = 10) -> Dict[str, Any]:
+    """
+    Offline evaluation of kNN sentiment on stored history (leave-one-out).
+
+    Each stored headline is classified from the other stored headlines (exact search
+    over the dumped embeddings, squared L2 as in Chroma's default space) and compared
+    with its stored label and with the base classifier on the same text. Copies of
+    the same headline under other tickers are left out too, as in `knn_sentiment`.
+
+    Returns:
+        {"documents", "coverage", "knn_vs_stored", "base_vs_stored", "knn_vs_base",
+         "expected_calibration_error", "ms_per_headline": {"knn_embed", "base_classifier"}}
+    """
+    import numpy as np
+
+    data = VSTORE.dump(limit=limit)
+    keep = [
+        i for i, m in enumerate(data["metadatas"])
+        if str((m or {}).get("sentiment", "")).lower() in SENTIMENT_LABELS and data["embeddings"] is not None
+    ]
+    if len(keep) < 2:
+        return {"documents": len(keep), "error": "not enough labelled documents in the vector store"}
+    texts = [data["texts"][i] for i in keep]
+    metas = [data["metadatas"][i] for i in keep]
+    stored = [str(m["sentiment"]).lower() for m in metas]
+    X = np.asarray([data["embeddings"][i] for i in keep], dtype="float32")
+    sq = (X * X).sum(axis=1)
+    k = min(KNN_K, len(keep) - 1)
+    copies: Dict[str, List[int]] = {}
+    for i, text in enumerate(texts):
+        copies.setdefault(normalize_headline(text), []).append(i)
+
+    preds: List[Optional[Dict[str, Any]]] = []
+    for start in range(0, len(keep), 512):
+        block = X[start:start + 512]
+        dist = sq[start:start + 512, None] + sq[None, :] - 2.0 * block @ X.T
+        for row in range(len(block)):  # leave one out (with its copies)
+            dist[row, copies[normalize_headline(texts[start + row])]] = np.inf
+        top = np.argpartition(dist, k - 1, axis=1)[:, :k]
+        for row, idx in enumerate(top):
+            nbs = [
+                {"metadata": metas[j], "distance": float(max(dist[row, j], 0.0))}
+                for j in idx if np.isfinite(dist[row, j])
+            ]
+            preds.append(knn_vote(nbs))
+
+    t0 = time.perf_counter()
+    base = classify_headlines(texts)
+    base_ms = (time.perf_counter() - t0) * 1000 / len(texts)
+    sample = texts[:64]
+    t0 = time.perf_counter()
+    embed_texts(sample)
+    embed_ms = (time.perf_counter() - t0) * 1000 / len(sample)
+
+    covered = [i for i, p in enumerate(preds) if p is not None]
+    base_ok = {i for i, b in enumerate(base) if "error" not in b}
+
+    def rate(pairs: List[bool]) -> Optional[float]:
+        return round(sum(pairs) / len(pairs), 3) if pairs else None
+
+    # Expected calibration error of the kNN confidence against the stored labels.
+    by_bin: Dict[int, List[int]] = {}
+    for i in covered:
+        by_bin.setdefault(min(int(preds[i]["confidence"] * bins), bins - 1), []).append(i)
+    ece = 0.0
+    for members in by_bin.values():
+        acc = sum(preds[i]["label"] == stored[i] for i in members) / len(members)
+        conf = sum(preds[i]["confidence"] for i in members) / len(members)
+        ece += len(members) / len(covered) * abs(acc - conf)
+
+    return {
+        "documents": len(keep),
+        "k": k,
+        "min_support": KNN_MIN_SUPPORT,
+        "coverage": rate([p is not None for p in preds]),
+        "knn_vs_stored": rate([preds[i]["label"] == stored[i] for i in covered]),
+        "base_vs_stored": rate([base[i]["label"] == stored[i] for i in sorted(base_ok)]),
+        "knn_vs_base": rate([preds[i]["label"] == base[i]["label"] for i in covered if i in base_ok]),
+        "expected_calibration_error": round(ece, 4) if covered else None,
+        "ms_per_headline": {"knn_embed": round(embed_ms, 2), "base_classifier": round(base_ms, 2)},
+    }
+
+
+# ===========================
+# Warm-up (readiness)
+# ===========================
+class Warmup:
+    """
+    Background warm-up: load every model and lazily-initialised store and push one
+    dummy request through each, so the first real request does not pay for it.
+
+    `ready` flips only once every step has run; per-step latency (and any error)
+    is kept for the readiness probe.
+    """
+
+    def __init__(self) -> None:
+        self.started = False
+        self.ready = False
+        self.latency_s: Dict[str, float] = {}
+        self.errors: Dict[str, str] = {}
+        self._thread: Optional[threading.Thread] = None
+
+    def steps(self) -> List[Tuple[str, Any]]:
+        return [
+            ("sentiment", lambda: sentiment_pipeline("Shares rose after earnings.")),
+            # straight to the encoder: a persistent EMBED_CACHE hit would leave it cold
+            ("embed", lambda: encode_texts(embed_pipeline.load(), ["warm-up"])),
+            ("generator", lambda: generator_pipeline("Say OK.", max_new_tokens=4, do_sample=False)),
+            ("critic", lambda: critic_pipeline("Say OK.", max_new_tokens=4, do_sample=False)),
+            ("vector_store", lambda: VSTORE.enabled and VSTORE.query("warm-up", k=1)),
+        ]
+
+    def run(self) -> None:
+        t_all = time.perf_counter()
+        for name, step in self.steps():
+            t0 = time.perf_counter()
+            try:
+                step()
+            except Exception as e:  # a failed step must not keep the worker unready forever
+                self.errors[name] = str(e)
+                console.print(f"[warn] Warm-up step '{name}' failed: {e}")
+            self.latency_s[name] = round(time.perf_counter() - t0, 3)
+        self.ready = True
+        console.print(f"[ok]Warm-up complete in {time.perf_counter() - t_all:.1f}s[/]")
+
+    def start(self) -> None:
+        """
+        Run the warm-up on a daemon thread (idempotent).
+        """
+        if self.started:
+            return
+        self.started = True
+        self._thread = threading.Thread(target=self.run, name="warmup", daemon=True)
+        self._thread.start()
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "started": self.started,
+            "ready": self.ready,
+            "latency_s": dict(self.latency_s),
+            "errors": dict(self.errors),
+        }
+
+
+WARMUP = Warmup()
+
+
 # ===========================
 # Pretty renderers & helpers
 # ===========================
@@ -555,7 +3317,7 @@ def render_news(
             s = sentiments[i]
             label = f"{s.get('sentiment','?')} ({s.get('score',0):.2f})"
             if s.get("rag", {}).get("used"):
-                label += " [RAG]"
+                label += " [LLM]" if s["rag"].get("tier") == "llm" else " [RAG]"
         table.add_row(str(i + 1), n.get("title", "—"), label)
     return table
 
@@ -656,23 +3418,26 @@ def build_graph(ticker: str, max_headlines: int = 5):
     Pipeline:
         fetch -> sentiment(RAG) -> draft -> critique -> final -> END
     """
+    from langgraph.graph import StateGraph, END
+
     graph = StateGraph(dict)
 
     def fetch_node(state: Dict[str, Any]) -> Dict[str, Any]:
         price, history = fetch_price_and_history(ticker)
         pe_ratio = fetch_pe_ratio(ticker)
-        news = fetch_news(ticker, max_headlines=max_headlines)
+        news = state.get("news") or fetch_news(ticker, max_headlines=max_headlines)  # may be prefetched
         state.update({"price": price, "history": history, "pe_ratio": pe_ratio, "news": news})
         return state
 
     def sentiment_node(state: Dict[str, Any]) -> Dict[str, Any]:
-        state["sentiment"] = classify_sentiment(state.get("news", []), ticker=ticker)
+        base = state.pop("base_sentiment", None)
+        state["sentiment"] = classify_sentiment(state.get("news", []), ticker=ticker, base=base)
         return state
 
     def draft_node(state: Dict[str, Any]) -> Dict[str, Any]:
         headlines_text = "\n".join([n.get("title", "") for n in state.get("news", [])])
         prompt = f"Draft a short stock analysis for {ticker} based on these headlines:\n{headlines_text}"
-        state["draft"] = hf_generate(prompt, max_new_tokens=200)
+        state["draft"] = hf_generate(prompt, max_new_tokens=200, node="draft")
         return state
 
     def critique_node(state: Dict[str, Any]) -> Dict[str, Any]:
@@ -682,7 +3447,7 @@ def build_graph(ticker: str, max_headlines: int = 5):
             "Focus on evidence, risks, missing context (valuation, catalysts, macro), and factual caution. "
             "Be specific.\n\n=== DRAFT ===\n" + draft
         )
-        state["critique"] = hf_critic(prompt, max_new_tokens=180)
+        state["critique"] = hf_critic(prompt, max_new_tokens=180, node="critique")
         return state
 
     def final_node(state: Dict[str, Any]) -> Dict[str, Any]:
@@ -693,7 +3458,7 @@ def build_graph(ticker: str, max_headlines: int = 5):
             "incorporating the critique. Include: thesis, key risks, and a cautious stance if evidence is weak.\n\n"
             f"=== DRAFT ===\n{draft}\n\n=== CRITIQUE ===\n{critique}"
         )
-        state["final"] = hf_generate(prompt, max_new_tokens=220)
+        state["final"] = hf_generate(prompt, max_new_tokens=220, node="final")
 
         sentiments = state.get("sentiment", [])
         positives = sum(1 for s in sentiments if s.get("sentiment") == "positive")
@@ -729,16 +3494,30 @@ def build_graph(ticker: str, max_headlines: int = 5):
 # ===========================
 # Core analysis (pretty CLI)
 # ===========================
-def _analyze_stock_impl(ticker: str, max_headlines: int = 5) -> Dict[str, Any]:
+def _analyze_stock_impl(
+    ticker: str, max_headlines: int = 5, prefetched: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
     """
     Execute the analysis workflow for a single ticker and render pretty sections.
+
+    `prefetched` (from `prefetch_portfolio`) seeds the workflow with news and base labels.
     """
     console.rule(f"[accent]Analysis • {ticker.upper()}[/]")
-    with console.status("Fetching data & running workflow…", spinner="dots"):
-        workflow = build_graph(ticker, max_headlines)
-        state: Dict[str, Any] = workflow.invoke({})
+    encoder_calls: Dict[str, int] = {"embed_passes": 0, "embed_texts": 0, "sentiment_passes": 0, "sentiment_texts": 0}
+    token = ENCODER_CALLS.set(encoder_calls)
+    try:
+        with console.status("Fetching data & running workflow…", spinner="dots"):
+            workflow = build_graph(ticker, max_headlines)
+            state: Dict[str, Any] = workflow.invoke(dict(prefetched or {}))
+    finally:
+        ENCODER_CALLS.reset(token)
 
     state["memory"] = {"last_run": datetime.utcnow().isoformat()}
+    # Encoder forward passes this call made (cached embeddings/labels cost none).
+    state["encoder_calls"] = encoder_calls
+    # Land this run's queued headline writes now: a worker killed or reloaded
+    # without atexit would otherwise lose them (stdio/http/sse as well as the CLI).
+    VSTORE.flush()
 
     # Pretty sections
     console.print(render_summary(state, ticker))
@@ -765,26 +3544,430 @@ def _analyze_stock_impl(ticker: str, max_headlines: int = 5) -> Dict[str, Any]:
 # ===========================
 # MCP tool
 # ===========================
+async def _stream_to_client(ctx: Context, work: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Run `work` on a worker thread with a TOKEN_SINK that forwards generated tokens to
+    the MCP client as log notifications tagged with the node name ("[draft] …"), plus
+    a progress tick per chunk. A single pump task sends them, so they stay in order.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    done = object()
+
+    def sink(node: str, chunk: str) -> None:
+        loop.call_soon_threadsafe(queue.put_nowait, (node, chunk))
+
+    async def pump() -> None:
+        sent = 0
+        while True:
+            item = await queue.get()
+            if item is done:
+                return
+            node, chunk = item
+            sent += 1
+            try:
+                await ctx.info(f"[{node}] {chunk}")
+                await ctx.report_progress(progress=sent)
+            except Exception:  # client went away or does not take notifications
+                pass
+
+    def run() -> Dict[str, Any]:
+        TOKEN_SINK.set(sink)
+        try:
+            return work()
+        finally:
+            loop.call_soon_threadsafe(queue.put_nowait, done)
+
+    pump_task = asyncio.create_task(pump())
+    try:
+        return await asyncio.to_thread(run)
+    finally:
+        await pump_task
+
+
 @mcp.tool
-def analyze_stock(ticker: str, max_headlines: int = 5) -> Dict[str, Any]:
+async def analyze_stock(ticker: str, ctx: Context, max_headlines: int = 5) -> Dict[str, Any]:
     """
     MCP Tool: Run the full LangGraph-based research workflow for one ticker.
 
+    Draft, critique and final tokens are streamed to the client as log/progress
+    notifications while they are generated; the returned result is unchanged.
+
     Returns:
         The workflow's final state dict (safe to serialize to JSON).
     """
-    return _analyze_stock_impl(ticker, max_headlines=max_headlines)
+    return await _stream_to_client(ctx, lambda: _analyze_stock_impl(ticker, max_headlines=max_headlines))
+
+
+@mcp.tool
+def server_stats() -> Dict[str, Any]:
+    """
+    MCP Tool: Report server performance counters (model loads, shared weights, RSS,
+    startup latency, warm-up, caches, early stops).
+    """
+    return {
+        "models": MODELS.report(),
+        "warmup": WARMUP.report(),
+        "generation_cache": GEN_CACHE.stats(),
+        "sentiment_cache": {"base": BASE_SENTIMENT_CACHE.stats(), "rag": RAG_SENTIMENT_CACHE.stats()},
+        "embedding_cache": EMBED_CACHE.stats(),
+        "vector_writes": VSTORE.write_stats(),
+        "vector_partitions": VSTORE.partition_stats(),
+        "rag_escalation": ESCALATION_STATS.report(),
+        "repetition_stop": REPETITION_STATS.report(),
+        "generation_batching": BATCHER.report(),
+    }
 
 
-# Optional health route for HTTP/SSE runs
+# Optional health routes for HTTP/SSE runs
 if PlainTextResponse is not None:  # pragma: no cover - only used for http/sse
     @mcp.custom_route("/health", methods=["GET"])
+    @mcp.custom_route("/health/live", methods=["GET"])
     async def health(_request):
         """
-        Lightweight liveness probe for HTTP/SSE transports.
+        Liveness probe: the process is up and serving HTTP (models may still be loading).
         """
         return PlainTextResponse("OK")
 
+    @mcp.custom_route("/health/ready", methods=["GET"])
+    async def ready(_request):
+        """
+        Readiness probe: 200 once the background warm-up has run every model and
+        store once, 503 before that. The body carries per-step warm-up latency.
+        """
+        report = WARMUP.report()
+        return JSONResponse(report, status_code=200 if report["ready"] else 503)
+
+
+# ===========================
+# Benchmarks & maintenance commands
+# ===========================
+# Fixed headline set so benchmark numbers are comparable across runs and nodes.
+_BENCH_HEADLINES = [
+    "Apple beats earnings estimates and raises full-year guidance",
+    "Tesla recalls 120,000 vehicles over faulty seat belt warning",
+    "Microsoft shares flat after mixed cloud results",
+    "Alphabet faces new antitrust probe in the European Union",
+    "Amazon announces major expansion of same-day delivery network",
+    "Nvidia stock slides as export restrictions tighten",
+    "Meta unveils new AI model, analysts see long-term upside",
+    "Intel cuts dividend amid falling PC demand",
+    "JPMorgan reports record quarterly profit on higher rates",
+    "Boeing delivery delays weigh on quarterly outlook",
+    "Netflix subscriber growth tops expectations",
+    "Pfizer shares drop after weak vaccine sales forecast",
+    "Walmart raises outlook as shoppers trade down",
+    "Coca-Cola holds prices steady, volumes unchanged",
+    "SEC opens inquiry into accounting at regional lender",
+    "Oil majors rally as crude climbs above $90",
+]
+
+
+def _throughput(fn: Any, texts: List[str], repeats: int = 3) -> float:
+    """
+    Items per second for `fn(texts)`, after one untimed warm-up call.
+    """
+    fn(texts[:2])
+    t0 = time.perf_counter()
+    for _ in range(repeats):
+        fn(texts)
+    return round(repeats * len(texts) / (time.perf_counter() - t0), 1)
+
+
+def onnx_parity_report(variant: str = "onnx-int8") -> Dict[str, Any]:
+    """
+    Compare the ONNX Runtime encoders (`variant`) against PyTorch on the fixed headline set.
+
+    Returns:
+        {"sentiment": {label agreement, mismatches, headlines/sec per runtime},
+         "embedding": {cosine similarity min/mean, headlines/sec per runtime}}
+    """
+    import numpy as np
+
+    texts = list(_BENCH_HEADLINES)
+    ref_sent = MODELS.get("sentiment-analysis", SENTIMENT_MODEL, DEVICE, "torch")
+    ort_sent = MODELS.get("sentiment-analysis", SENTIMENT_MODEL, DEVICE, variant)
+    ref_labels = [r["label"].lower() for r in ref_sent(texts)]
+    ort_labels = [r["label"].lower() for r in ort_sent(texts)]
+    mismatches = [
+        {"title": t, "torch": a, variant: b} for t, a, b in zip(texts, ref_labels, ort_labels) if a != b
+    ]
+
+    ref_emb = MODELS.get("feature-extraction", EMBED_MODEL, DEVICE, "torch")
+    ort_emb = MODELS.get("feature-extraction", EMBED_MODEL, DEVICE, variant)
+
+    def embed_with(pipe: Any, batch: List[str]) -> Any:
+        return encode_texts(pipe, batch)
+
+    a, b = embed_with(ref_emb, texts), embed_with(ort_emb, texts)
+    cos = (a * b).sum(axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1) + 1e-12)
+
+    return {
+        "variant": variant,
+        "headlines": len(texts),
+        "sentiment": {
+            "label_agreement": round(1 - len(mismatches) / len(texts), 3),
+            "mismatches": mismatches,
+            "headlines_per_s": {
+                "torch": _throughput(lambda xs: ref_sent(xs), texts),
+                variant: _throughput(lambda xs: ort_sent(xs), texts),
+            },
+        },
+        "embedding": {
+            "cosine_min": round(float(cos.min()), 4),
+            "cosine_mean": round(float(cos.mean()), 4),
+            "headlines_per_s": {
+                "torch": _throughput(lambda xs: embed_with(ref_emb, xs), texts),
+                variant: _throughput(lambda xs: embed_with(ort_emb, xs), texts),
+            },
+        },
+    }
+
+
+def _query_p95_ms(embeddings: Any, repeats: int = 5) -> Optional[float]:
+    # Store-side latency only: queries go in pre-embedded.
+    timings = []
+    for _ in range(repeats):
+        for vec in embeddings:
+            t0 = time.perf_counter()
+            VSTORE.query("", k=5, embedding=vec)
+            timings.append((time.perf_counter() - t0) * 1000)
+    timings.sort()
+    return round(timings[int(0.95 * (len(timings) - 1))], 2) if timings else None
+
+
+def vstore_bench_report(
+    sizes: List[int], dim: int = 384, n_queries: int = 100, batch: int = 5000
+) -> Dict[str, Any]:
+    """
+    Insert and query latency of each installed vector backend at each store size, on
+    synthetic unit vectors spread over 100 tickers (store-side cost only: no encoder).
+    Each run uses a fresh temporary directory.
+
+    Returns:
+        {"dim", "queries", "results": {backend: {size: {"insert_s", "inserts_per_s",
+         "query_p50_ms", "query_p95_ms", "filtered_p95_ms"}}}}
+    """
+    import shutil
+    import tempfile
+
+    import numpy as np
+
+    def unit(x: Any) -> Any:
+        x = x.astype("float32")
+        return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+    def latencies(run: Callable[[Any], Any], probes: Any) -> List[float]:
+        timings = []
+        for vec in probes:
+            t0 = time.perf_counter()
+            run(vec)
+            timings.append((time.perf_counter() - t0) * 1000)
+        return sorted(timings)
+
+    def pct(timings: List[float], q: float) -> float:
+        return round(timings[int(q * (len(timings) - 1))], 2)
+
+    backends = (["chroma"] if CHROMA_AVAILABLE else []) + (["numpy"] if NUMPY_AVAILABLE else [])
+    rng = np.random.default_rng(0)
+    probes = unit(rng.normal(size=(n_queries, dim))).tolist()
+    tickers = [f"T{i:03d}" for i in range(100)]
+    report: Dict[str, Any] = {"dim": dim, "queries": n_queries, "results": {}}
+    for backend in backends:
+        per_size: Dict[str, Any] = {}
+        for size in sizes:
+            root = tempfile.mkdtemp(prefix=f"vstore-bench-{backend}-")
+            try:
+                col = open_vector_client(backend, root).get_or_create_collection(
+                    name="bench", embedding_function=None
+                )
+                t0 = time.perf_counter()
+                for start in range(0, size, batch):
+                    ids = range(start, min(start + batch, size))
+                    col.upsert(
+                        ids=[f"h{i}" for i in ids],
+                        documents=[f"synthetic headline {i}" for i in ids],
+                        metadatas=[{"ticker": tickers[i % len(tickers)], "sentiment": "neutral"} for i in ids],
+                        embeddings=unit(rng.normal(size=(len(ids), dim))).tolist(),
+                    )
+                insert_s = time.perf_counter() - t0
+                plain = latencies(lambda v: col.query(query_embeddings=[v], n_results=5), probes)
+                filtered = latencies(
+                    lambda v: col.query(query_embeddings=[v], n_results=5, where={"ticker": tickers[7]}), probes
+                )
+                per_size[str(size)] = {
+                    "insert_s": round(insert_s, 2),
+                    "inserts_per_s": round(size / insert_s, 1) if insert_s else None,
+                    "query_p50_ms": pct(plain, 0.5),
+                    "query_p95_ms": pct(plain, 0.95),
+                    "filtered_p95_ms": pct(filtered, 0.95),
+                }
+            except Exception as e:  # e.g. out of memory at 1M; keep the other results
+                per_size[str(size)] = {"error": str(e)}
+            finally:
+                shutil.rmtree(root, ignore_errors=True)
+            console.print(f"[muted]{backend} @ {size}: {per_size[str(size)]}[/]")
+        report["results"][backend] = per_size
+    return report
+
+
+def vstore_compaction_report() -> Dict[str, Any]:
+    """
+    Apply the vector store retention policy and measure what it bought.
+
+    Returns:
+        {"policy", "deleted", "before"/"after": {"documents", "disk_mb", "query_p95_ms"}}
+    """
+    if not VSTORE.enabled or VSTORE.col is None:
+        return {"error": "vector store unavailable"}
+    probes = embed_texts(list(_BENCH_HEADLINES))
+
+    def snapshot() -> Dict[str, Any]:
+        return {
+            "documents": VSTORE.col.count(),
+            "disk_mb": round(VSTORE.disk_bytes() / 2**20, 2),
+            "query_p95_ms": _query_p95_ms(probes),
+        }
+
+    before = snapshot()
+    deleted = VSTORE.enforce_retention()
+    after = snapshot()
+    return {
+        "policy": {"max_age_days": VSTORE.max_age_days, "max_per_ticker": VSTORE.max_per_ticker},
+        "deleted": deleted,
+        "before": before,
+        "after": after,
+        # Chroma reuses freed space rather than shrinking files right away.
+        "note": "disk_mb may only drop after Chroma vacuums its files",
+    }
+
+
+# Prompts shaped like the workflow's draft / critique / final / RAG-relabel nodes.
+_BENCH_PROMPTS = [
+    "Draft a short stock analysis for AAPL based on these headlines:\n" + "\n".join(_BENCH_HEADLINES[:5]),
+    "Act as a senior equity analyst. Provide a concise, bullet-point critique of the draft below.\n\n"
+    "=== DRAFT ===\nApple beat estimates and raised guidance; the stock looks attractive.",
+    "Rewrite the draft into a clear, neutral stock note (≤180 words), incorporating the critique.\n\n"
+    "=== DRAFT ===\nTesla faces a large recall.\n\n=== CRITIQUE ===\n- No valuation context.",
+    "Classify the SENTIMENT (positive/negative/neutral) of the HEADLINE.\n\n"
+    "HEADLINE: Intel cuts dividend amid falling PC demand",
+    "Summarize stock analysis for MSFT: cloud growth steady, margins flat, valuation rich.",
+]
+
+
+def gen_precision_report(precisions: List[str], max_new_tokens: int = 96) -> Dict[str, Any]:
+    """
+    Benchmark GEN_MODEL at each precision on the fixed prompt set.
+
+    Returns tokens/sec and output agreement against fp32 (exact-match rate and mean
+    token-level similarity), so the fastest acceptable setting can be picked per node.
+    """
+    import difflib
+
+    outputs: Dict[str, List[str]] = {}
+    report: Dict[str, Any] = {"model": GEN_MODEL, "device": DEVICE, "prompts": len(_BENCH_PROMPTS), "results": {}}
+    for precision in ["fp32"] + [p for p in precisions if p != "fp32"]:
+        role = f"gen-bench:{precision}"
+        pipe = MODELS.get("text2text-generation", GEN_MODEL, DEVICE, precision, role=role)
+        pipe(_BENCH_PROMPTS[0], max_new_tokens=8, do_sample=False)  # untimed warm-up
+        t0 = time.perf_counter()
+        texts = [
+            pipe(p, max_new_tokens=max_new_tokens, do_sample=False)[0]["generated_text"].strip()
+            for p in _BENCH_PROMPTS
+        ]
+        elapsed = time.perf_counter() - t0
+        tokens = sum(len(pipe.tokenizer(t, add_special_tokens=False)["input_ids"]) for t in texts)
+        outputs[precision] = texts
+
+        ref = outputs["fp32"]
+        ref_tok = [pipe.tokenizer.tokenize(t) for t in ref]
+        sims = [
+            difflib.SequenceMatcher(None, a, pipe.tokenizer.tokenize(b)).ratio() for a, b in zip(ref_tok, texts)
+        ]
+        report["results"][precision] = {
+            "tokens_per_s": round(tokens / elapsed, 1),
+            "seconds": round(elapsed, 2),
+            "exact_match_vs_fp32": round(sum(a == b for a, b in zip(ref, texts)) / len(texts), 3),
+            "token_similarity_vs_fp32": round(sum(sims) / len(sims), 3),
+        }
+        MODELS.release(role)  # one precision in memory at a time
+    return report
+
+
+# Root package -> subsystem, for grouping `-X importtime` output.
+_IMPORT_SUBSYSTEMS = {
+    "models": ("torch", "transformers", "sentence_transformers", "tokenizers", "safetensors",
+               "huggingface_hub", "optimum", "onnxruntime", "onnx", "sympy"),
+    "vector-db": ("chromadb", "faiss", "hnswlib", "sqlite3"),
+    "plotting": ("matplotlib", "PIL", "wordcloud", "kiwisolver", "fontTools"),
+    "workflow": ("langgraph", "langchain", "langchain_core", "langsmith", "langchain_community"),
+    "mcp-server": ("fastmcp", "mcp", "starlette", "uvicorn", "pydantic", "pydantic_core", "httpx",
+                   "httpcore", "anyio", "sse_starlette", "authlib", "openapi_pydantic", "cyclopts"),
+    "market-data": ("yfinance", "pandas", "feedparser", "requests", "urllib3", "bs4", "lxml", "numpy",
+                    "curl_cffi", "peewee"),
+    "cli": ("rich", "pygments", "markdown_it"),
+}
+
+
+def profile_startup(script: str) -> Dict[str, Any]:
+    """
+    Import `script` (without running its __main__ block) under `python -X importtime`
+    and group the per-module self time by subsystem.
+
+    Returns:
+        {"script", "wall_s", "subsystems": {name: {"ms", "modules", "top": [[package, ms], ...]}}}
+    """
+    import subprocess
+
+    code = f"import runpy; runpy.run_path({os.path.abspath(script)!r})"
+    t0 = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(script))
+    )
+    wall = time.perf_counter() - t0
+
+    owner = {pkg: name for name, pkgs in _IMPORT_SUBSYSTEMS.items() for pkg in pkgs}
+    per_pkg: Dict[str, float] = {}
+    modules: Dict[str, int] = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, _cumulative, name = (part.strip() for part in line[len("import time:"):].split("|", 2))
+        if not self_us.isdigit():  # header row
+            continue
+        root = name.split(".")[0]
+        per_pkg[root] = per_pkg.get(root, 0.0) + int(self_us) / 1000
+        modules[root] = modules.get(root, 0) + 1
+
+    groups: Dict[str, Dict[str, Any]] = {}
+    for pkg, ms in per_pkg.items():
+        g = groups.setdefault(owner.get(pkg, "stdlib/other"), {"ms": 0.0, "modules": 0, "top": []})
+        g["ms"] += ms
+        g["modules"] += modules[pkg]
+        g["top"].append([pkg, round(ms, 1)])
+    for g in groups.values():
+        g["ms"] = round(g["ms"], 1)
+        g["top"] = sorted(g["top"], key=lambda x: -x[1])[:3]
+    if proc.returncode != 0:
+        console.print(f"[warn] import of {script} failed:\n{proc.stderr.splitlines()[-1] if proc.stderr else ''}")
+    return {
+        "script": script,
+        "wall_s": round(wall, 2),
+        "subsystems": dict(sorted(groups.items(), key=lambda kv: -kv[1]["ms"])),
+    }
+
+
+def render_startup_profile(profile: Dict[str, Any]) -> Table:
+    table = Table(title=f"Import time • {profile['script']} (wall {profile['wall_s']:.2f}s)", box=box.SIMPLE_HEAVY)
+    table.add_column("Subsystem", style="accent")
+    table.add_column("Self ms", justify="right")
+    table.add_column("Modules", justify="right", style="muted")
+    table.add_column("Heaviest packages")
+    for name, g in profile["subsystems"].items():
+        top = ", ".join(f"{pkg} {ms:.0f}ms" for pkg, ms in g["top"])
+        table.add_row(name, f"{g['ms']:,.1f}", str(g["modules"]), top)
+    return table
+
 
 # ===========================
 # Entrypoint
@@ -799,13 +3982,18 @@ if __name__ == "__main__":
     if len(sys.argv) > 1 and sys.argv[1].lower() == "agentic":
         companies = ["AAPL", "TSLA", "MSFT", "GOOGL", "AMZN"]
         results: Dict[str, Dict[str, Any]] = {}
+        # Classify every ticker's headlines up front in one batched pass.
+        prefetched = prefetch_portfolio(companies, max_headlines=5)
         for ticker in companies:
             try:
-                results[ticker] = _analyze_stock_impl(ticker, max_headlines=5)
+                results[ticker] = _analyze_stock_impl(ticker, max_headlines=5, prefetched=prefetched[ticker])
             except Exception as e:  # pragma: no cover
                 results[ticker] = {"error": str(e)}
                 console.print(f"[err][ERROR][/err] {ticker} -> {e}")
 
+        # Land the queued vector store writes before reporting.
+        VSTORE.flush()
+
         # Pretty portfolio recommendations table
         console.rule("[accent]RECOMMENDATIONS")
         console.print(render_portfolio_summary(results))
@@ -814,8 +4002,56 @@ if __name__ == "__main__":
         console.rule("[accent]RAW RESULTS (JSON)")
         console.print_json(data=results, indent=2, sort_keys=True, ensure_ascii=False)
 
+    elif len(sys.argv) > 1 and sys.argv[1].lower() == "profile-startup":
+        # python server_mcp_rag.py profile-startup [path/to/server.py]
+        target = sys.argv[2] if len(sys.argv) > 2 else __file__
+        console.print(render_startup_profile(profile_startup(target)))
+
+    elif len(sys.argv) > 1 and sys.argv[1].lower() == "gen-bench":
+        # python server_mcp_rag.py gen-bench [fp32,bf16,dynamic-int8]
+        wanted = sys.argv[2].lower().split(",") if len(sys.argv) > 2 else list(GEN_PRECISIONS)
+        console.print_json(data=gen_precision_report(wanted), indent=2, ensure_ascii=False)
+
+    elif len(sys.argv) > 1 and sys.argv[1].lower() == "train-head":
+        # python server_mcp_rag.py train-head [path/to/head.npz]
+        target = sys.argv[2] if len(sys.argv) > 2 else SENTIMENT_HEAD_PATH
+        console.print_json(data=train_sentiment_head(target), indent=2, ensure_ascii=False)
+
+    elif len(sys.argv) > 1 and sys.argv[1].lower() == "vstore-migrate-ids":
+        # python server_mcp_rag.py vstore-migrate-ids
+        console.print_json(data=VSTORE.migrate_ids(), indent=2, ensure_ascii=False)
+
+    elif len(sys.argv) > 1 and sys.argv[1].lower() == "vstore-compact":
+        # python server_mcp_rag.py vstore-compact
+        console.print_json(data=vstore_compaction_report(), indent=2, ensure_ascii=False)
+
+    elif len(sys.argv) > 1 and sys.argv[1].lower() == "vstore-partition":
+        # python server_mcp_rag.py vstore-partition   (then run with VSTORE_PARTITION=ticker)
+        console.print_json(data=VSTORE.partition_store(), indent=2, ensure_ascii=False)
+
+    elif len(sys.argv) > 1 and sys.argv[1].lower() == "vstore-bench":
+        # python server_mcp_rag.py vstore-bench [10000,100000,1000000]
+        sizes = [int(x) for x in sys.argv[2].split(",")] if len(sys.argv) > 2 else [10_000, 100_000, 1_000_000]
+        console.print_json(data=vstore_bench_report(sizes), indent=2, ensure_ascii=False)
+
+    elif len(sys.argv) > 1 and sys.argv[1].lower() == "knn-eval":
+        # python server_mcp_rag.py knn-eval [max_documents]
+        limit = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+        console.print_json(data=knn_eval_report(limit), indent=2, ensure_ascii=False)
+
+    elif len(sys.argv) > 1 and sys.argv[1].lower() == "onnx-parity":
+        # python server_mcp_rag.py onnx-parity [onnx|onnx-int8]
+        variant = sys.argv[2].lower() if len(sys.argv) > 2 else "onnx-int8"
+        console.print_json(data=onnx_parity_report(variant), indent=2, ensure_ascii=False)
+
     else:
         transport = (sys.argv[1] if len(sys.argv) > 1 else "stdio").lower()
+        console.print(f"[muted]RSS at startup: {_rss_mb():.0f} MiB (models load on first use)[/]")
+        if transport in ("http", "sse"):  # pragma: no cover
+            # Load balancers route to /health/ready, which flips once this finishes.
+            WARMUP.start()
+            # Concurrent requests share the generator: batch their calls together.
+            BATCHER.activate()
         if transport == "http":  # pragma: no cover
             host = os.getenv("HOST", "0.0.0.0")
             port = int(os.getenv("PORT", "8000"))
@@ -0,0 +1,199 @@
+"""
+Round-trip tests for the pieces of server_mcp_rag.py that persist state on their own:
+the in-process NumPy vector backend, VectorStore.migrate_ids and EmbeddingCache.
+
+No model is loaded: `embed_texts` is replaced by a deterministic hash embedding.
+"""
+
+import hashlib
+
+import numpy as np
+import pytest
+
+import server_mcp_rag as srv
+
+DIM = 8
+
+
+def fake_embed(texts):
+    rows = [np.frombuffer(hashlib.sha256(t.encode("utf-8")).digest()[:DIM], dtype=np.uint8) for t in texts]
+    return np.asarray(rows, dtype="float32").reshape(len(texts), DIM) / 255.0
+
+
+@pytest.fixture(autouse=True)
+def no_models(monkeypatch):
+    monkeypatch.setattr(srv, "embed_texts", fake_embed)
+
+
+def unit(i, dim=DIM):
+    v = np.zeros(dim, dtype="float32")
+    v[i] = 1.0
+    return v
+
+
+# ----- NumpyCollection / NumpyVectorClient -----
+def make_collection(tmp_path, name="news"):
+    client = srv.NumpyVectorClient(str(tmp_path))
+    return client, client.get_or_create_collection(name=name, embedding_function=fake_embed)
+
+
+def test_upsert_get_query_round_trip(tmp_path):
+    _, col = make_collection(tmp_path)
+    col.upsert(
+        ids=["a", "b", "c"],
+        documents=["doc a", "doc b", "doc c"],
+        metadatas=[{"ticker": "AAPL"}, {"ticker": "MSFT"}, {"ticker": "AAPL"}],
+        embeddings=[unit(0), unit(1), unit(2)],
+    )
+    assert col.count() == 3
+
+    got = col.get(ids=["c", "missing", "a"], include=["metadatas", "embeddings"])
+    assert got["ids"] == ["c", "a"]
+    assert got["documents"] == ["doc c", "doc a"]
+    np.testing.assert_allclose(got["embeddings"][0], unit(2))
+
+    res = col.query(query_embeddings=[unit(0)], n_results=2)
+    assert res["ids"] == [["a", "b"]]
+    assert res["distances"][0] == pytest.approx([0.0, 2.0])  # squared L2, as in Chroma
+
+    res = col.query(query_embeddings=[unit(1)], n_results=5, where={"ticker": "AAPL"})
+    assert sorted(res["ids"][0]) == ["a", "c"]
+    assert col.query(query_embeddings=[unit(1)], n_results=5, where={"ticker": "TSLA"})["ids"] == [[]]
+
+
+def test_upsert_replaces_document_and_ticker(tmp_path):
+    _, col = make_collection(tmp_path)
+    col.upsert(ids=["a"], documents=["old"], metadatas=[{"ticker": "AAPL"}], embeddings=[unit(0)])
+    col.upsert(ids=["a", "a"], documents=["x", "new"], metadatas=[{"ticker": "X"}, {"ticker": "MSFT"}],
+               embeddings=[unit(3), unit(1)])
+    assert col.count() == 1
+    assert col.get(ids=["a"])["documents"] == ["new"]  # last write in a batch wins
+    assert col.query(query_embeddings=[unit(1)], n_results=1, where={"ticker": "AAPL"})["ids"] == [[]]
+    res = col.query(query_embeddings=[unit(1)], n_results=1, where={"ticker": "MSFT"})
+    assert res["ids"] == [["a"]] and res["distances"][0] == pytest.approx([0.0])
+
+
+def test_upsert_without_embeddings_uses_embedding_function(tmp_path):
+    _, col = make_collection(tmp_path)
+    col.upsert(ids=["a"], documents=["some headline"], metadatas=[{"ticker": "AAPL"}])
+    res = col.query(query_texts=["some headline"], n_results=1)
+    assert res["ids"] == [["a"]] and res["distances"][0][0] == pytest.approx(0.0, abs=1e-5)
+
+
+def test_delete_keeps_rows_and_filters_consistent(tmp_path):
+    _, col = make_collection(tmp_path)
+    ids = [f"id{i}" for i in range(6)]
+    col.upsert(
+        ids=ids,
+        documents=[f"doc {i}" for i in range(6)],
+        metadatas=[{"ticker": "AAPL" if i % 2 else "MSFT"} for i in range(6)],
+        embeddings=[unit(i) for i in range(6)],
+    )
+    col.delete(ids=["id1", "id5", "nope"])  # id5 is the last row, id1 is swapped with it
+    assert col.count() == 4
+    assert sorted(col.get()["ids"]) == ["id0", "id2", "id3", "id4"]
+    for i in (0, 2, 3, 4):
+        res = col.query(query_embeddings=[unit(i)], n_results=1)
+        assert res["ids"] == [[f"id{i}"]] and res["documents"] == [[f"doc {i}"]]
+    res = col.query(query_embeddings=[unit(3)], n_results=5, where={"ticker": "AAPL"})
+    assert res["ids"] == [["id3"]]
+
+
+def test_reload_from_disk(tmp_path):
+    client, col = make_collection(tmp_path)
+    col.upsert(ids=["a", "b", "c"], documents=["A", "B", "C"],
+               metadatas=[{"ticker": "AAPL", "n": 1}, {"ticker": "MSFT"}, {"ticker": "AAPL"}],
+               embeddings=[unit(0), unit(1), unit(2)])
+    col.delete(ids=["b"])
+    client.get_or_create_collection(name="other").upsert(
+        ids=["z"], documents=["Z"], metadatas=[{"ticker": "TSLA"}], embeddings=[unit(4)]
+    )
+
+    reopened = srv.NumpyVectorClient(str(tmp_path))
+    assert sorted(reopened.list_collections()) == ["news", "other"]
+    col2 = reopened.get_collection(name="news", embedding_function=fake_embed)
+    assert col2.count() == 2
+    assert col2.get(ids=["a"])["metadatas"] == [{"ticker": "AAPL", "n": 1}]
+    res = col2.query(query_embeddings=[unit(2)], n_results=1, where={"ticker": "AAPL"})
+    assert res["ids"] == [["c"]]
+
+    reopened.delete_collection(name="other")
+    assert srv.NumpyVectorClient(str(tmp_path)).list_collections() == ["news"]
+    with pytest.raises(ValueError):
+        reopened.get_collection(name="other")
+
+
+# ----- VectorStore.migrate_ids -----
+def test_migrate_ids_collapses_duplicates(tmp_path):
+    store = srv.VectorStore(path=str(tmp_path), backend="numpy")
+    assert store.enabled and store.backend_name == "numpy"
+    seeds = store.col.count()
+    store.col.upsert(
+        ids=["AAPL-2024-01-01-a", "AAPL-2024-02-01-b", "MSFT-2024-01-05-c"],
+        documents=["Apple beats estimates - Reuters", "Apple beats estimates", "Microsoft cuts jobs"],
+        metadatas=[
+            {"ticker": "AAPL", "sentiment": "neutral", "time": "2024-01-01T00:00:00"},
+            {"ticker": "AAPL", "sentiment": "positive", "time": "2024-02-01T00:00:00", "hit_count": 2},
+            {"ticker": "MSFT", "sentiment": "negative", "time": "2024-01-05T00:00:00"},
+        ],
+        embeddings=[unit(0), unit(1), unit(2)],
+    )
+
+    report = store.migrate_ids()
+    assert report["documents_before"] == seeds + 3
+    assert report["documents_after"] == seeds + 2
+    assert report["duplicates_collapsed"] == 1
+
+    apple_id = store._make_id("Apple beats estimates", {"ticker": "AAPL"})
+    got = store.col.get(ids=[apple_id], include=["metadatas", "embeddings"])
+    meta = got["metadatas"][0]
+    assert meta["sentiment"] == "positive"  # latest sighting's label
+    assert meta["first_seen"] == "2024-01-01T00:00:00"
+    assert meta["last_seen"] == meta["time"] == "2024-02-01T00:00:00"
+    assert meta["hit_count"] == 3
+    np.testing.assert_allclose(got["embeddings"][0], unit(1))
+    assert all(i.startswith("seed-") for i in store.col.get()["ids"][:seeds])
+    assert store.migrate_ids()["ids_rewritten"] == 0  # idempotent
+
+
+# ----- EmbeddingCache -----
+def test_embedding_cache_append_and_refresh(tmp_path):
+    writer = srv.EmbeddingCache(str(tmp_path), "org/model-torch")
+    reader = srv.EmbeddingCache(str(tmp_path), "org/model-torch")
+    vectors = np.arange(12, dtype="float32").reshape(3, 4)
+
+    found, missing = reader.get_many(["a", "b"])
+    assert found == [None, None] and missing == [0, 1]
+
+    writer.put_many(["a", "b", "a"], vectors)  # repeated text stored once
+    writer.put_many(["c"], vectors[2:])
+    assert writer.stats()["rows"] == 3
+
+    found, missing = reader.get_many(["c", "a", "zzz", "b"])  # picks up rows written by another instance
+    assert missing == [2]
+    np.testing.assert_array_equal(found[0], vectors[2])
+    np.testing.assert_array_equal(found[1], vectors[0])
+    np.testing.assert_array_equal(found[3], vectors[1])
+
+
+def test_embedding_cache_dtypes_do_not_share_rows(tmp_path):
+    full = srv.EmbeddingCache(str(tmp_path), "m", dtype="float32")
+    full.put_many(["a"], np.ones((1, 4)))
+    half = srv.EmbeddingCache(str(tmp_path), "m", dtype="float16")
+    assert half.get_many(["a"])[1] == [0]
+    half.put_many(["a", "b"], np.full((2, 4), 0.5))
+    found, missing = half.get_many(["a", "b"])
+    assert missing == [] and found[0].dtype == np.float32
+    np.testing.assert_array_equal(found[0], np.full(4, 0.5, dtype="float32"))
+    np.testing.assert_array_equal(srv.EmbeddingCache(str(tmp_path), "m").get_many(["a"])[0][0], np.ones(4))
+
+
+def test_embedding_cache_drops_half_written_tail(tmp_path):
+    cache = srv.EmbeddingCache(str(tmp_path), "m")
+    cache.put_many(["a"], np.ones((1, 4)))
+    with open(cache._path("vectors.float32"), "ab") as fh:  # crashed writer: vector without digest
+        fh.write(b"\x00" * 7)
+    cache.put_many(["b"], np.full((1, 4), 2.0))
+    found, missing = srv.EmbeddingCache(str(tmp_path), "m").get_many(["a", "b"])
+    assert missing == []
+    np.testing.assert_array_equal(found[1], np.full(4, 2.0, dtype="float32"))
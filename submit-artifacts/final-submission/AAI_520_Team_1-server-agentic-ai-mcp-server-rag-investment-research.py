@@ -40,16 +40,14 @@ To develop a self-reasoning, explainable AI agent that can:
 # =============================================================================
 import os
 import sys
-import faiss
 import glob
+import hashlib
+import json
+import sqlite3
+import threading
+import time
 import feedparser
-import yfinance as yf
-import numpy as np
-import matplotlib.pyplot as plt
 from datetime import datetime
-from transformers import pipeline
-from sentence_transformers import SentenceTransformer
-from langgraph.graph import StateGraph, END
 from fastmcp import FastMCP
 from rich.console import Console
 from rich.table import Table
@@ -57,6 +55,9 @@ from rich.panel import Panel
 from rich import box
 from rich.traceback import install as rich_traceback
 
+# Heavy optional subsystems (faiss, matplotlib, yfinance/pandas, langgraph and the
+# model stacks) are imported on first use so the stdio server starts quickly.
+
 # =============================================================================
 #  Global Configuration and Initialization
 # =============================================================================
@@ -69,33 +70,245 @@ CRITIC_MODEL = os.getenv("CRITIC_MODEL", GEN_MODEL)
 EMBED_MODEL = os.getenv("EMBED_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
 SENTIMENT_MODEL = os.getenv("SENTIMENT_MODEL", None)
 DEVICE = os.getenv("DEVICE", "cpu").lower()
+# Runtime for the sentiment and embedding encoders: "torch" | "onnx" | "onnx-int8"
+ENCODER_BACKEND = os.getenv("ENCODER_BACKEND", "torch").lower()
+ONNX_CACHE = os.getenv("ONNX_CACHE", "./onnx_cache")
+# Weight precision for the generator and critic: "fp32" | "bf16" | "dynamic-int8"
+GEN_PRECISION = os.getenv("GEN_PRECISION", "fp32").lower()
+if GEN_PRECISION not in ("fp32", "bf16", "dynamic-int8"):
+    raise ValueError(f"GEN_PRECISION={GEN_PRECISION!r}; expected fp32, bf16 or dynamic-int8")
 
-# ----- Pipeline Setup -----
-generator_pipeline = pipeline(
-    "text2text-generation",
-    model=GEN_MODEL,
-    device_map="auto" if DEVICE in ("cuda", "mps") else None,
-)
-critic_pipeline = pipeline(
-    "text2text-generation",
-    model=CRITIC_MODEL,
-    device_map="auto" if DEVICE in ("cuda", "mps") else None,
-)
-sentiment_pipeline = pipeline(
+# ----- Lazy Model Registry -----
+_PROCESS_T0 = time.perf_counter()
+
+
+def rss_mb():
+    """Resident set size of this process in MiB (0.0 if unavailable)."""
+    try:
+        with open("/proc/self/statm") as fh:
+            return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except Exception:
+        try:
+            import resource
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return peak / (2**20 if sys.platform == "darwin" else 2**10)
+        except Exception:
+            return 0.0
+
+
+def load_sentence_encoder(model, device):
+    """
+    Load the SentenceTransformer embedder on the configured ENCODER_BACKEND.
+
+    "onnx" serves the exported graph through ONNX Runtime; "onnx-int8" additionally
+    applies dynamic int8 quantization (exported once, cached under ONNX_CACHE).
+    """
+    from sentence_transformers import SentenceTransformer
+    if not ENCODER_BACKEND.startswith("onnx"):
+        return SentenceTransformer(model, device=device)
+    if ENCODER_BACKEND != "onnx-int8":
+        return SentenceTransformer(model, device=device, backend="onnx")
+    from sentence_transformers import export_dynamic_quantized_onnx_model
+    local_dir = os.path.join(ONNX_CACHE, model.replace("/", "__") + "-st")
+    qfile = os.path.join("onnx", "model_qint8_avx2.onnx")
+    if not os.path.exists(os.path.join(local_dir, qfile)):
+        st = SentenceTransformer(model, device=device, backend="onnx")
+        st.save(local_dir)
+        export_dynamic_quantized_onnx_model(st, "avx2", local_dir)
+    return SentenceTransformer(local_dir, device=device, backend="onnx", model_kwargs={"file_name": qfile})
+
+
+def load_generator(model, device):
+    """
+    Load the seq2seq generator in GEN_PRECISION: bf16 weights, or fp32 with every
+    nn.Linear replaced by a dynamically quantized int8 kernel (CPU only).
+    """
+    import torch
+    from transformers import AutoModelForSeq2SeqLM
+    kwargs = {"device_map": "auto"} if device in ("cuda", "mps") else {}
+    if GEN_PRECISION == "bf16":
+        kwargs["torch_dtype"] = torch.bfloat16
+    gen = AutoModelForSeq2SeqLM.from_pretrained(model, **kwargs)
+    if GEN_PRECISION == "dynamic-int8" and device == "cpu":
+        gen = torch.ao.quantization.quantize_dynamic(gen, {torch.nn.Linear}, dtype=torch.qint8)
+    return gen.eval()
+
+
+def load_onnx_classifier(model):
+    """
+    Export the sentiment classifier to ONNX (optionally dynamic-int8 quantized) and
+    return an ONNX Runtime model usable by transformers pipelines.
+    """
+    from optimum.onnxruntime import ORTModelForSequenceClassification, ORTQuantizer
+    base_dir = os.path.join(ONNX_CACHE, model.replace("/", "__"))
+    if not os.path.exists(os.path.join(base_dir, "model.onnx")):
+        ORTModelForSequenceClassification.from_pretrained(model, export=True).save_pretrained(base_dir)
+    if ENCODER_BACKEND != "onnx-int8":
+        return ORTModelForSequenceClassification.from_pretrained(base_dir)
+    int8_dir = base_dir + "-int8"
+    if not os.path.exists(os.path.join(int8_dir, "model_quantized.onnx")):
+        from optimum.onnxruntime.configuration import AutoQuantizationConfig
+        qconfig = AutoQuantizationConfig.avx2(is_static=False, per_channel=False)
+        ORTQuantizer.from_pretrained(base_dir).quantize(save_dir=int8_dir, quantization_config=qconfig)
+    return ORTModelForSequenceClassification.from_pretrained(int8_dir, file_name="model_quantized.onnx")
+
+
+class ModelRegistry:
+    """
+    Load each model the first time it is used, keyed by (task, model, device).
+
+    Nothing is downloaded or loaded at import, so an MCP client gets its stdio
+    handshake immediately; the first tool call pays the load instead. Roles asking
+    for the same key share one instance (the critic reuses the drafter when
+    CRITIC_MODEL == GEN_MODEL); `refs` counts the roles holding each model. The
+    registry records load time and RSS growth per model, and the time to first
+    handshake vs. first inference.
+    """
+
+    def __init__(self):
+        self._models = {}
+        self._roles = {}
+        self._lock = threading.Lock()
+        self.load_seconds = {}
+        self.rss_delta_mb = {}
+        self.first_handshake_s = None
+        self.first_inference_s = None
+
+    def get(self, task, model, device=DEVICE, role=None):
+        key = (task, model, device)
+        if key not in self._models:
+            with self._lock:
+                if key not in self._models:
+                    t0, rss0 = time.perf_counter(), rss_mb()
+                    self._models[key] = self._load(task, model, device)
+                    label = f"{task}:{model}@{device}"
+                    self.load_seconds[label] = round(time.perf_counter() - t0, 3)
+                    self.rss_delta_mb[label] = round(rss_mb() - rss0, 1)
+        if role is not None:
+            self._roles.setdefault(role, key)
+        return self._models[key]
+
+    def release(self, role):
+        """Drop a role's reference; the model is freed once no role uses it."""
+        with self._lock:
+            key = self._roles.pop(role, None)
+            if key is not None and key not in self._roles.values():
+                self._models.pop(key, None)
+
+    @staticmethod
+    def _load(task, model, device):
+        # Heavy imports are deferred until a model is actually needed.
+        if task == "sentence-embedding":
+            return load_sentence_encoder(model, device)
+        from transformers import pipeline
+        if task == "sentiment-analysis" and ENCODER_BACKEND.startswith("onnx"):
+            from transformers import AutoTokenizer
+            return pipeline(task, model=load_onnx_classifier(model), tokenizer=AutoTokenizer.from_pretrained(model))
+        if task == "text2text-generation" and GEN_PRECISION != "fp32":
+            return pipeline(task, model=load_generator(model, device), tokenizer=model)
+        return pipeline(task, model=model, device_map="auto" if device in ("cuda", "mps") else None)
+
+    def mark_handshake(self):
+        if self.first_handshake_s is None:
+            self.first_handshake_s = round(time.perf_counter() - _PROCESS_T0, 3)
+
+    def mark_inference(self):
+        if self.first_inference_s is None:
+            self.first_inference_s = round(time.perf_counter() - _PROCESS_T0, 3)
+
+    def report(self):
+        """Model load times plus startup milestones (seconds since import)."""
+        refs = {}
+        for task, model, device in self._roles.values():
+            label = f"{task}:{model}@{device}"
+            refs[label] = refs.get(label, 0) + 1
+        return {
+            "rss_mb": round(rss_mb(), 1),
+            "load_seconds": dict(self.load_seconds),
+            "rss_delta_mb": dict(self.rss_delta_mb),
+            "refs": refs,
+            "time_to_first_handshake_s": self.first_handshake_s,
+            "time_to_first_inference_s": self.first_inference_s,
+        }
+
+
+class LazyModel:
+    """Cheap handle that resolves its model through MODELS on first call or attribute access."""
+
+    def __init__(self, role, task, model, device=DEVICE):
+        self.role, self.task, self.model_name, self.device = role, task, model, device
+
+    def load(self):
+        return MODELS.get(self.task, self.model_name, self.device, role=self.role)
+
+    def __call__(self, *args, **kwargs):
+        out = self.load()(*args, **kwargs)
+        MODELS.mark_inference()
+        return out
+
+    def encode(self, *args, **kwargs):
+        out = self.load().encode(*args, **kwargs)
+        MODELS.mark_inference()
+        return out
+
+    def __getattr__(self, name):
+        return getattr(self.load(), name)
+
+
+MODELS = ModelRegistry()
+
+# ----- Pipeline Setup (lazy) -----
+generator_pipeline = LazyModel("generator", "text2text-generation", GEN_MODEL)
+critic_pipeline = LazyModel("critic", "text2text-generation", CRITIC_MODEL)
+sentiment_pipeline = LazyModel(
+    "sentiment",
     "sentiment-analysis",
-    model=SENTIMENT_MODEL or "distilbert/distilbert-base-uncased-finetuned-sst-2-english",
+    SENTIMENT_MODEL or "distilbert/distilbert-base-uncased-finetuned-sst-2-english",
 )
-embed_model = SentenceTransformer(EMBED_MODEL)
+embed_model = LazyModel("embed", "sentence-embedding", EMBED_MODEL)
 
 # MCP server initialization
 mcp = FastMCP("investment-agentic-rag-visual")
 
+try:
+    from fastmcp.server.middleware import Middleware
+
+    class _HandshakeTimer(Middleware):
+        """Record when the first MCP message (the handshake) arrives."""
+
+        async def on_message(self, context, call_next):
+            MODELS.mark_handshake()
+            return await call_next(context)
+
+    mcp.add_middleware(_HandshakeTimer())
+except Exception:  # older fastmcp without middleware support
+    pass
+
 # =============================================================================
 #  RAG and FAISS Configuration
 # =============================================================================
 FAISS_INDEX_PATH = "rag_index.faiss"
 DOCS_PATH = "./docs"
 EMBED_DIM = 384  # Dimension for all-MiniLM-L6-v2 embeddings
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+
+
+def embed_texts(texts):
+    """
+    Embed texts in batches of EMBED_BATCH_SIZE.
+
+    SentenceTransformer tokenizes each (length-sorted) batch, runs one forward pass
+    and applies the model's attention-masked mean pooling and normalization.
+
+    Returns:
+        C-contiguous float32 array [len(texts), EMBED_DIM], the layout FAISS expects.
+    """
+    import numpy as np
+    vecs = embed_model.encode(
+        list(texts), batch_size=EMBED_BATCH_SIZE, convert_to_numpy=True, show_progress_bar=False
+    )
+    return np.ascontiguousarray(vecs, dtype="float32")
+
 
 def build_faiss_index():
     """
@@ -109,6 +322,8 @@ def build_faiss_index():
         index (faiss.IndexFlatL2): FAISS index object
         doc_chunks (list[str]): Document chunks mapped to embeddings
     """
+    import faiss
+
     index = faiss.IndexFlatL2(EMBED_DIM)
     doc_chunks = []
 
@@ -122,19 +337,34 @@ def build_faiss_index():
         console.print("[yellow]No text files found. FAISS index remains empty.[/]")
         return index, doc_chunks
 
-    # Iterate through local files and embed in chunks
+    # Chunk every local file, then embed all chunks in full batches and add them at once
     for fpath in text_files:
         with open(fpath, "r", encoding="utf-8", errors="ignore") as f:
             content = f.read()
-        chunks = [content[i:i+500] for i in range(0, len(content), 500)]
-        emb = embed_model.encode(chunks, convert_to_numpy=True)
-        index.add(emb)
-        doc_chunks.extend(chunks)
+        doc_chunks.extend(content[i:i+500] for i in range(0, len(content), 500))
+    if doc_chunks:
+        index.add(embed_texts(doc_chunks))
 
     console.print(f"[green]FAISS index built with {len(doc_chunks)} chunks from {len(text_files)} files.[/]")
     return index, doc_chunks
 
-FAISS_INDEX, DOC_TEXTS = build_faiss_index()
+FAISS_INDEX, DOC_TEXTS = None, []
+_FAISS_LOCK = threading.Lock()
+
+
+def get_faiss_index():
+    """
+    Build the FAISS index on first use (embedding ./docs needs the embedding model).
+
+    Returns:
+        (index, doc_chunks) as produced by build_faiss_index()
+    """
+    global FAISS_INDEX, DOC_TEXTS
+    if FAISS_INDEX is None:
+        with _FAISS_LOCK:
+            if FAISS_INDEX is None:
+                FAISS_INDEX, DOC_TEXTS = build_faiss_index()
+    return FAISS_INDEX, DOC_TEXTS
 
 def retrieve_docs(query: str, k: int = 3):
     """
@@ -147,15 +377,21 @@ def retrieve_docs(query: str, k: int = 3):
     Returns:
         list[str]: Retrieved document texts providing additional context
     """
-    if FAISS_INDEX.ntotal == 0:
+    index, doc_texts = get_faiss_index()
+    if index.ntotal == 0:
         return []
-    q_vec = embed_model.encode([query], convert_to_numpy=True)
-    D, I = FAISS_INDEX.search(q_vec, k)
-    return [DOC_TEXTS[i] for i in I[0] if i < len(DOC_TEXTS)]
+    q_vec = embed_texts([query])
+    D, I = index.search(q_vec, k)
+    return [doc_texts[i] for i in I[0] if i < len(doc_texts)]
 
 # =============================================================================
 #  Visualization Utilities
 # =============================================================================
+def pyplot():
+    """Import matplotlib.pyplot on first use (only chart rendering needs it)."""
+    import matplotlib.pyplot as plt
+    return plt
+
 def ensure_dir(path="visuals"):
     """Ensure the output directory exists for visual charts."""
     if not os.path.exists(path):
@@ -170,6 +406,7 @@ def plot_price_chart(ticker: str, history: dict):
         ticker (str): Stock symbol
         history (dict): Dictionary with 'Date' and 'Close' lists
     """
+    plt = pyplot()
     path = ensure_dir()
     plt.figure(figsize=(6, 3))
     plt.plot(history["Date"], history["Close"], linewidth=2)
@@ -195,6 +432,7 @@ def plot_sentiment_chart(ticker: str, sentiments: list):
     for s in sentiments:
         counts[s["sentiment"]] = counts.get(s["sentiment"], 0) + 1
     labels, vals = list(counts.keys()), list(counts.values())
+    plt = pyplot()
     path = ensure_dir()
     plt.figure(figsize=(4, 4))
     plt.pie(vals, labels=labels, autopct="%1.0f%%", colors=["green", "red", "gray"])
@@ -212,6 +450,7 @@ def fetch_stock_data(ticker: str):
     Fetch stock history and price statistics from Yahoo Finance.
     """
     try:
+        import yfinance as yf
         stock = yf.Ticker(ticker)
         hist = stock.history(period="1y")
         if hist.empty:
@@ -227,6 +466,7 @@ def fetch_stock_data(ticker: str):
 def fetch_pe_ratio(ticker: str):
     """Fetch the stock’s price-to-earnings (P/E) ratio."""
     try:
+        import yfinance as yf
         return float(yf.Ticker(ticker).info.get("trailingPE", "N/A"))
     except Exception:
         return "N/A"
@@ -236,13 +476,135 @@ def fetch_news(ticker: str, max_headlines: int = 5):
     feed = feedparser.parse(f"https://news.google.com/rss/search?q={ticker}+stock")
     return [{"title": e.title, "link": e.link} for e in feed.entries[:max_headlines]]
 
-def analyze_sentiment(news: list):
-    """Perform sentiment classification on news headlines."""
-    result = []
-    for n in news:
-        sentiment = sentiment_pipeline(n["title"])[0]
-        result.append({"title": n["title"], "sentiment": sentiment["label"].lower(), "score": sentiment["score"]})
-    return result
+SENTIMENT_BATCH_SIZE = int(os.getenv("SENTIMENT_BATCH_SIZE", "32"))
+
+
+def analyze_sentiment(news: list, batch_size: int = SENTIMENT_BATCH_SIZE):
+    """
+    Perform sentiment classification on news headlines.
+
+    Headlines are sorted by length and classified in batches (little padding, one
+    forward pass per batch instead of one per headline). If a batch fails, its
+    headlines are retried one by one so only the bad one raises.
+    """
+    titles = [n["title"] for n in news]
+    labels = [None] * len(titles)
+    order = sorted(range(len(titles)), key=lambda i: len(titles[i]))
+    for start in range(0, len(order), max(1, batch_size)):
+        bucket = order[start:start + batch_size]
+        try:
+            outs = sentiment_pipeline([titles[i] for i in bucket], batch_size=len(bucket))
+        except Exception:
+            outs = [sentiment_pipeline(titles[i])[0] for i in bucket]
+        for i, out in zip(bucket, outs):
+            labels[i] = out
+    return [{"title": t, "sentiment": s["label"].lower(), "score": s["score"]} for t, s in zip(titles, labels)]
+
+# =============================================================================
+#  Deterministic Generation Cache
+# =============================================================================
+def _transformers_version():
+    # read from package metadata (transformers itself is not imported)
+    try:
+        from importlib.metadata import version
+        return version("transformers")
+    except Exception:
+        return "unknown"
+
+
+TRANSFORMERS_VERSION = _transformers_version()
+
+
+class GenerationCache:
+    """
+    Persistent, content-addressed cache for greedy generations (SQLite, LRU-bounded).
+
+    Generation is deterministic here, so output depends only on the model version,
+    the prompt and max_new_tokens. The key includes the model id, GEN_PRECISION,
+    GEN_MODEL_REVISION and the transformers version, so swapping GEN_MODEL simply
+    stops hitting old entries, which then age out through LRU eviction.
+
+    The cache is best effort: any SQLite error is logged and treated as a miss
+    (or a skipped write), so a broken cache never fails a generation.
+    """
+
+    def __init__(self, path, max_entries):
+        self.path, self.max_entries = path, max_entries
+        self.hits = self.misses = self.evictions = 0
+        self._db = None
+        self._lock = threading.Lock()
+
+    def _conn(self):
+        if self._db is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA busy_timeout=5000")
+            db.execute("CREATE TABLE IF NOT EXISTS generations "
+                       "(key TEXT PRIMARY KEY, value TEXT NOT NULL, accessed REAL NOT NULL)")
+            db.execute("CREATE INDEX IF NOT EXISTS generations_accessed ON generations(accessed)")
+            self._db = db  # only once fully set up, so a failed open is retried
+        return self._db
+
+    @staticmethod
+    def key(model, prompt, max_new_tokens):
+        parts = [model, GEN_PRECISION, os.getenv("GEN_MODEL_REVISION", "main"), TRANSFORMERS_VERSION,
+                 prompt, max_new_tokens]
+        return hashlib.sha256(json.dumps(parts, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        if self.max_entries <= 0:
+            return None
+        try:
+            with self._lock:
+                row = self._conn().execute("SELECT value FROM generations WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    self.misses += 1
+                    return None
+                self._db.execute("UPDATE generations SET accessed = ? WHERE key = ?", (time.time(), key))
+                self.hits += 1
+                return json.loads(row[0])
+        except Exception as e:  # a broken cache must never break a generation
+            console.print(f"[warn] Generation cache read failed: {e}")
+            return None
+
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        try:
+            with self._lock:
+                db = self._conn()
+                db.execute("INSERT OR REPLACE INTO generations (key, value, accessed) VALUES (?, ?, ?)",
+                           (key, json.dumps(value, ensure_ascii=False), time.time()))
+                (count,) = db.execute("SELECT COUNT(*) FROM generations").fetchone()
+                if count > self.max_entries:
+                    db.execute("DELETE FROM generations WHERE key IN "
+                               "(SELECT key FROM generations ORDER BY accessed ASC LIMIT ?)",
+                               (count - self.max_entries,))
+                    self.evictions += count - self.max_entries
+        except Exception as e:
+            console.print(f"[warn] Generation cache write failed: {e}")
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None}
+
+
+GEN_CACHE = GenerationCache(
+    os.getenv("GEN_CACHE_PATH", "./cache/generations.sqlite"),
+    int(os.getenv("GEN_CACHE_MAX_ENTRIES", "20000")),
+)
+
+
+def generate(pipe, model, prompt, max_new_tokens):
+    """Run `pipe` on `prompt` (greedy), answering from GEN_CACHE when possible."""
+    key = GEN_CACHE.key(model, prompt, max_new_tokens)
+    text = GEN_CACHE.get(key)
+    if text is None:
+        text = pipe(prompt, max_new_tokens=max_new_tokens)[0]["generated_text"]
+        GEN_CACHE.put(key, text)
+    return text
 
 # =============================================================================
 #  LangGraph Agentic Workflow Definition
@@ -253,6 +615,8 @@ def build_graph(ticker: str, max_headlines: int = 5):
         1. Fetch → 2. Sentiment → 3. Draft → 4. Reasoning (RAG) →
         5. Critique → 6. Final Summary (with visualization)
     """
+    from langgraph.graph import StateGraph, END
+
     g = StateGraph(dict)
 
     def fetch_node(s):
@@ -268,23 +632,23 @@ def build_graph(ticker: str, max_headlines: int = 5):
 
     def draft_node(s):
         text = "\n".join([n["title"] for n in s["news"]])
-        s["draft"] = generator_pipeline(f"Draft stock analysis for {ticker}:\n{text}", max_new_tokens=180)[0]["generated_text"]
+        s["draft"] = generate(generator_pipeline, GEN_MODEL, f"Draft stock analysis for {ticker}:\n{text}", 180)
         return s
 
     def reasoning_node(s):
         draft = s.get("draft", "")
         context = "\n".join(retrieve_docs(draft))
         prompt = f"Refine reasoning for {ticker} using context:\n{context}\n\nDraft:\n{draft}"
-        s["reasoning"] = generator_pipeline(prompt, max_new_tokens=150)[0]["generated_text"]
+        s["reasoning"] = generate(generator_pipeline, GEN_MODEL, prompt, 150)
         return s
 
     def critique_node(s):
-        s["critique"] = critic_pipeline(f"Critique this reasoning:\n{s.get('reasoning', '')}", max_new_tokens=100)[0]["generated_text"]
+        s["critique"] = generate(critic_pipeline, CRITIC_MODEL, f"Critique this reasoning:\n{s.get('reasoning', '')}", 100)
         return s
 
     def final_node(s):
         final_prompt = f"Summarize stock analysis for {ticker}:\n{s.get('critique', '')}"
-        s["final"] = generator_pipeline(final_prompt, max_new_tokens=150)[0]["generated_text"]
+        s["final"] = generate(generator_pipeline, GEN_MODEL, final_prompt, 150)
 
         sentiments = s.get("sentiment", [])
         pos = sum(1 for x in sentiments if x["sentiment"] == "positive")
@@ -317,6 +681,70 @@ def build_graph(ticker: str, max_headlines: int = 5):
     g.add_edge("final", END)
     return g.compile()
 
+# =============================================================================
+#  Warm-up and Health Probes
+# =============================================================================
+class Warmup:
+    """
+    Background warm-up that loads every model and the FAISS index and runs one
+    dummy inference through each. `ready` flips only when all steps have run;
+    per-step latency (and any error) is reported by the readiness probe.
+    """
+
+    def __init__(self):
+        self.started = False
+        self.ready = False
+        self.latency_s = {}
+        self.errors = {}
+
+    def run(self):
+        steps = [
+            ("sentiment", lambda: sentiment_pipeline("Shares rose after earnings.")),
+            ("embed", lambda: embed_texts(["warm-up"])),
+            ("generator", lambda: generator_pipeline("Say OK.", max_new_tokens=4)),
+            ("critic", lambda: critic_pipeline("Say OK.", max_new_tokens=4)),
+            ("faiss_index", get_faiss_index),
+        ]
+        for name, step in steps:
+            t0 = time.perf_counter()
+            try:
+                step()
+            except Exception as e:
+                self.errors[name] = str(e)
+                console.print(f"[yellow]Warm-up step '{name}' failed: {e}[/]")
+            self.latency_s[name] = round(time.perf_counter() - t0, 3)
+        self.ready = True
+        console.print("[green]Warm-up complete.[/]")
+
+    def start(self):
+        """Run the warm-up on a daemon thread (idempotent)."""
+        if not self.started:
+            self.started = True
+            threading.Thread(target=self.run, name="warmup", daemon=True).start()
+
+    def report(self):
+        return {"started": self.started, "ready": self.ready,
+                "latency_s": dict(self.latency_s), "errors": dict(self.errors)}
+
+
+WARMUP = Warmup()
+
+try:
+    from starlette.responses import JSONResponse, PlainTextResponse
+
+    @mcp.custom_route("/health/live", methods=["GET"])
+    async def health_live(_request):
+        """Liveness probe: the HTTP server is up (models may still be loading)."""
+        return PlainTextResponse("OK")
+
+    @mcp.custom_route("/health/ready", methods=["GET"])
+    async def health_ready(_request):
+        """Readiness probe: 503 until warm-up has finished, then 200 with per-model latency."""
+        report = WARMUP.report()
+        return JSONResponse(report, status_code=200 if report["ready"] else 503)
+except Exception:  # Starlette is only needed for network transports
+    pass
+
 # =============================================================================
 #  Execution and MCP Integration
 # =============================================================================
@@ -343,6 +771,11 @@ def mcp_analyze_stock(ticker: str, max_headlines: int = 5):
     """MCP entrypoint for integration with LangGraph and FastMCP protocol."""
     return analyze_stock(ticker, max_headlines)
 
+@mcp.tool
+def mcp_server_stats():
+    """MCP entrypoint reporting model load times, warm-up state and startup latency."""
+    return {"models": MODELS.report(), "warmup": WARMUP.report(), "generation_cache": GEN_CACHE.stats()}
+
 # =============================================================================
 #  Entrypoint
 # =============================================================================
@@ -359,5 +792,8 @@ if __name__ == "__main__":
             analyze_stock(t)
     else:
         transport = (sys.argv[1] if len(sys.argv) > 1 else "stdio").lower()
+        console.print(f"[grey66]RSS at startup: {rss_mb():.0f} MiB (models load on first use)[/]")
+        if transport in ("http", "sse", "streamable-http"):
+            WARMUP.start()  # /health/ready flips once this finishes
         mcp.run(transport=transport)
 